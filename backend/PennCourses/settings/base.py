@@ -172,11 +172,64 @@ OPEN_DATA_API_BASE = "https://3scale-public-prod-open-data.apps.k8s.upenn.edu/ap
 WEBHOOK_USERNAME = os.environ.get("WEBHOOK_USERNAME", "webhook")
 WEBHOOK_PASSWORD = os.environ.get("WEBHOOK_PASSWORD", "password")
 
+# If enabled, the course status webhook only authenticates and validates each request and
+# appends it to a durable Redis stream (acknowledging it immediately); the updates are then
+# applied by Celery workers (see alert/webhook_queue.py)
+WEBHOOK_QUEUE_ENABLED = os.environ.get("WEBHOOK_QUEUE_ENABLED", "false").lower() == "true"
+WEBHOOK_QUEUE_PARTITIONS = 8  # Updates for the same section always go to the same partition
+WEBHOOK_QUEUE_MAXLEN = 1000000  # Approximate number of entries retained per partition for replay
+# A partition's process_webhook_queue task is scheduled again by the next update if it hasn't
+# started draining within this many seconds (e.g. if the task was lost)
+WEBHOOK_QUEUE_SCHEDULED_TIMEOUT = 600
+# An entry that fails to apply is retried after this many seconds, and is moved to its
+# partition's dead-letter stream once it has been delivered this many times
+WEBHOOK_QUEUE_RETRY_DELAY = 60
+WEBHOOK_QUEUE_MAX_DELIVERIES = 5
+
+# If enabled, the raw webhook request bodies of new StatusUpdate objects are stored compressed
+# and deduplicated in a side table (see courses.models.StatusUpdateRequestBody)
+STATUS_UPDATE_COMPACT_REQUEST_BODIES = (
+    os.environ.get("STATUS_UPDATE_COMPACT_REQUEST_BODIES", "false").lower() == "true"
+)
+
 # Email Configuration
 SMTP_HOST = os.environ.get("SMTP_HOST", "")
 SMTP_PORT = os.environ.get("SMTP_PORT", 587)
 SMTP_USERNAME = os.environ.get("SMTP_USERNAME", "")
 SMTP_PASSWORD = os.environ.get("SMTP_PASSWORD", "")
+SMTP_USE_TLS = True
+SMTP_TIMEOUT = 30  # seconds
+# Emails are sent through a per-process pool of persistent SMTP connections
+# (see alert/alerts.py)
+SMTP_POOL_SIZE = 4  # The maximum number of open SMTP connections per process
+SMTP_POOL_MAX_MESSAGES_PER_CONNECTION = 100  # Reconnect after sending this many messages
+SMTP_POOL_IDLE_TIMEOUT = 60  # Close connections that have been idle for this many seconds
+
+# The channels (text, email, push notification) of an alert are sent concurrently on a pool of
+# this many threads per process, and an alert through a channel that doesn't finish within
+# the channel's timeout (in seconds) is treated as an error (see alert/alerts.py)
+ALERT_CHANNEL_THREADS = 8
+ALERT_CHANNEL_TIMEOUTS = {"text": 10, "email": 30, "push": 10}
+
+# If enabled, alerts through each channel are throttled by a token bucket shared by all workers
+# through Redis (see alert/rate_limit.py), with the given (tokens per second, burst size) per
+# channel (these should match the providers' rate limits). An alert that can't get a token
+# within ALERT_RATE_LIMIT_MAX_WAIT seconds fails with a transient error (and is retried).
+ALERT_RATE_LIMITING_ENABLED = (
+    os.environ.get("ALERT_RATE_LIMITING_ENABLED", "false").lower() == "true"
+)
+ALERT_CHANNEL_RATE_LIMITS = {"email": (14, 28), "text": (10, 20), "push": (50, 100)}
+ALERT_RATE_LIMIT_MAX_WAIT = 30
+
+# Alerts that fail with transient errors are retried up to ALERT_RETRY_MAX_ATTEMPTS times,
+# with exponential backoff (in seconds) and jitter (see alert.tasks.schedule_alert_retry)
+ALERT_RETRY_MAX_ATTEMPTS = 5
+ALERT_RETRY_BASE_DELAY = 5
+ALERT_RETRY_MAX_DELAY = 600
+
+# The maximum number of sections in a single request to the bulk registration endpoints
+# (see alert.views.RegistrationViewSet.bulk_create / bulk_update)
+PCA_BULK_REGISTRATION_LIMIT = 100
 
 # Twilio Credentials
 TWILIO_SID = os.environ.get("TWILIO_SID", "")
@@ -227,3 +280,48 @@ PRE_NGSS_PERMIT_REQ_RESTRICTION_CODES = [  # TODO: add post-NGSS list
 ROUGH_MINIMUM_DEMAND_DISTRIBUTION_ESTIMATES = (
     200  # Aim for at least 200 demand distribution estimates over the course of a semester
 )
+
+# If positive, demand changes (status updates, registration (de)activations) within this many
+# seconds of each other are coalesced into a single section_demand_change task per semester
+# (see alert.tasks.schedule_section_demand_change); 0 (the default) disables coalescing
+SECTION_DEMAND_CHANGE_COALESCE_WINDOW = int(
+    os.environ.get("SECTION_DEMAND_CHANGE_COALESCE_WINDOW", "0")
+)
+
+# If enabled, the raw demand of each section is maintained incrementally in Redis sorted sets,
+# from which section_demand_change reads the lowest / highest demand sections and the
+# closed section demands (see alert/demand_index.py)
+DEMAND_INDEX_ENABLED = os.environ.get("DEMAND_INDEX_ENABLED", "false").lower() == "true"
+
+# If enabled, the lognormal distribution of closed section demands in each demand distribution
+# estimate is fit with scipy's (slow, numerical) stats.lognorm.fit, rather than in closed form
+# from running sums of log demands (see alert/demand_fit.py)
+DEMAND_DISTRIBUTION_FULL_LOGNORM_FIT = (
+    os.environ.get("DEMAND_DISTRIBUTION_FULL_LOGNORM_FIT", "false").lower() == "true"
+)
+
+# If enabled, send_course_alerts sends a section's alerts itself in batches of ALERT_BATCH_SIZE
+# registrations (through shared channel clients, marking them sent in bulk), rather than
+# queueing one send_alert task per registration (see alert.tasks.dispatch_alerts)
+ALERT_BATCH_DISPATCH = os.environ.get("ALERT_BATCH_DISPATCH", "false").lower() == "true"
+ALERT_BATCH_SIZE = 100
+
+# If enabled, duplicate triggers of the same section status transition (within the same
+# ALERT_FANOUT_DEDUP_WINDOW second time bucket) queue at most one alert fan-out
+# (see alert/fanout_dedup.py)
+ALERT_FANOUT_DEDUP_ENABLED = os.environ.get("ALERT_FANOUT_DEDUP_ENABLED", "false").lower() == "true"
+ALERT_FANOUT_DEDUP_WINDOW = 60
+
+# The maximum number of rendered alert messages to keep in each process's in-memory LRU cache
+# (see alert.alerts.render_alert_template)
+ALERT_RENDER_CACHE_SIZE = 5000
+
+# If enabled, the latency of each stage of alert fan-outs triggered by webhook requests is
+# recorded in AlertLatencyTrace objects (see alert/latency.py)
+ALERT_LATENCY_TRACING_ENABLED = (
+    os.environ.get("ALERT_LATENCY_TRACING_ENABLED", "false").lower() == "true"
+)
+
+# The maximum number of (section code, semester) -> section id mappings to keep in each
+# process's in-memory LRU cache (see courses.util.get_cached_section_id)
+SECTION_ID_CACHE_SIZE = 20000
@@ -4,7 +4,7 @@ from django.urls import include, path
 from django.views.generic import TemplateView
 from rest_framework.schemas import get_schema_view
 
-from alert.views import accept_webhook
+from alert.views import accept_webhook, accept_webhook_batch
 from courses.views import UserView
 from PennCourses.docs_settings import JSONOpenAPICustomTagGroupsRenderer, openapi_description
 
@@ -41,6 +41,7 @@ urlpatterns = [
     path("accounts/", include("accounts.urls", namespace="accounts")),
     path("api/", include(api_urlpatterns)),
     path("webhook", accept_webhook, name="webhook"),
+    path("webhook/batch", accept_webhook_batch, name="webhook-batch"),
 ]
 
 if settings.DEBUG:
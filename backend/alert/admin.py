@@ -2,7 +2,12 @@ from django.contrib import admin
 from django.urls import reverse
 from django.utils.html import format_html
 
-from alert.models import AddDropPeriod, PcaDemandDistributionEstimate, Registration
+from alert.models import (
+    AddDropPeriod,
+    AlertLatencyTrace,
+    PcaDemandDistributionEstimate,
+    Registration,
+)
 
 
 class RegistrationAdmin(admin.ModelAdmin):
@@ -21,7 +26,7 @@ class RegistrationAdmin(admin.ModelAdmin):
 
     list_filter = [
         "notification_sent",
-        "section__course__semester",
+        "semester",
         ("resubscribed_to", admin.EmptyFieldListFilter),
     ]
 
@@ -61,6 +66,30 @@ class AddDropPeriodAdmin(admin.ModelAdmin):
     list_filter = ["semester"]
 
 
+class AlertLatencyTraceAdmin(admin.ModelAdmin):
+    search_fields = ("full_code",)
+
+    ordering = ("-webhook_received_at",)
+
+    list_display = (
+        "full_code",
+        "semester",
+        "course_status",
+        "webhook_received_at",
+        "course_alerts_started_ms",
+    )
+
+    list_filter = ["semester", "course_status"]
+
+    def has_change_permission(self, request, obj=None):
+        """
+        Don't allow AlertLatencyTrace objects to be changed in the Admin console
+        (although they can be deleted).
+        """
+        return False
+
+
 admin.site.register(Registration, RegistrationAdmin)
 admin.site.register(PcaDemandDistributionEstimate, PcaDemandDistributionEstimateAdmin)
 admin.site.register(AddDropPeriod, AddDropPeriodAdmin)
+admin.site.register(AlertLatencyTrace, AlertLatencyTraceAdmin)
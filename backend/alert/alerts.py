@@ -1,146 +1,564 @@
 import logging
+import os
+import queue
+import threading
+import time
 from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from email.mime.text import MIMEText
-from smtplib import SMTP, SMTPRecipientsRefused
+from smtplib import (
+    SMTP,
+    SMTPException,
+    SMTPRecipientsRefused,
+    SMTPResponseException,
+    SMTPServerDisconnected,
+)
 
 import requests
 from django.conf import settings
 from django.template import loader
+from requests.adapters import HTTPAdapter
 from twilio.base.exceptions import TwilioRestException
+from twilio.http.http_client import TwilioHttpClient
 from twilio.rest import Client
 
+from alert.rate_limit import acquire_channel_tokens
 from PennCourses.settings.production import MOBILE_NOTIFICATION_SECRET
 
 
 logger = logging.getLogger(__name__)
 
+# HTTP status codes of provider responses after which sending an alert may succeed if retried
+TRANSIENT_HTTP_STATUSES = {408, 429, 500, 502, 503, 504}
 
-def send_email(from_, to, subject, html):
+
+class TransientAlertError(Exception):
+    """
+    Raised when an alert could not be sent through a channel because of an error that may not
+    recur if the alert is retried later (a rate limit or server error response from the provider,
+    a dropped connection, or a saturated channel rate limiter). See alert/tasks.py for retries.
+    """
+
+
+def is_transient_smtp_error(e):
+    """
+    Returns True if the given error (an SMTPException or OSError raised while sending emails)
+    is transient: a 4xx SMTP response (other than refused recipients) or a connection error.
+    """
+    if isinstance(e, SMTPRecipientsRefused):
+        return False
+    if isinstance(e, SMTPResponseException):
+        return 400 <= e.smtp_code < 500
+    return isinstance(e, (SMTPServerDisconnected, OSError))
+
+
+"""
+Pooled SMTP Transport
+=====================
+
+Opening an SMTP connection (EHLO / STARTTLS / EHLO / LOGIN) takes several round trips, and
+providers throttle clients that open many connections. So rather than connecting once per
+email, emails are sent through a per-process pool of at most settings.SMTP_POOL_SIZE persistent,
+logged-in connections (see get_smtp_pool). Each connection is reused for up to
+settings.SMTP_POOL_MAX_MESSAGES_PER_CONNECTION messages, and is closed once it has been idle for
+more than settings.SMTP_POOL_IDLE_TIMEOUT seconds. If a send fails because the server dropped
+the connection, the message is retried once on a fresh connection. An error sending one message
+of a batch doesn't stop the rest of the batch from being sent (see send_messages).
+"""
+
+
+class SMTPConnectionPool:
+    """
+    A bounded, thread-safe pool of persistent SMTP connections. Use send_messages
+    to send messages through a pooled connection.
+    """
+
+    # Errors after which a connection can no longer be used (and a send may be retried)
+    CONNECTION_ERRORS = (SMTPServerDisconnected, ConnectionError, TimeoutError)
+
+    def __init__(self, max_size, max_messages_per_connection, idle_timeout):
+        self.max_size = max_size
+        self.max_messages_per_connection = max_messages_per_connection
+        self.idle_timeout = idle_timeout
+        self.idle = queue.LifoQueue()  # of (server, num_messages_sent, last_used) tuples
+        self.slots = threading.BoundedSemaphore(max_size)
+        self.num_connections_opened = 0
+
+    def connect(self):
+        # An email alert times out after its channel's timeout (see send_channel_alerts)
+        timeout = min(settings.SMTP_TIMEOUT, settings.ALERT_CHANNEL_TIMEOUTS["email"])
+        server = SMTP(settings.SMTP_HOST, settings.SMTP_PORT, timeout=timeout)
+        try:
+            server.ehlo()
+            if settings.SMTP_USE_TLS:
+                server.starttls()
+                server.ehlo()
+            if settings.SMTP_USERNAME:
+                server.login(settings.SMTP_USERNAME, settings.SMTP_PASSWORD)
+        except Exception:
+            self.discard(server)
+            raise
+        self.num_connections_opened += 1
+        return server
+
+    @staticmethod
+    def discard(server):
+        try:
+            server.quit()
+        except Exception:
+            server.close()
+
+    @classmethod
+    def is_connection_error(cls, e):
+        """
+        Returns True if the given error (an SMTPException or OSError raised while sending
+        a message) means the connection can no longer be used. After any other SMTP error
+        response, the transaction is reset and the connection can send the next message.
+        """
+        if isinstance(e, SMTPResponseException):
+            return e.smtp_code == 421  # 421 means the server is closing the connection
+        return isinstance(e, cls.CONNECTION_ERRORS) or not isinstance(e, SMTPException)
+
+    def acquire(self):
+        """
+        Returns a `(server, num_messages_sent)` tuple for an idle connection (or a new connection
+        if none are idle), blocking while settings.SMTP_POOL_SIZE connections are in use.
+        """
+        self.slots.acquire()
+        try:
+            while True:
+                try:
+                    server, num_sent, last_used = self.idle.get_nowait()
+                except queue.Empty:
+                    return self.connect(), 0
+                if time.monotonic() - last_used <= self.idle_timeout:
+                    return server, num_sent
+                self.discard(server)
+        except Exception:
+            self.slots.release()
+            raise
+
+    def release(self, server, num_sent, reusable=True):
+        if server is not None:
+            if reusable and num_sent < self.max_messages_per_connection:
+                self.idle.put((server, num_sent, time.monotonic()))
+            else:
+                self.discard(server)
+        self.slots.release()
+
+    def send_messages(self, messages, raise_refused=False):
+        """
+        Sends the given email messages (MIMEText objects) through a pooled connection.
+        Returns a list with, for each message, True if it was sent, None if its recipients were
+        all refused (or raises the SMTPRecipientsRefused error, if raise_refused is set), or the
+        SMTPException (or OSError) that prevented it from being sent. An error sending one
+        message doesn't stop the remaining messages from being sent: if the connection is
+        dropped, the remaining messages are sent on a fresh connection (and the message being
+        sent is retried once). If no connection can be opened, the connection error is
+        returned for each of the remaining messages.
+        """
+        results = []
+        try:
+            server, num_sent = self.acquire()
+        except OSError as e:  # SMTPException is a subclass of OSError
+            return [e] * len(messages)
+        retried = None  # the index of the message retried on a fresh connection, if any
+        reusable = False
+        try:
+            while len(results) < len(messages):
+                if server is None:
+                    try:
+                        server, num_sent = self.connect(), 0
+                    except OSError as e:
+                        results.extend([e] * (len(messages) - len(results)))
+                        break
+                try:
+                    server.send_message(messages[len(results)])
+                    results.append(True)
+                    num_sent += 1
+                except SMTPRecipientsRefused:
+                    # The transaction is reset after a refusal, so the connection is reusable
+                    if raise_refused:
+                        reusable = True
+                        raise
+                    results.append(None)
+                except OSError as e:
+                    if not self.is_connection_error(e):
+                        results.append(e)
+                        continue
+                    self.discard(server)
+                    server = None
+                    if retried == len(results):
+                        results.append(e)
+                    else:
+                        retried = len(results)
+            reusable = True
+        finally:
+            self.release(server, num_sent, reusable=reusable)
+        return results
+
+    def close(self):
+        """
+        Closes all idle connections.
+        """
+        while True:
+            try:
+                server, _, _ = self.idle.get_nowait()
+            except queue.Empty:
+                return
+            self.discard(server)
+
+
+smtp_pool = None
+smtp_pool_pid = None
+smtp_pool_lock = threading.Lock()
+
+
+def get_smtp_pool():
+    """
+    Returns the SMTPConnectionPool of the current process (creating it if necessary;
+    a forked worker process never reuses its parent's pool).
+    """
+    global smtp_pool, smtp_pool_pid
+    with smtp_pool_lock:
+        if smtp_pool is None or smtp_pool_pid != os.getpid():
+            smtp_pool = SMTPConnectionPool(
+                max_size=settings.SMTP_POOL_SIZE,
+                max_messages_per_connection=settings.SMTP_POOL_MAX_MESSAGES_PER_CONNECTION,
+                idle_timeout=settings.SMTP_POOL_IDLE_TIMEOUT,
+            )
+            smtp_pool_pid = os.getpid()
+        return smtp_pool
+
+
+"""
+Shared Channel Clients
+======================
+
+Texts are sent through a per-process Twilio client and push notifications through a per-process
+requests.Session (both of which keep pooled, persistent HTTP connections), rather than through
+a new client / connection per message. Both are created lazily (see get_channel_client), and a
+forked worker process never reuses its parent's clients. Their requests time out after the
+channel's timeout in settings.ALERT_CHANNEL_TIMEOUTS.
+"""
+
+channel_clients = dict()  # maps channel names to (pid, client) tuples
+channel_clients_lock = threading.Lock()
+
+
+def get_channel_client(channel, create):
+    """
+    Returns the shared client for the given channel in the current process,
+    calling create() to create it if necessary.
+    """
+    with channel_clients_lock:
+        pid, client = channel_clients.get(channel, (None, None))
+        if client is None or pid != os.getpid():
+            client = create()
+            channel_clients[channel] = (os.getpid(), client)
+        return client
+
+
+def get_twilio_client():
+    return get_channel_client(
+        "text",
+        lambda: Client(
+            settings.TWILIO_SID,
+            settings.TWILIO_AUTH_TOKEN,
+            http_client=TwilioHttpClient(timeout=settings.ALERT_CHANNEL_TIMEOUTS["text"]),
+        ),
+    )
+
+
+def create_push_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_maxsize=settings.ALERT_CHANNEL_THREADS)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_push_session():
+    return get_channel_client("push", create_push_session)
+
+
+def make_email(from_, to, subject, html):
     msg = MIMEText(html, "html")
     msg["Subject"] = subject
     msg["From"] = from_
     msg["To"] = to
+    return msg
+
 
-    with SMTP(settings.SMTP_HOST, settings.SMTP_PORT) as server:
-        server.ehlo()
-        server.starttls()
-        server.ehlo()
-        server.login(settings.SMTP_USERNAME, settings.SMTP_PASSWORD)
-        server.send_message(msg)
-        return True
+def send_email(from_, to, subject, html):
+    """
+    Sends an HTML email through the pooled SMTP transport. Returns True if the email was sent,
+    and raises SMTPRecipientsRefused if the recipient was refused (or the SMTPException / OSError
+    that prevented the email from being sent).
+    """
+    msg = make_email(from_, to, subject, html)
+    (result,) = get_smtp_pool().send_messages([msg], raise_refused=True)
+    if isinstance(result, Exception):
+        raise result
+    return True
+
+
+def send_emails(emails):
+    """
+    Sends the given emails (a list of `(from_, to, subject, html)` tuples) in a batch through
+    one pooled SMTP connection. Returns a list with True for each email that was sent,
+    None for each email whose recipient was refused, and the SMTPException (or OSError) that
+    prevented each other email from being sent.
+    """
+    results = get_smtp_pool().send_messages([make_email(*email) for email in emails])
+    for (_, to, _, _), result in zip(emails, results):
+        if result is None:
+            logger.error(f"Email Error: recipient {to} refused")
+        elif isinstance(result, Exception):
+            logger.error(f"Email Error: sending to {to} failed: {result!r}")
+    return results
 
 
-def send_text(to, text):
+def send_text(to, text, client=None):
+    """
+    Sends a text message through Twilio (using the given Twilio client, or the shared client
+    if none is specified). Returns True if the text was sent, and None if an error occurred.
+    Raises TransientAlertError if Twilio could not be reached or responded with a
+    transient error status (e.g. 429 Too Many Requests).
+    """
     try:
-        client = Client(settings.TWILIO_SID, settings.TWILIO_AUTH_TOKEN)
+        if client is None:
+            client = get_twilio_client()
         msg = client.messages.create(to=to, from_=settings.TWILIO_NUMBER, body=text)
         if msg.sid is not None:
             return True
-    except TwilioRestException:
+    except TwilioRestException as e:
+        if e.status in TRANSIENT_HTTP_STATUSES:
+            raise TransientAlertError(f"Twilio {e.status} Response: {e.msg}") from e
         logger.exception("Text Error")
         return None
+    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+        raise TransientAlertError(f"Twilio Request Error: {e}") from e
 
 
-class Alert(ABC):
-    def __init__(self, template, reg, close_template=None):
-        t = loader.get_template(template)
-        self.text = t.render(
+"""
+Alert Message Rendering
+=======================
+
+An alert message depends only on its template, the section's full code, and whether the
+registration auto-resubscribes. So each template is compiled once per process, and rendered
+messages are memoized per process by `(template, full_code, auto_resubscribe)` in an LRU cache
+of at most settings.ALERT_RENDER_CACHE_SIZE messages; fanning an opening out to N watchers of
+a section renders each distinct message once. Alert objects render their messages lazily, so
+only the variant (open or close) that is actually sent is ever rendered.
+"""
+
+compiled_alert_templates = dict()  # maps template names to compiled templates
+rendered_alert_lru = OrderedDict()  # maps (template, full_code, auto_resubscribe) to messages
+rendered_alert_lru_lock = threading.Lock()
+
+
+def render_alert_template(template, full_code, auto_resubscribe):
+    """
+    Returns the given alert template rendered for the given section full code and
+    auto_resubscribe value (memoized in the in-process LRU cache).
+    """
+    key = (template, full_code, auto_resubscribe)
+    # Rendering an alert template is fast, so messages are rendered while holding the lock
+    # (guaranteeing that concurrent alert channels never render the same message twice)
+    with rendered_alert_lru_lock:
+        text = rendered_alert_lru.get(key)
+        if text is not None:
+            rendered_alert_lru.move_to_end(key)
+            return text
+        if template not in compiled_alert_templates:
+            compiled_alert_templates[template] = loader.get_template(template)
+        text = compiled_alert_templates[template].render(
             {
-                "course": reg.section.full_code,
+                "course": full_code,
                 "brand": "Penn Course Alert",
-                "auto_resubscribe": reg.auto_resubscribe,
+                "auto_resubscribe": auto_resubscribe,
             }
         )
-        self.close_text = None
-        if close_template:
-            t = loader.get_template(close_template)
-            self.close_text = t.render(
-                {
-                    "course": reg.section.full_code,
-                    "brand": "Penn Course Alert",
-                    "auto_resubscribe": reg.auto_resubscribe,
-                }
-            )
+        rendered_alert_lru[key] = text
+        while len(rendered_alert_lru) > settings.ALERT_RENDER_CACHE_SIZE:
+            rendered_alert_lru.popitem(last=False)
+    return text
+
+
+def clear_alert_render_cache():
+    """
+    Clears the in-process caches of compiled alert templates and rendered alert messages.
+    """
+    with rendered_alert_lru_lock:
+        compiled_alert_templates.clear()
+        rendered_alert_lru.clear()
+
+
+class Alert(ABC):
+    channel = None  # the key of this channel in settings.ALERT_CHANNEL_TIMEOUTS
+
+    def __init__(self, template, reg, close_template=None):
+        self.template = template
+        self.close_template = close_template
         self.registration = reg
 
+    @property
+    def text(self):
+        return render_alert_template(
+            self.template, self.registration.section.full_code, self.registration.auto_resubscribe
+        )
+
+    @property
+    def close_text(self):
+        if not self.close_template:
+            return None
+        return render_alert_template(
+            self.close_template,
+            self.registration.section.full_code,
+            self.registration.auto_resubscribe,
+        )
+
+    def load_related(self):
+        """
+        Loads the related objects of this alert's registration that send_alert uses (if they
+        aren't already loaded), so that send_alert can run on a thread without database access.
+        """
+        self.registration.section
+        if self.registration.user is not None:
+            self.registration.user.profile
+
+    @abstractmethod
+    def has_recipient(self, close_notification=False):
+        """
+        Returns True if this alert would be sent through its channel by send_alert
+        (and False if send_alert would return False without sending anything).
+        """
+        pass
+
     @abstractmethod
     def send_alert(self, close_notification=False):
         pass
 
 
 class Email(Alert):
+    channel = "email"
+    FROM = "Penn Course Alert <team@penncoursealert.com>"
+
     def __init__(self, reg):
         super().__init__("alert/email_alert.html", reg, "alert/email_alert_close.html")
 
+    def get_address(self):
+        """
+        Returns the email address this alert should be sent to, or None if there is none.
+        """
+        if self.registration.user is not None and self.registration.user.profile.email is not None:
+            return self.registration.user.profile.email
+        return self.registration.email
+
+    def get_email(self, close_notification=False):
+        """
+        Returns a `(from_, to, subject, html)` tuple for this alert (as accepted by send_emails),
+        or None if it should not be sent (if there is no email address to send it to).
+        """
+        email = self.get_address()
+        if email is None:
+            return None
+        if close_notification:
+            alert_subject = f"{self.registration.section.full_code} has closed."
+            alert_text = self.close_text
+        else:
+            alert_subject = f"{self.registration.section.full_code} is now open!"
+            alert_text = self.text
+        return self.FROM, email, alert_subject, alert_text
+
+    def has_recipient(self, close_notification=False):
+        return self.get_address() is not None
+
     def send_alert(self, close_notification=False):
         """
         Returns False if notification was not sent intentionally,
         and None if notification was attempted to be sent but an error occurred.
+        Raises TransientAlertError if the error was transient (see is_transient_smtp_error).
         """
-        if self.registration.user is not None and self.registration.user.profile.email is not None:
-            email = self.registration.user.profile.email
-        elif self.registration.email is not None:
-            email = self.registration.email
-        else:
+        email = self.get_email(close_notification=close_notification)
+        if email is None:
             return False
+        if close_notification and not self.close_text:
+            # This should be unreachable
+            return None
 
         try:
-            if close_notification:
-                if not self.close_text:
-                    # This should be unreachable
-                    return None
-                alert_subject = f"{self.registration.section.full_code} has closed."
-                alert_text = self.close_text
-            else:
-                alert_subject = f"{self.registration.section.full_code} is now open!"
-                alert_text = self.text
-            return send_email(
-                from_="Penn Course Alert <team@penncoursealert.com>",
-                to=email,
-                subject=alert_subject,
-                html=alert_text,
-            )
+            from_, to, subject, html = email
+            return send_email(from_=from_, to=to, subject=subject, html=html)
         except SMTPRecipientsRefused:
             logger.exception("Email Error")
             return None
+        except (SMTPException, OSError) as e:
+            if is_transient_smtp_error(e):
+                raise TransientAlertError(f"Email Error: {e!r}") from e
+            raise
 
 
 class Text(Alert):
+    channel = "text"
+
     def __init__(self, reg):
         super().__init__("alert/text_alert.txt", reg)
 
-    def send_alert(self, close_notification=False):
+    def get_phone_number(self, close_notification=False):
         """
-        Returns False if notification was not sent intentionally,
-        and None if notification was attempted to be sent but an error occurred.
+        Returns the phone number this alert should be texted to, or None if it should not be
+        sent by text.
         """
         if close_notification:
             # Do not send close notifications by text
-            return False
+            return None
         if self.registration.user is not None and self.registration.user.profile.push_notifications:
             # Do not send text if push_notifications is enabled
-            return False
+            return None
         if self.registration.user is not None and self.registration.user.profile.phone is not None:
-            phone_number = self.registration.user.profile.phone
-        elif self.registration.phone is not None:
-            phone_number = self.registration.phone
-        else:
-            return False
+            return self.registration.user.profile.phone
+        return self.registration.phone
 
-        alert_text = self.text
-        return send_text(phone_number, alert_text)
+    def has_recipient(self, close_notification=False):
+        return self.get_phone_number(close_notification=close_notification) is not None
+
+    def send_alert(self, close_notification=False, client=None):
+        """
+        Returns False if notification was not sent intentionally,
+        and None if notification was attempted to be sent but an error occurred.
+        Raises TransientAlertError if the error was transient (see send_text).
+        """
+        phone_number = self.get_phone_number(close_notification=close_notification)
+        if phone_number is None:
+            return False
+        return send_text(phone_number, self.text, client=client)
 
 
 class PushNotification(Alert):
+    channel = "push"
+
     def __init__(self, reg):
         super().__init__("alert/push_notif.txt", reg, close_template="alert/push_notif_close.txt")
 
-    def send_alert(self, close_notification=False):
+    def has_recipient(self, close_notification=False):
+        return (
+            self.registration.user is not None and self.registration.user.profile.push_notifications
+        )
+
+    def send_alert(self, close_notification=False, session=None):
         """
         Returns False if notification was not sent intentionally,
         and None if notification was attempted to be sent but an error occurred.
+        Raises TransientAlertError if the push notification API could not be reached or
+        responded with a transient error status (e.g. 429 Too Many Requests).
+        The notification is sent through the given requests.Session
+        (or the shared push notification session if none is given).
         """
-        if self.registration.user is not None and self.registration.user.profile.push_notifications:
+        if self.has_recipient(close_notification=close_notification):
             # Only send push notification if push_notifications is enabled
             pennkey = self.registration.user.username
             bearer_token = MOBILE_NOTIFICATION_SECRET
@@ -154,7 +572,7 @@ class PushNotification(Alert):
                 alert_title = f"{self.registration.section.full_code} is now open!"
                 alert_body = self.text
             try:
-                response = requests.post(
+                response = (session or get_push_session()).post(
                     "https:/api.pennlabs.org/notifications/send/internal",
                     data={
                         "title": alert_title,
@@ -162,14 +580,237 @@ class PushNotification(Alert):
                         "pennkey": pennkey,
                     },
                     headers={"Authorization": f"Bearer {bearer_token}"},
+                    timeout=settings.ALERT_CHANNEL_TIMEOUTS["push"],
                 )
+                if response.status_code in TRANSIENT_HTTP_STATUSES:
+                    raise TransientAlertError(
+                        f"Push Notification {response.status_code} Response: {response.content}"
+                    )
                 if response.status_code != 200:
                     logger.exception(
                         f"Push Notification {response.status_code} Response: {response.content}"
                     )
                     return None
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                raise TransientAlertError(f"Push Notification Request Error: {e}") from e
             except requests.exceptions.RequestException as e:
                 logger.exception(f"Push Notification Request Error: {e}")
                 return None
             return True
         return False
+
+
+"""
+Concurrent Channel Dispatch
+===========================
+
+The channels (text, email and/or push notification) of an alert are sent concurrently, on a
+bounded per-process pool of settings.ALERT_CHANNEL_THREADS threads (see send_channel_alerts),
+rather than one after another. Each channel's result is awaited for at most the channel's
+timeout in settings.ALERT_CHANNEL_TIMEOUTS (plus settings.ALERT_RATE_LIMIT_MAX_WAIT, if channels
+are rate limited, see alert/rate_limit.py); a channel that times out or raises an exception
+is treated as an error (a None result, as with the Alert.send_alert return value). The channel
+clients' own timeouts are at most the channel's timeout, but a send that waited for a free thread
+may still be running when its channel times out (and may still deliver the alert), so an alert
+with a channel still sending is never retried (see get_channel_result).
+"""
+
+channel_executor = None
+channel_executor_pid = None
+channel_executor_lock = threading.Lock()
+
+
+def get_channel_executor():
+    """
+    Returns the channel thread pool of the current process (creating it if necessary;
+    a forked worker process never reuses its parent's pool).
+    """
+    global channel_executor, channel_executor_pid
+    with channel_executor_lock:
+        if channel_executor is None or channel_executor_pid != os.getpid():
+            channel_executor = ThreadPoolExecutor(
+                max_workers=settings.ALERT_CHANNEL_THREADS, thread_name_prefix="alert-channel"
+            )
+            channel_executor_pid = os.getpid()
+        return channel_executor
+
+
+def send_timed(send, *args, **kwargs):
+    """
+    Calls send with the given arguments, and returns a tuple of its result
+    and the time at which it returned (as returned by time.time()).
+    """
+    result = send(*args, **kwargs)
+    return result, time.time()
+
+
+def send_rate_limited(alert, close_notification=False):
+    """
+    Sends the given alert (returning its send_alert result), after taking a token from its
+    channel's rate limiter if it has a recipient (see alert/rate_limit.py). Raises
+    TransientAlertError if no token is available within settings.ALERT_RATE_LIMIT_MAX_WAIT seconds.
+    """
+    if alert.has_recipient(close_notification=close_notification) and not acquire_channel_tokens(
+        alert.channel
+    ):
+        raise TransientAlertError(f"{alert.channel} rate limit saturated")
+    return alert.send_alert(close_notification=close_notification)
+
+
+def get_channel_timeout(channel):
+    """
+    Returns the number of seconds to wait for an alert through the given channel
+    (including the time it may wait for its channel's rate limiter).
+    """
+    timeout = settings.ALERT_CHANNEL_TIMEOUTS[channel]
+    if settings.ALERT_RATE_LIMITING_ENABLED:
+        timeout += settings.ALERT_RATE_LIMIT_MAX_WAIT
+    return timeout
+
+
+def get_channel_result(channel, future, timeout=None, transient_errors=None, still_sending=None):
+    """
+    Waits for the given channel send (a future of send_timed) for at most timeout seconds,
+    and returns a tuple of its result and the time at which it finished, or (None, None)
+    if it timed out or raised an exception. If it raised a TransientAlertError and a
+    transient_errors set is given, the channel is added to it. A send that times out before
+    it starts is cancelled (and treated as a transient error); if it has already started,
+    the channel is added to the given still_sending set (since it may still be sent).
+    """
+    try:
+        return future.result(timeout=timeout)
+    except TransientAlertError as e:
+        logger.warning(f"{channel} alert transient error: {e}")
+        if transient_errors is not None:
+            transient_errors.add(channel)
+        return None, None
+    except FutureTimeoutError:
+        if future.cancel():
+            logger.warning(f"{channel} alert transient error: timed out before sending")
+            if transient_errors is not None:
+                transient_errors.add(channel)
+        else:
+            logger.error(f"{channel} alert timed out while sending")
+            if still_sending is not None:
+                still_sending.add(channel)
+        return None, None
+    except Exception:
+        logger.exception(f"{channel} alert error")
+        return None, None
+
+
+def send_channel_alerts(
+    channel_alerts, close_notification=False, accepted_at=None, transient_errors=None
+):
+    """
+    Sends the given alerts (Alert objects for different channels) concurrently, each through its
+    channel's rate limiter. Returns a list of their send_alert results (with None for each alert
+    that timed out or raised an exception). If an accepted_at dict is given, the time at which
+    each channel that sent its alert successfully finished sending it is recorded in it
+    (by channel). If a transient_errors set is given, each channel whose alert failed with
+    a TransientAlertError is added to it, unless a channel timed out while still sending
+    (in which case the set is left empty, so the alert isn't retried and sent twice).
+    """
+    for alert in channel_alerts:
+        alert.load_related()
+    executor = get_channel_executor()
+    start = time.monotonic()
+    futures = [
+        executor.submit(send_timed, send_rate_limited, alert, close_notification=close_notification)
+        for alert in channel_alerts
+    ]
+    results = []
+    still_sending = set()
+    for alert, future in zip(channel_alerts, futures):
+        timeout = get_channel_timeout(alert.channel) - (time.monotonic() - start)
+        result, finished_at = get_channel_result(
+            alert.channel,
+            future,
+            timeout=max(timeout, 0),
+            transient_errors=transient_errors,
+            still_sending=still_sending,
+        )
+        if result and accepted_at is not None:
+            accepted_at[alert.channel] = finished_at
+        results.append(result)
+    if still_sending and transient_errors:
+        logger.warning(f"Not retrying alert: {', '.join(sorted(still_sending))} still sending")
+        transient_errors.clear()
+    return results
+
+
+"""
+Batch Alert Dispatch
+====================
+
+When settings.ALERT_BATCH_DISPATCH is enabled, send_course_alerts (in alert/tasks.py) sends
+the alerts for a section itself, in batches, rather than queueing one send_alert task per
+registration. Each batch is sent with send_alerts, which sends all emails through one pooled
+SMTP connection while the texts and push notifications are sent concurrently (through the
+shared channel clients) on the channel thread pool. The sent registrations are then marked
+with Registration.mark_alerts_sent (in bulk). Every alert still goes through its channel's rate
+limiter (a batch of emails takes one token per email at once).
+"""
+
+
+def send_alerts(registrations, close_notification=False, accepted_at=None, transient_errors=None):
+    """
+    Sends alerts for the given registrations, as Registration.alert would (but without checking
+    whether each registration is active / waiting for close, or marking them as sent).
+    The registrations should be fetched with `select_related("section", "user__profile")`.
+    Returns a list with, for each registration, True if its alert was sent through at least
+    one medium and False otherwise. If an accepted_at list is given, a dict is appended to it
+    for each registration, recording the time at which each channel finished sending its alert
+    successfully (as with send_channel_alerts). Similarly, if a transient_errors list is given,
+    a set of the channels whose alerts failed with a transient error is appended to it
+    for each registration.
+    """
+    executor = get_channel_executor()
+    futures = []  # a list of (index, channel, future) tuples
+    emails = []  # a list of (index, email) tuples
+    for i, reg in enumerate(registrations):
+        push_notification = reg.user is not None and reg.user.profile.push_notifications
+        if not push_notification and not close_notification:
+            text = Text(reg)
+            if text.get_phone_number() is not None:
+                future = executor.submit(send_timed, send_rate_limited, text)
+                futures.append((i, text.channel, future))
+        email = Email(reg).get_email(close_notification=close_notification)
+        if email is not None:
+            emails.append((i, email))
+        if push_notification:
+            push = PushNotification(reg)
+            future = executor.submit(
+                send_timed, send_rate_limited, push, close_notification=close_notification
+            )
+            futures.append((i, push.channel, future))
+
+    results = [False] * len(registrations)
+    accepted = [dict() for _ in registrations]
+    transient = [set() for _ in registrations]
+    if emails:
+        if not acquire_channel_tokens(Email.channel, len(emails)):
+            logger.warning("email alert transient error: email rate limit saturated")
+            for i, _ in emails:
+                transient[i].add(Email.channel)
+        else:
+            email_results, emails_sent_at = send_timed(send_emails, [email for _, email in emails])
+            # Only the registrations whose own emails failed transiently are retried
+            # (an error sending one email of the batch doesn't affect the others)
+            for (i, _), email_result in zip(emails, email_results):
+                if email_result is True:
+                    results[i] = True
+                    accepted[i][Email.channel] = emails_sent_at
+                elif isinstance(email_result, Exception) and is_transient_smtp_error(email_result):
+                    transient[i].add(Email.channel)
+    # The channel clients' requests time out individually, so queued sends are awaited fully
+    for i, channel, future in futures:
+        result, finished_at = get_channel_result(channel, future, transient_errors=transient[i])
+        if result:
+            results[i] = True
+            accepted[i][channel] = finished_at
+    if accepted_at is not None:
+        accepted_at.extend(accepted)
+    if transient_errors is not None:
+        transient_errors.extend(transient)
+    return results
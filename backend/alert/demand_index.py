@@ -0,0 +1,317 @@
+import logging
+
+import redis
+from django.conf import settings
+
+from alert.demand_fit import ClosedDemandMoments
+from courses.models import Section
+from review.views import extra_metrics_section_filters
+
+
+"""
+Demand Index
+============
+
+When settings.DEMAND_INDEX_ENABLED is set, the raw demand (registration_volume / capacity)
+of every section in a semester that passes extra_metrics_section_filters is kept in a pair of
+Redis sorted sets (one for closed sections, one for all other sections), keyed by section id.
+This lets section_demand_change (in alert/tasks.py) read the lowest / highest demand sections
+and the raw demands of all closed sections without sorting (or locking) the semester's sections.
+Alongside the closed partition, the index keeps the moments of the closed sections' log raw
+demands (see ClosedDemandMoments in alert/demand_fit.py) in a Redis hash, from which the
+lognormal fit of each demand distribution estimate is computed in O(1).
+
+The index for a semester is rebuilt from the database by rebuild_demand_index (which is called
+by recomputestats and loadstatus), and is updated in O(log n) per section by update_demand_index
+whenever a section's registration_volume or status changes (each section's partitions and the
+closed moments are updated atomically by a Lua script, so concurrent updates can't count a section
+twice in the moments). Until the index for a semester has been built (or if Redis is unavailable),
+readers return None and callers should fall back to querying the database.
+
+Sections with status updates that fail extra_metrics_section_filters are kept in an "excluded"
+set, so update_demand_index doesn't query the database for them on every update. Of the fields
+the filter depends on, only a section's capacity can change without a registrar import, so an
+excluded section with a positive capacity is checked again on each update (and removed from
+the excluded set if it has become eligible). Other changes (e.g. to a section's restrictions)
+are picked up when registrarimport (run daily) rebuilds the index through loadstatus and
+recomputestats.
+"""
+
+logger = logging.getLogger(__name__)
+r = redis.Redis.from_url(settings.REDIS_URL)
+
+DEMAND_INDEX_PARTITIONS = ["closed", "other"]
+CLOSED_MOMENTS_FIELDS = ["num_closed", "num_positive", "sum_log", "sum_log_sq", "shift"]
+
+# KEYS: the closed and other partitions' keys, the closed moments key
+# ARGV: the section id, the partition to index it in ("closed" or "other", or "" to remove it
+#   from the index), the section's raw demand
+UPDATE_SECTION_DEMAND_SCRIPT = """
+local has_moments = redis.call("EXISTS", KEYS[3]) == 1
+local function add_moments(raw_demand, sign)
+    if not has_moments then
+        return  -- built before the moments were kept (readers will fall back to the partition)
+    end
+    redis.call("HINCRBY", KEYS[3], "num_closed", sign)
+    if raw_demand > 0 then
+        local log_demand = math.log(raw_demand)
+        local num_positive = redis.call("HINCRBY", KEYS[3], "num_positive", sign)
+        if num_positive == 0 then
+            redis.call("HSET", KEYS[3], "sum_log", 0, "sum_log_sq", 0)
+        elseif num_positive == 1 and sign == 1 then
+            redis.call(
+                "HSET", KEYS[3], "shift", string.format("%.17g", log_demand),
+                "sum_log", 0, "sum_log_sq", 0
+            )
+        else
+            -- Hashes built before the logs were shifted have no shift (i.e. a shift of 0)
+            local shift = tonumber(redis.call("HGET", KEYS[3], "shift") or "0")
+            local shifted_log_demand = log_demand - shift
+            redis.call(
+                "HINCRBYFLOAT", KEYS[3], "sum_log",
+                string.format("%.17g", sign * shifted_log_demand)
+            )
+            redis.call(
+                "HINCRBYFLOAT", KEYS[3], "sum_log_sq",
+                string.format("%.17g", sign * shifted_log_demand * shifted_log_demand)
+            )
+        end
+    end
+end
+local old_closed = redis.call("ZSCORE", KEYS[1], ARGV[1])
+if old_closed then
+    add_moments(tonumber(old_closed), -1)
+end
+redis.call("ZREM", KEYS[1], ARGV[1])
+redis.call("ZREM", KEYS[2], ARGV[1])
+if ARGV[2] == "closed" then
+    redis.call("ZADD", KEYS[1], ARGV[3], ARGV[1])
+    add_moments(tonumber(ARGV[3]), 1)
+elseif ARGV[2] == "other" then
+    redis.call("ZADD", KEYS[2], ARGV[3], ARGV[1])
+end
+return 1
+"""
+update_section_demand = r.register_script(UPDATE_SECTION_DEMAND_SCRIPT)
+
+
+def demand_index_key(semester, name):
+    """
+    Returns the Redis key for the given part of the demand index for the given semester,
+    where name is one of the DEMAND_INDEX_PARTITIONS, "excluded" (a set of the ids of sections
+    known to fail extra_metrics_section_filters), "moments" (a hash of the closed partition's
+    CLOSED_MOMENTS_FIELDS), or "built" (a flag set once the index is built).
+    """
+    return f"demand_index:{semester}:{name}"
+
+
+def get_demand_index_partition(status):
+    return "closed" if status == "C" else "other"
+
+
+def get_raw_demand(section):
+    return float(section.registration_volume) / float(section.capacity)
+
+
+def rebuild_demand_index(semester):
+    """
+    Rebuilds the demand index for the given semester from the database (atomically replacing
+    the existing index for that semester, if any). Does nothing if the index is disabled.
+    """
+    if not settings.DEMAND_INDEX_ENABLED:
+        return
+    partitions = {name: dict() for name in DEMAND_INDEX_PARTITIONS}
+    for section_id, status, registration_volume, capacity in Section.objects.filter(
+        extra_metrics_section_filters, course__semester=semester
+    ).values_list("id", "status", "registration_volume", "capacity"):
+        partitions[get_demand_index_partition(status)][section_id] = float(
+            registration_volume
+        ) / float(capacity)
+    # Sections without status updates are left out of the excluded set, since they
+    # may become eligible (see update_demand_index)
+    excluded = set(
+        Section.objects.filter(course__semester=semester, has_status_updates=True).values_list(
+            "id", flat=True
+        )
+    ).difference(*partitions.values())
+
+    moments = ClosedDemandMoments.from_raw_demands(list(partitions["closed"].values()))
+
+    pipe = r.pipeline(transaction=True)
+    for name in DEMAND_INDEX_PARTITIONS + ["excluded", "moments"]:
+        key = demand_index_key(semester, name)
+        pipe.delete(key)
+        if name == "excluded" and excluded:
+            pipe.sadd(key, *excluded)
+        elif name == "moments":
+            pipe.hset(key, mapping={f: getattr(moments, f) for f in CLOSED_MOMENTS_FIELDS})
+        elif name != "excluded" and partitions[name]:
+            pipe.zadd(key, partitions[name])
+    pipe.set(demand_index_key(semester, "built"), 1)
+    pipe.execute()
+
+
+def update_demand_index(sections):
+    """
+    Updates the demand index entries of the given sections (Section objects, all of which should
+    have been saved) to reflect their current status and registration_volume, in O(log n) each.
+    Sections that are not yet in the index are added if they pass extra_metrics_section_filters
+    (checked with a single query), as are excluded sections with a positive capacity that now
+    pass it (which are removed from the excluded set). Sections in semesters whose index has not
+    been built are skipped. Redis errors are logged rather than raised, since the index is only
+    an optimization.
+    """
+    if not settings.DEMAND_INDEX_ENABLED:
+        return
+    sections = list(sections)
+    if not sections:
+        return
+    try:
+        pipe = r.pipeline(transaction=False)
+        for section in sections:
+            pipe.exists(demand_index_key(section.semester, "built"))
+            pipe.sismember(demand_index_key(section.semester, "excluded"), section.id)
+            for name in DEMAND_INDEX_PARTITIONS:
+                pipe.zscore(demand_index_key(section.semester, name), section.id)
+        responses = iter(pipe.execute())
+
+        to_index = []
+        to_check = []
+        excluded_ids = set()
+        for section in sections:
+            built, excluded = next(responses), next(responses)
+            scores = [next(responses) for _ in DEMAND_INDEX_PARTITIONS]
+            if not built:
+                continue
+            if excluded:
+                excluded_ids.add(section.id)
+                # An excluded section may have become eligible if its capacity became positive
+                if section.capacity and section.capacity > 0:
+                    to_check.append(section)
+            elif all(score is None for score in scores):
+                to_check.append(section)
+            else:
+                to_index.append(section)
+
+        to_exclude = []
+        to_unexclude = []
+        if to_check:
+            eligible_ids = set(
+                Section.objects.filter(
+                    extra_metrics_section_filters, id__in=[s.id for s in to_check]
+                ).values_list("id", flat=True)
+            )
+            for section in to_check:
+                if section.id in eligible_ids:
+                    to_index.append(section)
+                    if section.id in excluded_ids:
+                        to_unexclude.append(section)
+                elif section.has_status_updates and section.id not in excluded_ids:
+                    to_exclude.append(section)
+
+        pipe = r.pipeline(transaction=True)
+        for section in to_index:
+            has_capacity = section.capacity and section.capacity > 0
+            update_section_demand(
+                keys=[
+                    demand_index_key(section.semester, name)
+                    for name in DEMAND_INDEX_PARTITIONS + ["moments"]
+                ],
+                args=[
+                    section.id,
+                    get_demand_index_partition(section.status) if has_capacity else "",
+                    get_raw_demand(section) if has_capacity else 0,
+                ],
+                client=pipe,
+            )
+        for section in to_exclude:
+            pipe.sadd(demand_index_key(section.semester, "excluded"), section.id)
+        for section in to_unexclude:
+            pipe.srem(demand_index_key(section.semester, "excluded"), section.id)
+        pipe.execute()
+    except redis.exceptions.RedisError as e:
+        logger.error(f"Could not update demand index: {e}")
+
+
+def get_demand_index_extreme_sections(semester):
+    """
+    Returns a tuple (lowest_demand_section, highest_demand_section) of the Section objects
+    with the lowest and highest raw demand in the given semester according to the demand index,
+    each with a raw_demand attribute set (as if annotated). Raises Section.DoesNotExist if the
+    index is empty. Returns None if the index is disabled, unavailable or not built for the
+    given semester (or out of date), in which case the caller should query the database instead.
+    """
+    if not settings.DEMAND_INDEX_ENABLED:
+        return None
+    try:
+        pipe = r.pipeline(transaction=True)
+        pipe.exists(demand_index_key(semester, "built"))
+        for name in DEMAND_INDEX_PARTITIONS:
+            pipe.zrange(demand_index_key(semester, name), 0, 0, withscores=True)
+            pipe.zrange(demand_index_key(semester, name), -1, -1, withscores=True)
+        built, *ends = pipe.execute()
+    except redis.exceptions.RedisError as e:
+        logger.error(f"Could not read demand index: {e}")
+        return None
+    if not built:
+        return None
+    candidates = [(int(member), score) for end in ends for member, score in end]
+    if not candidates:
+        raise Section.DoesNotExist("The demand index is empty.")
+    lowest_id, lowest_raw_demand = min(candidates, key=lambda c: c[1])
+    highest_id, highest_raw_demand = max(candidates, key=lambda c: c[1])
+    sections = Section.objects.in_bulk([lowest_id, highest_id])
+    if lowest_id not in sections or highest_id not in sections:
+        return None
+    sections[lowest_id].raw_demand = lowest_raw_demand
+    sections[highest_id].raw_demand = highest_raw_demand
+    return sections[lowest_id], sections[highest_id]
+
+
+def get_demand_index_closed_raw_demands(semester):
+    """
+    Returns a list of the raw demands of all closed sections in the given semester according
+    to the demand index (in ascending order), or None if the index is disabled, unavailable
+    or not built for the given semester.
+    """
+    if not settings.DEMAND_INDEX_ENABLED:
+        return None
+    try:
+        pipe = r.pipeline(transaction=True)
+        pipe.exists(demand_index_key(semester, "built"))
+        pipe.zrange(demand_index_key(semester, "closed"), 0, -1, withscores=True)
+        built, closed = pipe.execute()
+    except redis.exceptions.RedisError as e:
+        logger.error(f"Could not read demand index: {e}")
+        return None
+    if not built:
+        return None
+    return [score for _, score in closed]
+
+
+def get_demand_index_closed_moments(semester):
+    """
+    Returns the ClosedDemandMoments of the closed sections in the given semester according
+    to the demand index, or None if the index is disabled, unavailable or not built for the
+    given semester.
+    """
+    if not settings.DEMAND_INDEX_ENABLED:
+        return None
+    try:
+        pipe = r.pipeline(transaction=True)
+        pipe.exists(demand_index_key(semester, "built"))
+        pipe.hmget(demand_index_key(semester, "moments"), CLOSED_MOMENTS_FIELDS)
+        built, moments = pipe.execute()
+    except redis.exceptions.RedisError as e:
+        logger.error(f"Could not read demand index: {e}")
+        return None
+    num_closed, num_positive, sum_log, sum_log_sq, shift = moments
+    if not built or any(value is None for value in [num_closed, num_positive, sum_log, sum_log_sq]):
+        return None
+    return ClosedDemandMoments(
+        num_closed=int(num_closed),
+        num_positive=int(num_positive),
+        sum_log=float(sum_log),
+        sum_log_sq=float(sum_log_sq),
+        shift=float(shift or 0),  # hashes built before the logs were shifted have no shift
+    )
@@ -0,0 +1,146 @@
+import logging
+
+import redis
+from django.conf import settings
+
+from courses.util import separate_course_code
+
+
+"""
+Alert Fan-out Deduplication
+===========================
+
+The registrar sometimes resends the same status transition, and the webhookbackup command may
+trigger alerts for transitions the webhook already handled, so the same transition can reach
+alert_for_course (in alert/views.py) more than once, possibly concurrently. When
+settings.ALERT_FANOUT_DEDUP_ENABLED is set, alert_for_course only queues a send_course_alerts
+fan-out if it can claim the transition with claim_alert_fanout first (and releases the claim
+with release_alert_fanout if the fan-out can't be queued, so the transition can be retried).
+
+A transition is identified by its section, its new status, and the time bucket (of
+settings.ALERT_FANOUT_DEDUP_WINDOW seconds) in which it happened. The last claimed transition of
+each section is stored in Redis and checked / replaced atomically by a Lua script, so of any
+number of concurrent or repeated triggers for the same transition, exactly one claims it.
+A trigger is a duplicate if the section's last claimed transition has the same new status and
+a bucket at most one bucket away (so duplicates straddling a bucket boundary are also caught);
+a claim for a different status (e.g. a close notification) replaces it, so a section
+that genuinely reopens right after closing is alerted again. Claimed and suppressed triggers
+are counted per semester (see get_alert_fanout_stats). If Redis is unavailable, every trigger
+is allowed through (as it would be with deduplication disabled).
+
+Webhook triggers are bucketed by the time the webhook request was received, but webhookbackup
+doesn't know when a transition happened, so its triggers are bucketed by the time it runs.
+So a webhookbackup trigger is only caught as a duplicate of the webhook's trigger for the same
+transition if it runs within one to two windows of it; otherwise, webhookbackup relies on its own
+check of the section's last status update (which the webhook records) to skip transitions the
+webhook already handled.
+"""
+
+logger = logging.getLogger(__name__)
+r = redis.Redis.from_url(settings.REDIS_URL)
+
+# KEYS: the section's last claim key, the semester's stats key
+# ARGV: the new status, the transition's time bucket, the claim's expiry (seconds)
+# Returns 1 if the transition was claimed, and 0 if it is a duplicate
+CLAIM_FANOUT_SCRIPT = """
+local claim = redis.call("GET", KEYS[1])
+if claim then
+    local status, bucket = string.match(claim, "^(.*):(%-?%d+)$")
+    if status == ARGV[1] and math.abs(tonumber(bucket) - tonumber(ARGV[2])) <= 1 then
+        redis.call("HINCRBY", KEYS[2], "suppressed", 1)
+        return 0
+    end
+end
+redis.call("SET", KEYS[1], ARGV[1] .. ":" .. ARGV[2], "EX", ARGV[3])
+redis.call("HINCRBY", KEYS[2], "claimed", 1)
+return 1
+"""
+claim_fanout = r.register_script(CLAIM_FANOUT_SCRIPT)
+
+# KEYS: the section's last claim key, the semester's stats key
+# ARGV: the new status, the transition's time bucket
+# Returns 1 if the claim was released, and 0 if the section's last claim is a different one
+RELEASE_FANOUT_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] .. ":" .. ARGV[2] then
+    redis.call("DEL", KEYS[1])
+    redis.call("HINCRBY", KEYS[2], "claimed", -1)
+    return 1
+end
+return 0
+"""
+release_fanout = r.register_script(RELEASE_FANOUT_SCRIPT)
+
+
+def alert_fanout_key(semester, full_code):
+    return f"alert_fanout:{semester}:{full_code}"
+
+
+def alert_fanout_stats_key(semester):
+    return f"alert_fanout:{semester}:stats"
+
+
+def get_alert_fanout_bucket(transition_at):
+    """
+    Returns the time bucket (an int) of a transition that happened at the given datetime.
+    """
+    return int(transition_at.timestamp() // settings.ALERT_FANOUT_DEDUP_WINDOW)
+
+
+def claim_alert_fanout(course_code, semester, course_status, transition_at):
+    """
+    Claims the alert fan-out for the transition of the given section (in the given semester)
+    to the given status at the given datetime. Returns True if the fan-out should be queued,
+    and False if it is a duplicate of an already claimed transition (always returns True if
+    deduplication is disabled or Redis is unavailable). Raises a ValueError if the given
+    course code cannot be parsed.
+    """
+    if not settings.ALERT_FANOUT_DEDUP_ENABLED:
+        return True
+    full_code = "-".join(separate_course_code(course_code))
+    try:
+        claimed = claim_fanout(
+            keys=[alert_fanout_key(semester, full_code), alert_fanout_stats_key(semester)],
+            args=[
+                course_status,
+                get_alert_fanout_bucket(transition_at),
+                3 * settings.ALERT_FANOUT_DEDUP_WINDOW,
+            ],
+        )
+    except redis.exceptions.RedisError as e:
+        logger.error(f"Could not deduplicate alert fan-out for {full_code}: {e}")
+        return True
+    if not claimed:
+        logger.info(f"Suppressed duplicate alert fan-out for {full_code} ({course_status})")
+    return bool(claimed)
+
+
+def release_alert_fanout(course_code, semester, course_status, transition_at):
+    """
+    Releases a claim made by claim_alert_fanout with the same arguments (e.g. if the claimed
+    fan-out could not be queued), so a later trigger for the same transition can claim it.
+    Does nothing if deduplication is disabled, the section's last claim is a different one,
+    or Redis is unavailable.
+    """
+    if not settings.ALERT_FANOUT_DEDUP_ENABLED:
+        return
+    full_code = "-".join(separate_course_code(course_code))
+    try:
+        release_fanout(
+            keys=[alert_fanout_key(semester, full_code), alert_fanout_stats_key(semester)],
+            args=[course_status, get_alert_fanout_bucket(transition_at)],
+        )
+    except redis.exceptions.RedisError as e:
+        logger.error(f"Could not release alert fan-out claim for {full_code}: {e}")
+
+
+def get_alert_fanout_stats(semester):
+    """
+    Returns a dict with the number of alert fan-outs `claimed` and duplicate fan-outs
+    `suppressed` for the given semester (or None values if Redis is unavailable).
+    """
+    try:
+        stats = r.hgetall(alert_fanout_stats_key(semester))
+    except redis.exceptions.RedisError as e:
+        logger.error(f"Could not read alert fan-out stats: {e}")
+        return {"claimed": None, "suppressed": None}
+    return {name: int(stats.get(name.encode(), 0)) for name in ["claimed", "suppressed"]}
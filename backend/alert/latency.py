@@ -0,0 +1,164 @@
+import json
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone as dj_timezone
+
+from alert.models import AlertLatencyTrace
+
+
+"""
+Alert Latency Tracing
+=====================
+
+When settings.ALERT_LATENCY_TRACING_ENABLED is set, each alert fan-out triggered by a registrar
+webhook request records the time of each of its stages in an AlertLatencyTrace object:
+the webhook request was received, its StatusUpdate was committed, send_course_alerts started,
+and (for each alert) the alert was started, and each channel's provider accepted it.
+
+A trace is a small JSON-serializable dict (returned by start_alert_trace) which is passed
+through alert_for_course to send_course_alerts and on to the send_alert tasks / batches, so
+each stage can compute its offset from the time the webhook request was received locally.
+Per-alert samples are appended to the trace's row with a single UPDATE per send_alert task
+(or per batch, with batch dispatch). The alertlatency management command and the admin-only
+alert latency endpoint report percentiles of these offsets per channel and semester.
+"""
+
+ALERT_SAMPLE_FIELDS = ["alert_started", "email", "text", "push"]
+LATENCY_STAGES = ["status_update_committed", "course_alerts_started"] + ALERT_SAMPLE_FIELDS
+LATENCY_PERCENTILES = (50, 90, 99)
+
+
+def start_alert_trace(full_code, semester, course_status, received_at):
+    """
+    Creates an AlertLatencyTrace for an alert fan-out triggered by a webhook request received
+    at the given datetime, and returns the trace to pass along the fan-out, or None if
+    tracing is disabled.
+    """
+    if not settings.ALERT_LATENCY_TRACING_ENABLED or received_at is None:
+        return None
+    trace = AlertLatencyTrace.objects.create(
+        full_code=full_code,
+        semester=semester,
+        course_status=course_status,
+        webhook_received_at=received_at,
+    )
+    return {"id": trace.id, "received_at": received_at.timestamp()}
+
+
+def get_offset_ms(trace, timestamp=None):
+    """
+    Returns the offset in milliseconds of the given timestamp (a float as returned by
+    time.time(), or the current time if None) from the time the trace's webhook was received.
+    """
+    if timestamp is None:
+        timestamp = time.time()
+    return int(round((timestamp - trace["received_at"]) * 1000))
+
+
+def record_trace_stage(trace, stage):
+    """
+    Records that the given stage ("status_update_committed" or "course_alerts_started")
+    of the given trace happened now. Does nothing if trace is None.
+    """
+    if trace is None:
+        return
+    AlertLatencyTrace.objects.filter(id=trace["id"]).update(**{f"{stage}_ms": get_offset_ms(trace)})
+
+
+def record_alert_samples(trace, samples):
+    """
+    Appends the given per-alert samples to the given trace with a single UPDATE, where each
+    sample is a tuple `(started_at, accepted_at)` of the time the alert was started and a dict
+    mapping each channel that accepted the alert to the time it did (as returned by time.time()).
+    Does nothing if trace is None.
+    """
+    if trace is None or not samples:
+        return
+    rows = [
+        [get_offset_ms(trace, started_at)]
+        + [
+            get_offset_ms(trace, accepted_at[channel]) if channel in accepted_at else None
+            for channel in ALERT_SAMPLE_FIELDS[1:]
+        ]
+        for started_at, accepted_at in samples
+    ]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            UPDATE {AlertLatencyTrace._meta.db_table}
+            SET alerts = alerts || %s::jsonb
+            WHERE id = %s
+            """,
+            [json.dumps(rows), trace["id"]],
+        )
+
+
+def get_latency_samples(traces):
+    """
+    Returns a dict mapping each of the LATENCY_STAGES to a list of its offsets (in ms)
+    in the given AlertLatencyTrace objects.
+    """
+    samples = {stage: [] for stage in LATENCY_STAGES}
+    for trace in traces:
+        for stage in LATENCY_STAGES[:2]:
+            if getattr(trace, f"{stage}_ms") is not None:
+                samples[stage].append(getattr(trace, f"{stage}_ms"))
+        for row in trace.alerts:
+            for field, offset in zip(ALERT_SAMPLE_FIELDS, row):
+                if offset is not None:
+                    samples[field].append(offset)
+    return samples
+
+
+def summarize_latencies(offsets, percentiles=LATENCY_PERCENTILES):
+    """
+    Returns a dict with the count and the given percentiles of the given list of offsets
+    (with None percentiles if the list is empty).
+    """
+    summary = {"count": len(offsets)}
+    for p in percentiles:
+        summary[f"p{p}"] = float(np.percentile(offsets, p)) if offsets else None
+    return summary
+
+
+def get_alert_latency_percentiles(traces, percentiles=LATENCY_PERCENTILES):
+    """
+    Returns a dict mapping each semester of the given AlertLatencyTrace objects (a queryset) to a
+    dict mapping each of the LATENCY_STAGES to a summary (see summarize_latencies) of its
+    latencies (in ms from when the triggering webhook request was received) in that semester.
+    """
+    by_semester = dict()
+    for trace in traces.order_by("semester"):
+        by_semester.setdefault(trace.semester, []).append(trace)
+    return {
+        semester: {
+            stage: summarize_latencies(offsets, percentiles)
+            for stage, offsets in get_latency_samples(semester_traces).items()
+        }
+        for semester, semester_traces in by_semester.items()
+    }
+
+
+def get_alert_latency_traces(semesters, days=None):
+    """
+    Returns a queryset of the AlertLatencyTrace objects from the given semesters
+    (only those from the last `days` days, if days is given).
+    """
+    traces = AlertLatencyTrace.objects.filter(semester__in=semesters)
+    if days is not None:
+        traces = traces.filter(webhook_received_at__gte=dj_timezone.now() - timedelta(days=days))
+    return traces
+
+
+def traces_since(received_at):
+    """
+    Returns a queryset of the AlertLatencyTrace objects for webhook requests received at or after
+    the given timestamp (a float as returned by time.time()).
+    """
+    return AlertLatencyTrace.objects.filter(
+        webhook_received_at__gte=datetime.fromtimestamp(received_at, tz=timezone.utc)
+    )
@@ -0,0 +1,70 @@
+import json
+from textwrap import dedent
+
+from django.core.management.base import BaseCommand
+
+from alert.latency import (
+    LATENCY_PERCENTILES,
+    get_alert_latency_percentiles,
+    get_alert_latency_traces,
+)
+from alert.management.commands.recomputestats import get_semesters
+
+
+class Command(BaseCommand):
+    help = dedent(
+        """
+    Report percentiles of the latency (in milliseconds from when the triggering webhook request
+    was received) of each stage of alert fan-outs, per channel and semester, from the
+    AlertLatencyTrace objects recorded while settings.ALERT_LATENCY_TRACING_ENABLED is set
+    (see alert/latency.py).
+    """
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--semesters",
+            type=str,
+            help=dedent(
+                """
+                The semesters argument should be a comma-separated list of semesters
+            corresponding to the semesters for which you want to report alert latencies,
+            i.e. "2019C,2020A,2020C" for fall 2019, spring 2020, and fall 2020. If you pass "all"
+            to this argument, this script will report latencies for all semesters.
+            Defaults to the current semester.
+                """
+            ),
+            nargs="?",
+            default=None,
+        )
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=None,
+            help="If specified, only alerts triggered in the last this many days are included.",
+        )
+        parser.add_argument(
+            "--json",
+            action="store_true",
+            help="Print the report as JSON (rather than as a table).",
+        )
+
+    def handle(self, *args, **kwargs):
+        semesters = get_semesters(semesters=kwargs["semesters"])
+        report = get_alert_latency_percentiles(
+            get_alert_latency_traces(semesters, days=kwargs["days"])
+        )
+
+        if kwargs["json"]:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        if not report:
+            self.stdout.write(f"No alert latency traces found for semesters {semesters}.")
+            return
+        columns = ["count"] + [f"p{p}" for p in LATENCY_PERCENTILES]
+        for semester, stages in report.items():
+            self.stdout.write(f"{semester} (ms from webhook received):")
+            self.stdout.write(f"  {'stage':<24}" + "".join(f"{c:>10}" for c in columns))
+            for stage, summary in stages.items():
+                values = ["-" if summary[c] is None else f"{summary[c]:.0f}" for c in columns]
+                self.stdout.write(f"  {stage:<24}" + "".join(f"{v:>10}" for v in values))
@@ -8,6 +8,7 @@ from django.db.models import Q
 from django.utils import timezone
 
 from alert.models import Registration
+from alert.tasks import get_section_demand_change_stats
 from courses.models import StatusUpdate
 from courses.util import get_current_semester
 
@@ -29,7 +30,8 @@ class Command(BaseCommand):
 
         start = timezone.now() - timezone.timedelta(days=days)
 
-        qs = Registration.objects.filter(section__course__semester=get_current_semester())
+        semester = get_current_semester()
+        qs = Registration.objects.filter(semester=semester)
 
         num_registrations = qs.filter(created_at__gte=start, resubscribed_from__isnull=True).count()
         num_alerts_sent = qs.filter(notification_sent=True, notification_sent_at__gte=start).count()
@@ -38,7 +40,7 @@ class Command(BaseCommand):
         ).count()
         num_status_updates = StatusUpdate.objects.filter(created_at__gte=start).count()
         num_active_perpetual = qs.filter(
-            resubscribed_to__isnull=True,
+            is_head=True,
             auto_resubscribe=True,
             deleted=False,
             cancelled=False,
@@ -46,12 +48,15 @@ class Command(BaseCommand):
         ).count()
         num_cancelled_perpetual = (
             qs.filter(
-                resubscribed_to__isnull=True,
+                is_head=True,
                 auto_resubscribe=True,
             )
             .filter(Q(deleted=True) | Q(cancelled=True))
             .count()
         )
+        demand_change_stats = get_section_demand_change_stats(semester)
+        num_demand_recomputations = demand_change_stats["recomputations"]
+        num_demand_triggers_merged = demand_change_stats["merged"]
 
         message = dedent(
             f"""
@@ -63,6 +68,8 @@ class Command(BaseCommand):
         Active auto-resubscribe requests: {num_active_perpetual}
         Cancelled auto-resubscribe requests: {num_cancelled_perpetual}
         Status Updates from Penn InTouch: {num_status_updates}
+        Demand recomputations since last cache reset: {num_demand_recomputations}
+        Demand change triggers merged since last cache reset: {num_demand_triggers_merged}
         """
         )
 
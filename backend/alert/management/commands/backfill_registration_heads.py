@@ -0,0 +1,100 @@
+from textwrap import dedent
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Exists, OuterRef, Q
+
+from alert.management.commands.recomputestats import get_semesters
+from alert.models import Registration
+
+
+# Sets the is_head column of each registration from the given semesters (%(semesters)s)
+# that doesn't already have the right value (a registration is the head of its resubscribe
+# chain iff no other registration was resubscribed from it)
+REGISTRATION_HEADS_BACKFILL_SQL = f"""
+UPDATE {Registration._meta.db_table} AS t
+SET is_head = NOT EXISTS (
+    SELECT 1 FROM {Registration._meta.db_table} AS s WHERE s.resubscribed_from_id = t.id
+)
+WHERE t.semester = ANY(%(semesters)s)
+    AND t.is_head IS DISTINCT FROM NOT EXISTS (
+        SELECT 1 FROM {Registration._meta.db_table} AS s WHERE s.resubscribed_from_id = t.id
+    )
+"""
+
+
+def find_inconsistent_registration_heads(semesters):
+    """
+    Returns the number of registrations from the given semesters whose is_head column
+    doesn't match whether they have been resubscribed to.
+    """
+    return (
+        Registration.objects.filter(semester__in=semesters)
+        .annotate(
+            has_successor=Exists(Registration.objects.filter(resubscribed_from_id=OuterRef("id")))
+        )
+        .filter(Q(is_head=True, has_successor=True) | Q(is_head=False, has_successor=False))
+        .count()
+    )
+
+
+def backfill_registration_heads(semesters):
+    """
+    Sets the is_head column of all registrations from the given semesters (that don't already
+    have the right value). Returns the number of registrations updated.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(REGISTRATION_HEADS_BACKFILL_SQL, {"semesters": list(semesters)})
+        return cursor.rowcount
+
+
+class Command(BaseCommand):
+    help = dedent(
+        """
+    Backfill (or check) the is_head column of registrations, which marks the head of each
+    resubscribe chain (the registration that hasn't been resubscribed to). The migration adding
+    this column backfills it, and it is automatically maintained when registrations are saved,
+    resubscribed, or bulk loaded, so this script only needs to be run if rows were written
+    some other way (e.g. with raw SQL). Pass --check to report inconsistent rows without
+    modifying the database (the command fails if any are found).
+    """
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--semesters",
+            type=str,
+            help=dedent(
+                """
+                The semesters argument should be a comma-separated list of semesters
+            corresponding to the semesters for which you want to backfill/check the is_head
+            column, i.e. "2019C,2020A,2020C" for fall 2019, spring 2020, and fall 2020.
+            If you pass "all" to this argument (the default), this script will backfill/check
+            registrations from all semesters.
+                """
+            ),
+            nargs="?",
+            default="all",
+        )
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Only check for inconsistent rows (don't modify the database).",
+        )
+
+    def handle(self, *args, **kwargs):
+        semesters = get_semesters(semesters=kwargs["semesters"])
+
+        if kwargs["check"]:
+            num_inconsistent = find_inconsistent_registration_heads(semesters)
+            if num_inconsistent:
+                raise CommandError(
+                    f"Found {num_inconsistent} registrations with an inconsistent is_head column. "
+                    "Run this command without --check to fix them."
+                )
+            print("All registration is_head columns are consistent.")
+            return
+
+        print(f"Backfilling registration is_head columns for semesters {semesters}...")
+        num_updated = backfill_registration_heads(semesters)
+        print(f"Updated {num_updated} registrations.")
@@ -81,10 +81,9 @@ class Command(BaseCommand):
             )
             for registration in tqdm(
                 Registration.objects.filter(
-                    section__course__semester__in=semesters,
+                    semester__in=semesters,
                     section__course__full_code__startswith=kwargs["courses_query"],
                 ).annotate(
-                    efficient_semester=F("section__course__semester"),
                     section_full_code=F("section__full_code"),
                 )
             ):
@@ -119,7 +118,7 @@ class Command(BaseCommand):
                         str(field)
                         for field in [
                             registration.section_full_code,
-                            registration.efficient_semester,
+                            registration.semester,
                             registration.created_at.strftime("%Y-%m-%d %H:%M:%S.%f %Z"),
                             original_created_at,
                             registration.id,
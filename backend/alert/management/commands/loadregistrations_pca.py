@@ -67,87 +67,71 @@ class Command(BaseCommand):
             for section_ob in section_obs:
                 sections_map[section_ob.full_code, section_ob.efficient_semester] = section_ob.id
 
-        id_corrections = dict()
         semesters = set()
-        registrations = []
-        with transaction.atomic():
-            with open(src) as data_file:
-                i = 0
-                data_reader = csv.reader(data_file, delimiter=",", quotechar='"')
-
-                for row in tqdm(data_reader, total=row_count):
-                    i += 1
-                    if len(row) != 12:
-                        print(f"\nRow found with {len(row)} (!=12) columns.")
-                        print(
-                            f"For the above reason, row {i} (1-indexed) of {src} is invalid:\n"
-                            f"{row}\n(Not necessarily helpful reminder: Columns must be:\n"
-                            "registration.section.full_code, registration.section.semester, "
-                            "registration.created_at (%Y-%m-%d %H:%M:%S.%f %Z), "
-                            "registration.original_created_at (%Y-%m-%d %H:%M:%S.%f %Z), "
-                            "registration.id, resubscribed_from_id, "
-                            "registration.notification_sent, "
-                            "notification_sent_at (%Y-%m-%d %H:%M:%S.%f %Z), "
-                            "registration.cancelled, "
-                            "registration.cancelled_at (%Y-%m-%d %H:%M:%S.%f %Z), "
-                            "registration.deleted, "
-                            "registration.deleted_at (%Y-%m-%d %H:%M:%S.%f %Z)"
-                            ")\n\nInvalid input; no registrations were added to the database.\n"
-                        )
-                        return False
-
-                    full_code = row[0]
-                    semester = row[1]
-                    if (full_code, semester) not in sections_map:
-                        raise ValueError(f"Section {full_code} {semester} not found in database.")
-                    semesters.add(semester)
-
-                    original_id = row[4]
-                    resubscribed_from_id = row[5]
-                    if resubscribed_from_id == "" or resubscribed_from_id == "None":
-                        resubscribed_from_id = None
-
-                    def extract_date(dt_string):
-                        if dt_string is None or dt_string == "" or dt_string == "None":
-                            return None
-                        dt = datetime.strptime(dt_string, "%Y-%m-%d %H:%M:%S.%f %Z")
-                        return make_aware(dt, timezone=gettz(TIME_ZONE), is_dst=None)
-
-                    registration_dict = dict()  # fields to unpack into Registration initialization
-                    registration_dict["section_id"] = sections_map[full_code, semester]
-                    registration_dict["source"] = "SCRIPT_PCA"
-                    registration_dict["created_at"] = extract_date(row[2])
-                    registration_dict["original_created_at"] = extract_date(row[3])
-                    registration_dict["notification_sent"] = bool(row[6])
-                    registration_dict["notification_sent_at"] = extract_date(row[7])
-                    registration_dict["cancelled"] = bool(row[8])
-                    registration_dict["cancelled_at"] = extract_date(row[9])
-                    registration_dict["deleted"] = bool(row[10])
-                    registration_dict["deleted_at"] = extract_date(row[11])
-
-                    registration = Registration(**registration_dict)
-                    registration.save(load_script=True)
-                    registration.created_at = registration_dict["created_at"]
-                    registration.save(load_script=True)
-                    id_corrections[original_id] = registration.id
-                    registrations.append((registration, original_id, resubscribed_from_id))
-
-            print("Connecting resubscribe chains...")
+        rows = []
+        with open(src) as data_file:
+            i = 0
+            data_reader = csv.reader(data_file, delimiter=",", quotechar='"')
 
-            to_save = []
-            for registration, original_id, resubscribed_from_id in registrations:
-                if resubscribed_from_id is not None:
-                    registration.resubscribed_from_id = id_corrections[resubscribed_from_id]
-                    to_save.append(registration)
-            Registration.objects.bulk_update(to_save, ["resubscribed_from_id"])
-            to_save = []
-            for registration, _, _ in tqdm(registrations):
-                head_registration = registration.get_most_current_iter()
-                if registration.head_registration != head_registration:
-                    registration.head_registration = head_registration
-                    to_save.append(registration)
-            Registration.objects.bulk_update(to_save, ["head_registration"])
+            for row in tqdm(data_reader, total=row_count):
+                i += 1
+                if len(row) != 12:
+                    print(f"\nRow found with {len(row)} (!=12) columns.")
+                    print(
+                        f"For the above reason, row {i} (1-indexed) of {src} is invalid:\n"
+                        f"{row}\n(Not necessarily helpful reminder: Columns must be:\n"
+                        "registration.section.full_code, registration.section.semester, "
+                        "registration.created_at (%Y-%m-%d %H:%M:%S.%f %Z), "
+                        "registration.original_created_at (%Y-%m-%d %H:%M:%S.%f %Z), "
+                        "registration.id, resubscribed_from_id, "
+                        "registration.notification_sent, "
+                        "notification_sent_at (%Y-%m-%d %H:%M:%S.%f %Z), "
+                        "registration.cancelled, "
+                        "registration.cancelled_at (%Y-%m-%d %H:%M:%S.%f %Z), "
+                        "registration.deleted, "
+                        "registration.deleted_at (%Y-%m-%d %H:%M:%S.%f %Z)"
+                        ")\n\nInvalid input; no registrations were added to the database.\n"
+                    )
+                    return False
+
+                full_code = row[0]
+                semester = row[1]
+                if (full_code, semester) not in sections_map:
+                    raise ValueError(f"Section {full_code} {semester} not found in database.")
+                semesters.add(semester)
+
+                resubscribed_from_id = row[5]
+                if resubscribed_from_id == "" or resubscribed_from_id == "None":
+                    resubscribed_from_id = None
+
+                def extract_date(dt_string):
+                    if dt_string is None or dt_string == "" or dt_string == "None":
+                        return None
+                    dt = datetime.strptime(dt_string, "%Y-%m-%d %H:%M:%S.%f %Z")
+                    return make_aware(dt, timezone=gettz(TIME_ZONE), is_dst=None)
+
+                rows.append(
+                    {
+                        # see Registration.bulk_load
+                        "load_id": row[4],
+                        "resubscribed_from": resubscribed_from_id,
+                        "section_id": sections_map[full_code, semester],
+                        "semester": semester,
+                        "source": "SCRIPT_PCA",
+                        "created_at": extract_date(row[2]),
+                        "original_created_at": extract_date(row[3]),
+                        "notification_sent": bool(row[6]),
+                        "notification_sent_at": extract_date(row[7]),
+                        "cancelled": bool(row[8]),
+                        "cancelled_at": extract_date(row[9]),
+                        "deleted": bool(row[10]),
+                        "deleted_at": extract_date(row[11]),
+                    }
+                )
 
+        with transaction.atomic():
+            print("Inserting registrations and connecting resubscribe chains...")
+            registrations = Registration.bulk_load(rows)
             print(f"Done! {len(registrations)} registrations added to database.")
 
             print(
@@ -1,17 +1,19 @@
+import heapq
 import logging
 from textwrap import dedent
 
-import numpy as np
-import scipy.stats as stats
+from django.conf import settings
 from django.core.cache import cache
 from django.core.exceptions import ValidationError
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from django.db import connection, transaction
 from django.db.models import Count, F, OuterRef, Q, Subquery, Value
 from django.db.models.functions import Coalesce
 from django.utils import timezone
 from tqdm import tqdm
 
+from alert.demand_fit import ClosedDemandMoments, fit_closed_demand_distribution
+from alert.demand_index import rebuild_demand_index
 from alert.models import (
     PcaDemandDistributionEstimate,
     Registration,
@@ -26,12 +28,18 @@ from courses.models import Course, Meeting, StatusUpdate, Topic
 from courses.util import (
     get_current_semester,
     get_or_create_add_drop_period,
+    recompute_last_status_updates,
     subquery_count_distinct,
 )
 from PennCourses.settings.base import ROUGH_MINIMUM_DEMAND_DISTRIBUTION_ESTIMATES
 from review.views import extra_metrics_section_filters
 
 
+# The number of demand distribution estimates to hold in memory (and insert at a time)
+# while recomputing a semester's estimates
+ESTIMATES_CHUNK_SIZE = 5000
+
+
 def all_semesters():
     return set(Course.objects.values_list("semester", flat=True).distinct())
 
@@ -120,6 +128,7 @@ def recompute_precomputed_fields(verbose=False):
         - Section.num_meetings
         - Section.has_reviews
         - Section.has_status_updates
+        - Section.last_status_update (and last_status_update_at / last_status_update_new_status)
 
     :param verbose: Set to True if you want this script to print its status as it goes,
         or keep as False (default) if you want the script to work silently.
@@ -139,6 +148,9 @@ def recompute_precomputed_fields(verbose=False):
     if verbose:
         print("\tRecomputing Section.has_status_updates")
     recompute_has_status_updates()
+    if verbose:
+        print("\tRecomputing Section.last_status_update")
+    recompute_last_status_updates()
 
     if verbose:
         print("Done recomputing precomputed fields.")
@@ -185,8 +197,10 @@ def deduplicate_status_updates(semesters=None, verbose=False, semesters_precompu
                 last_update = None
                 ids_to_remove = []  # IDs of redundant status updates to remove
 
-                for update in StatusUpdate.objects.filter(section_id=section_id).order_by(
-                    "created_at"
+                for update in (
+                    StatusUpdate.objects.filter(section_id=section_id)
+                    .defer("request_body")
+                    .order_by("created_at")
                 ):
                     if (
                         last_update
@@ -199,6 +213,7 @@ def deduplicate_status_updates(semesters=None, verbose=False, semesters_precompu
 
                 num_removed += len(ids_to_remove)
                 StatusUpdate.objects.filter(id__in=ids_to_remove).delete()
+            recompute_last_status_updates(semesters=[semester])
             print(
                 f"Removed {num_removed} duplicate status update objects from semester {semester}."
             )
@@ -245,15 +260,19 @@ def recompute_percent_open(semesters=None, verbose=False, semesters_precomputed=
             add_drop_start = add_drop.estimated_start
             add_drop_end = add_drop.estimated_end
 
-            StatusUpdate.objects.filter(section__course__semester=semester).select_for_update()
+            StatusUpdate.objects.filter(semester=semester).select_for_update()
 
             sections = Section.objects.filter(course__semester=semester)
             num_erroneous_updates = 0
             num_total_updates = 0
             for section in sections:
-                status_updates = StatusUpdate.objects.filter(
-                    section=section, created_at__gt=add_drop_start, created_at__lt=add_drop_end
-                ).order_by("created_at")
+                status_updates = (
+                    StatusUpdate.objects.filter(
+                        section=section, created_at__gt=add_drop_start, created_at__lt=add_drop_end
+                    )
+                    .defer("request_body")
+                    .order_by("created_at")
+                )
                 num_total_updates += len(status_updates)
                 total_open_seconds = 0
                 if not status_updates.exists():
@@ -297,9 +316,13 @@ def recompute_percent_open(semesters=None, verbose=False, semesters_precomputed=
         print(f"Finished recomputing open percentages for semesters {str(semesters)}.")
 
 
-def recompute_registration_volumes(semesters=None, semesters_precomputed=False, verbose=False):
+def recompute_registration_volumes(
+    semesters=None, semesters_precomputed=False, verbose=False, section_ids=None
+):
     """
-    Recomputes the registration_volume fields for all sections in the given semester(s).
+    Recomputes the registration_volume fields for all sections in the given semester(s)
+    (or only for the sections with the given ids, if section_ids is given, in which case
+    the semesters argument is ignored).
 
     :param semesters: The semesters argument should be a comma-separated list of string semesters
         corresponding to the semesters for which you want to recompute demand distribution
@@ -313,20 +336,29 @@ def recompute_registration_volumes(semesters=None, semesters_precomputed=False,
         individual string semesters.
     :param verbose: Set to True if you want this script to print its status as it goes,
         or keep as False (default) if you want the script to work silently.
+    :param section_ids: If given, only the registration_volume fields of the sections
+        with these ids are recomputed.
     """
 
-    semesters = (
-        semesters if semesters_precomputed else get_semesters(semesters=semesters, verbose=verbose)
-    )
-
-    if verbose:
-        print(f"Computing most recent registration volumes for semesters {semesters} ...")
+    if section_ids is not None:
+        sections = Section.objects.filter(id__in=section_ids)
+    else:
+        semesters = (
+            semesters
+            if semesters_precomputed
+            else get_semesters(semesters=semesters, verbose=verbose)
+        )
+        if verbose:
+            print(f"Computing most recent registration volumes for semesters {semesters} ...")
+        sections = Section.objects.filter(course__semester__in=semesters)
     with transaction.atomic():
-        Section.objects.filter(course__semester__in=semesters).select_for_update().update(
+        sections.select_for_update().update(
             registration_volume=Coalesce(
                 Subquery(
                     Registration.objects.filter(
-                        section__id=OuterRef("id"), **Registration.is_active_filter()
+                        section__id=OuterRef("id"),
+                        is_head=True,  # active registrations are heads (uses the partial index)
+                        **Registration.is_active_filter(),
                     )
                     .annotate(common=Value(1))
                     .values("common")
@@ -338,8 +370,62 @@ def recompute_registration_volumes(semesters=None, semesters_precomputed=False,
         )
 
 
+class DemandExtrema:
+    """
+    Tracks the lowest and highest demand sections of a semester as their demands change, with
+    lazy-deletion min / max heaps: each update pushes the section's new demand onto both heaps,
+    and entries that no longer match a section's current demand are only discarded once they
+    reach the top of a heap. So updates and queries take amortized O(log n) time, rather than
+    the O(n) of a scan over all sections. Ties are broken by the order of the sections in the
+    given demands dict, as `min` / `max` over the dict would.
+    """
+
+    def __init__(self, demands):
+        """
+        :param demands: A dict mapping section id to demand, which should be updated in place
+            (calling `update` after each change).
+        """
+        self.demands = demands
+        self.order = {section_id: i for i, section_id in enumerate(demands)}
+        self.rebuild()
+
+    def rebuild(self):
+        self.min_heap = [(d, self.order[s], s) for s, d in self.demands.items()]
+        self.max_heap = [(-d, self.order[s], s) for s, d in self.demands.items()]
+        heapq.heapify(self.min_heap)
+        heapq.heapify(self.max_heap)
+
+    def update(self, section_id):
+        """
+        Records the current demand of the given section (from the demands dict).
+        """
+        demand = self.demands[section_id]
+        heapq.heappush(self.min_heap, (demand, self.order[section_id], section_id))
+        heapq.heappush(self.max_heap, (-demand, self.order[section_id], section_id))
+        if len(self.min_heap) > 4 * len(self.demands):
+            self.rebuild()  # bound the number of stale entries
+
+    @staticmethod
+    def peek(heap, sign, demands):
+        while sign * heap[0][0] != demands[heap[0][2]]:
+            heapq.heappop(heap)  # stale entry
+        return heap[0][2]
+
+    def lowest(self):
+        """
+        Returns the id of the section with the lowest demand.
+        """
+        return self.peek(self.min_heap, 1, self.demands)
+
+    def highest(self):
+        """
+        Returns the id of the section with the highest demand.
+        """
+        return self.peek(self.max_heap, -1, self.demands)
+
+
 def recompute_demand_distribution_estimates(
-    semesters=None, semesters_precomputed=False, verbose=False
+    semesters=None, semesters_precomputed=False, verbose=False, chunk_size=ESTIMATES_CHUNK_SIZE
 ):
     """
     This script recomputes all PcaDemandDistributionEstimate objects for the given semester(s)
@@ -359,6 +445,9 @@ def recompute_demand_distribution_estimates(
         individual string semesters.
     :param verbose: Set to True if you want this script to print its status as it goes,
         or keep as False (default) if you want the script to work silently.
+    :param chunk_size: The new PcaDemandDistributionEstimate objects for each semester are built
+        in memory (with their add/drop period fields set) and inserted with bulk_create in chunks
+        of this many objects, so at most this many are held in memory at once.
     """
 
     current_semester = get_current_semester()
@@ -419,7 +508,9 @@ def recompute_demand_distribution_estimates(
             if verbose:
                 print("Computing registration volume changes over time for each section...")
             for registration in iterator_wrapper(
-                Registration.objects.filter(section_id__in=section_id_to_object.keys())
+                Registration.objects.filter(
+                    semester=semester, section_id__in=section_id_to_object.keys()
+                )
                 .annotate(section_capacity=F("section__capacity"))
                 .select_for_update()
             ):
@@ -437,8 +528,12 @@ def recompute_demand_distribution_estimates(
                 print("Collecting status updates over time for each section...")
             for status_update in iterator_wrapper(
                 StatusUpdate.objects.filter(
-                    section_id__in=section_id_to_object.keys(), in_add_drop_period=True
-                ).select_for_update()
+                    semester=semester,
+                    section_id__in=section_id_to_object.keys(),
+                    in_add_drop_period=True,
+                )
+                .defer("request_body")
+                .select_for_update()
             ):
                 section_id = status_update.section_id
                 status_updates_map[section_id].append(
@@ -468,8 +563,10 @@ def recompute_demand_distribution_estimates(
 
             # Initialize variables to be maintained in our main all_changes loop
             latest_popularity_dist_estimate = None
+            new_estimates = []  # estimates not yet inserted (see chunk_size)
             registration_volumes = {section_id: 0 for section_id in section_id_to_object.keys()}
             demands = {section_id: 0 for section_id in section_id_to_object.keys()}
+            demand_extrema = DemandExtrema(demands)
 
             # Initialize section statuses
             section_status = {section_id: None for section_id in section_id_to_object.keys()}
@@ -479,6 +576,19 @@ def recompute_demand_distribution_estimates(
                     if section_status[section_id] is None:
                         section_status[section_id] = change["old_status"]
 
+            # Maintain the moments of closed section demands (for the lognormal fit)
+            closed_demand_moments = ClosedDemandMoments()
+            for section_id, status in section_status.items():
+                if status == "C":
+                    closed_demand_moments.add(demands[section_id])
+
+            def set_section_status(section_id, status):
+                if section_status[section_id] == "C":
+                    closed_demand_moments.remove(demands[section_id])
+                section_status[section_id] = status
+                if status == "C":
+                    closed_demand_moments.add(demands[section_id])
+
             percent_through = (
                 add_drop_period.get_percent_through_add_drop(timezone.now())
                 if semester == current_semester
@@ -502,22 +612,28 @@ def recompute_demand_distribution_estimates(
                 section_id = change["section_id"]
 
                 if section_status[section_id] is None:
-                    section_status[section_id] = (
-                        "O" if section_id_to_object[section_id].percent_open > 0.5 else "C"
+                    set_section_status(
+                        section_id,
+                        "O" if section_id_to_object[section_id].percent_open > 0.5 else "C",
                     )
                 if change["type"] == "status_update":
-                    section_status[section_id] = change["new_status"]
+                    set_section_status(section_id, change["new_status"])
                     continue
 
                 date = change["date"]
                 volume_change = change["volume_change"]
                 registration_volumes[section_id] += volume_change
+                if section_status[section_id] == "C":
+                    closed_demand_moments.remove(demands[section_id])
                 demands[section_id] = (
                     registration_volumes[section_id] / section_id_to_object[section_id].capacity
                 )
+                if section_status[section_id] == "C":
+                    closed_demand_moments.add(demands[section_id])
+                demand_extrema.update(section_id)
 
-                max_id = max(demands.keys(), key=lambda x: demands[x])
-                min_id = min(demands.keys(), key=lambda x: demands[x])
+                max_id = demand_extrema.highest()
+                min_id = demand_extrema.lowest()
                 if (
                     latest_popularity_dist_estimate is None
                     or section_id == latest_popularity_dist_estimate.highest_demand_section_id
@@ -527,21 +643,17 @@ def recompute_demand_distribution_estimates(
                     or num_changes_without_estimate >= distribution_estimate_threshold
                 ):
                     num_changes_without_estimate = 0
-                    closed_sections_demand_values = np.asarray(
-                        [val for sec_id, val in demands.items() if section_status[sec_id] == "C"]
-                    )
-                    csrdv_frac_zero, fit_shape, fit_loc, fit_scale = (None, None, None, None)
-                    if len(closed_sections_demand_values) > 0:
-                        closed_sections_positive_demand_values = closed_sections_demand_values[
-                            np.where(closed_sections_demand_values > 0)
-                        ]
-                        csrdv_frac_zero = 1 - len(closed_sections_positive_demand_values) / len(
-                            closed_sections_demand_values
+                    if settings.DEMAND_DISTRIBUTION_FULL_LOGNORM_FIT:
+                        closed_demand_fit = fit_closed_demand_distribution(
+                            [
+                                val
+                                for sec_id, val in demands.items()
+                                if section_status[sec_id] == "C"
+                            ]
                         )
-                        if len(closed_sections_positive_demand_values) > 0:
-                            fit_shape, fit_loc, fit_scale = stats.lognorm.fit(
-                                closed_sections_positive_demand_values
-                            )
+                    else:
+                        closed_demand_fit = closed_demand_moments.estimate()
+                    csrdv_frac_zero, fit_shape, fit_loc, fit_scale = closed_demand_fit
 
                     latest_popularity_dist_estimate = PcaDemandDistributionEstimate(
                         created_at=date,
@@ -555,11 +667,14 @@ def recompute_demand_distribution_estimates(
                         csprdv_lognorm_param_loc=fit_loc,
                         csprdv_lognorm_param_scale=fit_scale,
                     )
-                    latest_popularity_dist_estimate.save(add_drop_period=add_drop_period)
-                    latest_popularity_dist_estimate.created_at = date
-                    latest_popularity_dist_estimate.save(add_drop_period=add_drop_period)
+                    latest_popularity_dist_estimate.set_add_drop_fields(add_drop_period)
+                    new_estimates.append(latest_popularity_dist_estimate)
+                    if len(new_estimates) >= chunk_size:
+                        PcaDemandDistributionEstimate.objects.bulk_create(new_estimates)
+                        new_estimates = []
                 else:
                     num_changes_without_estimate += 1
+            PcaDemandDistributionEstimate.objects.bulk_create(new_estimates)
 
             if set_cache:
                 if latest_popularity_dist_estimate is not None:
@@ -571,6 +686,11 @@ def recompute_demand_distribution_estimates(
                 else:
                     cache.set("current_demand_distribution_estimate", None, timeout=None)
 
+    if current_semester in semesters:
+        if verbose:
+            print(f"Rebuilding demand index for semester {current_semester}...")
+        rebuild_demand_index(current_semester)
+
     if verbose:
         print(
             "Finished recomputing demand distribution estimate and section registration_volume "
@@ -587,11 +707,14 @@ def garbage_collect_topics():
     ).delete()
 
 
-def recompute_stats(semesters=None, semesters_precomputed=False, verbose=False):
+def recompute_stats(
+    semesters=None, semesters_precomputed=False, verbose=False, chunk_size=ESTIMATES_CHUNK_SIZE
+):
     """
     Recomputes PCA demand distribution estimates, as well as the registration_volume
     and percent_open fields for all sections in the given semester(s). Deduplicates
-    status updates saved to the database.
+    status updates saved to the database. See recompute_demand_distribution_estimates
+    for the chunk_size argument.
     """
     if not semesters_precomputed:
         semesters = get_semesters(semesters=semesters, verbose=verbose)
@@ -600,7 +723,7 @@ def recompute_stats(semesters=None, semesters_precomputed=False, verbose=False):
     load_add_drop_dates(verbose=verbose)
     deduplicate_status_updates(semesters=semesters, semesters_precomputed=True, verbose=verbose)
     recompute_demand_distribution_estimates(
-        semesters=semesters, semesters_precomputed=True, verbose=verbose
+        semesters=semesters, semesters_precomputed=True, verbose=verbose, chunk_size=chunk_size
     )
 
 
@@ -627,9 +750,22 @@ class Command(BaseCommand):
             nargs="?",
             default=None,
         )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=ESTIMATES_CHUNK_SIZE,
+            help=(
+                "The number of recomputed demand distribution estimates to hold in memory "
+                f"(and insert at a time) for each semester (default {ESTIMATES_CHUNK_SIZE})."
+            ),
+        )
 
     def handle(self, *args, **kwargs):
         root_logger = logging.getLogger("")
         root_logger.setLevel(logging.DEBUG)
 
-        recompute_stats(semesters=kwargs["semesters"], verbose=True)
+        if kwargs["chunk_size"] < 1:
+            raise CommandError("Chunk size must be at least 1.")
+        recompute_stats(
+            semesters=kwargs["semesters"], verbose=True, chunk_size=kwargs["chunk_size"]
+        )
@@ -3,6 +3,7 @@ import logging
 from django.core.management.base import BaseCommand
 from tqdm import tqdm
 
+from alert.fanout_dedup import get_alert_fanout_stats
 from alert.models import Course, Section
 from alert.util import should_send_pca_alert
 from alert.views import alert_for_course
@@ -31,6 +32,7 @@ class Command(BaseCommand):
             "error": 0,
             "skipped": 0,
         }
+        suppressed_before = get_alert_fanout_stats(semester)["suppressed"]
         for status in tqdm(statuses):
             data = status
             section_code = data.get("section_id_normalized")
@@ -56,8 +58,7 @@ class Command(BaseCommand):
                 continue
 
             # Ignore duplicate updates
-            last_status_update = section.last_status_update
-            if last_status_update and last_status_update.new_status == course_status:
+            if section.last_status_update_new_status == course_status:
                 stats["duplicate_updates"] += 1
                 continue
 
@@ -75,4 +76,9 @@ class Command(BaseCommand):
             else:
                 stats["skipped"] += 1
 
+        suppressed_after = get_alert_fanout_stats(semester)["suppressed"]
+        if suppressed_before is not None and suppressed_after is not None:
+            # Fan-outs suppressed as duplicates of ones already triggered (e.g. by the webhook),
+            # which are also counted as sent (see alert/fanout_dedup.py)
+            stats["duplicate_fanouts"] = suppressed_after - suppressed_before
         print(stats)
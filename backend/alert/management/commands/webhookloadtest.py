@@ -0,0 +1,310 @@
+import base64
+import csv
+import json
+import os
+import subprocess
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime
+from textwrap import dedent
+
+import numpy as np
+from celery.signals import before_task_publish, task_prerun
+from dateutil.tz import gettz
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils.timezone import make_aware
+
+from alert.latency import get_alert_latency_percentiles, traces_since
+from courses.util import translate_semester
+from PennCourses.settings.base import TIME_ZONE
+
+
+STATUS_CODES_NORMALIZED = {"O": "Open", "C": "Closed", "X": "Cancelled"}
+
+
+def read_status_history(src, limit=None):
+    """
+    Reads a CSV of status updates in the format produced by the export_status_history command,
+    and returns a list of `(created_at, body)` tuples (sorted by created_at), where body
+    is the JSON-serializable webhook request body the registrar would have sent for the update.
+    """
+    updates = []
+    with open(src) as history_file:
+        for row in csv.reader(history_file):
+            full_code, semester, created_at, old_status, new_status = row[:5]
+            created_at = make_aware(
+                datetime.strptime(created_at, "%Y-%m-%d %H:%M:%S.%f %Z"),
+                timezone=gettz(TIME_ZONE),
+                is_dst=None,
+            )
+            body = {
+                "section_id_normalized": full_code,
+                "previous_status": old_status,
+                "status": new_status,
+                "status_code_normalized": STATUS_CODES_NORMALIZED.get(new_status, ""),
+                "term": translate_semester(semester),
+            }
+            updates.append((created_at, body))
+    updates.sort(key=lambda u: u[0])
+    return updates[:limit] if limit else updates
+
+
+def summarize(values, percentiles=(50, 90, 95, 99)):
+    """
+    Returns a dict with the mean, max and given percentiles of the given list of numbers
+    (or None values if the list is empty).
+    """
+    values = np.asarray(values, dtype=float)
+    summary = {"mean": float(values.mean()) if len(values) else None}
+    for p in percentiles:
+        summary[f"p{p}"] = float(np.percentile(values, p)) if len(values) else None
+    summary["max"] = float(values.max()) if len(values) else None
+    return summary
+
+
+class TaskCounter:
+    """
+    Counts the Celery tasks enqueued while it is connected, by task name
+    (tasks run eagerly, e.g. with CELERY_ALWAYS_EAGER, are counted when they start).
+    """
+
+    def __init__(self):
+        self.counts = Counter()
+        self.lock = threading.Lock()
+
+    def count_published(self, sender=None, **kwargs):
+        with self.lock:
+            self.counts[sender] += 1
+
+    def count_eager(self, sender=None, task=None, **kwargs):
+        if task is not None and task.request.is_eager:
+            with self.lock:
+                self.counts[task.name] += 1
+
+    def __enter__(self):
+        before_task_publish.connect(self.count_published, weak=False)
+        task_prerun.connect(self.count_eager, weak=False)
+        return self
+
+    def __exit__(self, *args):
+        before_task_publish.disconnect(self.count_published)
+        task_prerun.disconnect(self.count_eager)
+
+
+def get_git_commit():
+    try:
+        return (
+            subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL)
+            .decode()
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def replay_status_history(updates, speedup=60.0, concurrency=1, batch_size=0, trace_alerts=False):
+    """
+    Replays the given `(created_at, body)` webhook updates (as returned by read_status_history)
+    against the webhook endpoint (in-process, using the Django test client), preserving their
+    relative timing divided by the given speedup factor (or as fast as possible if speedup is 0),
+    with up to `concurrency` requests in flight at once. If batch_size is positive, consecutive
+    updates are grouped into requests of (up to) batch_size updates to the batch webhook endpoint.
+    If trace_alerts is set, alert latency tracing is enabled during the replay (see
+    alert/latency.py), and the latency percentiles of the alerts it triggered are included.
+    Returns a dict of results (see the webhookloadtest command help text).
+    """
+    auth = base64.standard_b64encode(
+        f"{settings.WEBHOOK_USERNAME}:{settings.WEBHOOK_PASSWORD}".encode("ascii")
+    ).decode()
+    headers = {"HTTP_AUTHORIZATION": f"Basic {auth}"}
+    if batch_size > 0:
+        url = reverse("webhook-batch", urlconf="alert.urls")
+        requests = []
+        for i, (created_at, body) in enumerate(updates):
+            if i % batch_size == 0:
+                requests.append((created_at, []))
+            requests[-1][1].append(body)
+    else:
+        url = reverse("webhook", urlconf="alert.urls")
+        requests = updates
+
+    latencies = []  # in milliseconds
+    queries = []
+    lags = []  # how far behind schedule each request was sent, in milliseconds
+    status_codes = Counter()
+    results_lock = threading.Lock()
+    local = threading.local()
+
+    def send(scheduled_at, body):
+        if not hasattr(local, "client"):
+            local.client = Client()
+        lag = (time.perf_counter() - scheduled_at) * 1000
+        with CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            response = local.client.post(
+                url, data=json.dumps(body), content_type="application/json", **headers
+            )
+            latency = (time.perf_counter() - start) * 1000
+        with results_lock:
+            latencies.append(latency)
+            queries.append(len(captured.captured_queries))
+            lags.append(max(lag, 0))
+            status_codes[str(response.status_code)] += 1
+
+    tracing = (
+        override_settings(ALERT_LATENCY_TRACING_ENABLED=True) if trace_alerts else nullcontext()
+    )
+    with TaskCounter() as task_counter, tracing:
+        replay_started_at = time.time()
+        first_created_at = requests[0][0] if requests else None
+        start = time.perf_counter()
+        if concurrency > 1:
+            executor = ThreadPoolExecutor(max_workers=concurrency)
+        futures = []
+        for created_at, body in requests:
+            scheduled_at = start
+            if speedup:
+                scheduled_at += (created_at - first_created_at).total_seconds() / speedup
+                time.sleep(max(scheduled_at - time.perf_counter(), 0))
+            if concurrency > 1:
+                futures.append(executor.submit(send, scheduled_at, body))
+            else:
+                send(scheduled_at, body)
+        if concurrency > 1:
+            for future in futures:
+                future.result()  # re-raise any exceptions
+            executor.shutdown()
+        duration = time.perf_counter() - start
+
+    num_updates = len(updates)
+    results = {
+        "commit": get_git_commit(),
+        "updates": num_updates,
+        "requests": len(requests),
+        "speedup": speedup,
+        "concurrency": concurrency,
+        "batch_size": batch_size,
+        "duration_seconds": duration,
+        "throughput_updates_per_second": num_updates / duration if duration else None,
+        "status_codes": dict(status_codes),
+        "latency_ms": summarize(latencies),
+        "schedule_lag_ms": summarize(lags),
+        "sql_queries_per_request": {**summarize(queries), "total": int(sum(queries))},
+        "celery_tasks_enqueued": {
+            "total": sum(task_counter.counts.values()),
+            "by_task": dict(task_counter.counts),
+        },
+    }
+    if trace_alerts:
+        results["alert_latency_ms"] = get_alert_latency_percentiles(traces_since(replay_started_at))
+    return results
+
+
+class Command(BaseCommand):
+    help = dedent(
+        """
+        Replays a CSV of status updates (as produced by the export_status_history command)
+        against the course status webhook, to measure how it behaves at realistic burst rates.
+        Reports throughput, latency percentiles, SQL queries per request, and the number of
+        Celery tasks enqueued, and optionally saves these results as JSON (along with the
+        current git commit) so they can be compared between commits.
+        Requests are sent in-process with the Django test client, so this will write status
+        updates to (and may send alerts from) the configured database; only run it against
+        a development database loaded with the load_test_courses_data script.
+        """
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--src",
+            type=str,
+            required=True,
+            help="The file path of the .csv file containing the status updates to replay.",
+        )
+        parser.add_argument(
+            "--speedup",
+            type=float,
+            default=60.0,
+            help=(
+                "The factor by which to speed up the replay relative to the original timing "
+                "of the updates (e.g. 60 replays an hour of updates in a minute). "
+                "Pass 0 to send updates as fast as possible."
+            ),
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=1,
+            help="The maximum number of requests in flight at once (default 1).",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=0,
+            help=(
+                "If positive, consecutive updates are sent in batches of this size to the "
+                "batch webhook endpoint, rather than one update per request."
+            ),
+        )
+        parser.add_argument(
+            "--limit",
+            type=int,
+            default=None,
+            help="Only replay the first (earliest) this many updates from the CSV.",
+        )
+        parser.add_argument(
+            "--output",
+            type=str,
+            default=None,
+            help="A .json file path to save the results to (they are always printed).",
+        )
+        parser.add_argument(
+            "--trace-alerts",
+            default=False,
+            action="store_true",
+            help=(
+                "Enable alert latency tracing during the replay, and report the latency "
+                "percentiles of the alerts it triggers (see the alertlatency command)."
+            ),
+        )
+        parser.add_argument(
+            "--force",
+            default=False,
+            action="store_true",
+            help="Allow running this command with DEBUG disabled (e.g. in production).",
+        )
+
+    def handle(self, *args, **kwargs):
+        if not settings.DEBUG and not kwargs["force"]:
+            raise CommandError(
+                "Refusing to replay status updates with DEBUG disabled (pass --force to override)."
+            )
+        if not os.path.exists(kwargs["src"]):
+            raise CommandError(f"File {kwargs['src']} does not exist.")
+        if kwargs["concurrency"] < 1:
+            raise CommandError("Concurrency must be at least 1.")
+
+        updates = read_status_history(kwargs["src"], limit=kwargs["limit"])
+        self.stdout.write(f"Replaying {len(updates)} status updates from {kwargs['src']}...")
+        results = replay_status_history(
+            updates,
+            speedup=kwargs["speedup"],
+            concurrency=kwargs["concurrency"],
+            batch_size=kwargs["batch_size"],
+            trace_alerts=kwargs["trace_alerts"],
+        )
+        results["src"] = kwargs["src"]
+        output = json.dumps(results, indent=2)
+        self.stdout.write(output)
+        if kwargs["output"]:
+            with open(kwargs["output"], "w") as output_file:
+                output_file.write(output)
+            self.stdout.write(f"Saved results to {kwargs['output']}.")
@@ -0,0 +1,76 @@
+import logging
+from textwrap import dedent
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from alert.webhook_queue import drain_webhook_queue, get_webhook_queue_stats, replay_webhook_queue
+
+
+class Command(BaseCommand):
+    help = dedent(
+        """
+    Inspect, drain or replay the webhook queue (see alert/webhook_queue.py). By default, this
+    script applies all unprocessed course status updates in every partition of the queue.
+    """
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--stats",
+            action="store_true",
+            help=(
+                "Print the length and number of pending and dead-lettered entries of each "
+                "partition, and exit."
+            ),
+        )
+        parser.add_argument(
+            "--replay",
+            action="store_true",
+            help=dedent(
+                """
+                Re-apply all retained entries (including already applied ones) with stream ids
+            between --start and --end, instead of only unprocessed entries. Applying an entry is
+            idempotent, so this only restores updates that are missing from the database.
+                """
+            ),
+        )
+        parser.add_argument(
+            "--start",
+            type=str,
+            default="-",
+            help="The first stream id (or millisecond timestamp) to replay (default: oldest).",
+        )
+        parser.add_argument(
+            "--end",
+            type=str,
+            default="+",
+            help="The last stream id (or millisecond timestamp) to replay (default: newest).",
+        )
+        parser.add_argument(
+            "--partitions",
+            type=str,
+            default=None,
+            help="A comma-separated list of partitions to process (default: all partitions).",
+        )
+
+    def handle(self, *args, **kwargs):
+        root_logger = logging.getLogger("")
+        root_logger.setLevel(logging.DEBUG)
+
+        if kwargs["partitions"] is None:
+            partitions = range(settings.WEBHOOK_QUEUE_PARTITIONS)
+        else:
+            partitions = [int(p) for p in kwargs["partitions"].split(",")]
+
+        for partition in partitions:
+            if kwargs["stats"]:
+                print(f"Partition {partition}: {get_webhook_queue_stats(partition)}")
+            elif kwargs["replay"]:
+                num_replayed = replay_webhook_queue(
+                    partition, start=kwargs["start"], end=kwargs["end"]
+                )
+                print(f"Partition {partition}: replayed {num_replayed} entries.")
+            else:
+                num_applied = drain_webhook_queue(partition)
+                print(f"Partition {partition}: applied {num_applied} entries.")
@@ -0,0 +1,35 @@
+# Generated by Django 4.0.5 on 2026-10-18 07:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("alert", "0017_alter_registration_head_registration"),
+        ("courses", "0056_statusupdate_semester"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="registration",
+            name="semester",
+            field=models.CharField(
+                db_index=True,
+                default="",
+                help_text="\nThe semester of the section that the user registered to be notified about (denormalized\nfrom `section.course.semester` so that queries for a semester's registrations don't need\nto join through the section and course tables). This field is set automatically when the\nregistration is saved.\n",
+                max_length=5,
+            ),
+            preserve_default=False,
+        ),
+        migrations.RunSQL(
+            """
+            UPDATE alert_registration AS t
+            SET semester = c.semester
+            FROM courses_section AS s
+            INNER JOIN courses_course AS c ON c.id = s.course_id
+            WHERE s.id = t.section_id
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
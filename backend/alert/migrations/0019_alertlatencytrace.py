@@ -0,0 +1,77 @@
+# Generated by Django 4.0.5 on 2026-10-18 08:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("alert", "0018_registration_semester"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AlertLatencyTrace",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                (
+                    "full_code",
+                    models.CharField(
+                        help_text="The full code of the section that triggered the alerts (from the registrar).",
+                        max_length=32,
+                    ),
+                ),
+                (
+                    "semester",
+                    models.CharField(
+                        db_index=True,
+                        help_text="\nThe semester of the section that triggered the alerts (of the form YYYYx where x is\nA [for spring], B [summer], or C [fall]), e.g. `2019C` for fall 2019.\n",
+                        max_length=5,
+                    ),
+                ),
+                (
+                    "course_status",
+                    models.CharField(
+                        help_text="The new status of the section that triggered the alerts.",
+                        max_length=16,
+                    ),
+                ),
+                (
+                    "webhook_received_at",
+                    models.DateTimeField(
+                        db_index=True,
+                        help_text="The datetime at which the webhook request triggering the alerts was received.",
+                    ),
+                ),
+                (
+                    "status_update_committed_ms",
+                    models.IntegerField(
+                        blank=True,
+                        help_text="When the StatusUpdate for the webhook request was committed (ms offset).",
+                        null=True,
+                    ),
+                ),
+                (
+                    "course_alerts_started_ms",
+                    models.IntegerField(
+                        blank=True,
+                        help_text="When the send_course_alerts task started (ms offset).",
+                        null=True,
+                    ),
+                ),
+                (
+                    "alerts",
+                    models.JSONField(
+                        blank=True,
+                        default=list,
+                        help_text="\nA list with one entry for each alert sent in this fan-out, of the form\n`[alert_started_ms, email_accepted_ms, text_accepted_ms, push_accepted_ms]`\n(see alert/latency.py/ALERT_SAMPLE_FIELDS), where each value is a ms offset,\nor null if the alert was not accepted by that channel's provider.\n",
+                    ),
+                ),
+            ],
+        ),
+    ]
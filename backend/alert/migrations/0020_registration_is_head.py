@@ -0,0 +1,47 @@
+# Generated by Django 4.0.5 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("alert", "0019_alertlatencytrace"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="registration",
+            name="is_head",
+            field=models.BooleanField(
+                default=True,
+                help_text="\nTrue iff this registration is the head of its resubscribe chain (i.e. it has not been\nresubscribed to). Maintained by `Registration.save`, `Registration.mark_alerts_sent`\nand `Registration.bulk_load` (and backfilled / verified by the backfill_registration_heads\nmanagement command), so that the current registrations of a user or section\ncan be found with an index scan.\n",
+            ),
+        ),
+        migrations.RunSQL(
+            """
+            UPDATE alert_registration AS t
+            SET is_head = FALSE
+            WHERE EXISTS (
+                SELECT 1 FROM alert_registration AS s WHERE s.resubscribed_from_id = t.id
+            )
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.AddIndex(
+            model_name="registration",
+            index=models.Index(
+                condition=models.Q(("is_head", True)),
+                fields=["user", "section"],
+                name="alert_reg_user_section_head",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="registration",
+            index=models.Index(
+                condition=models.Q(("is_head", True)),
+                fields=["section"],
+                name="alert_reg_section_head",
+            ),
+        ),
+    ]
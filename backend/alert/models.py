@@ -1,4 +1,5 @@
 import logging
+from collections import Counter
 from datetime import datetime
 from enum import Enum, auto
 from textwrap import dedent
@@ -10,11 +11,11 @@ from django.core.cache import cache
 from django.core.exceptions import ValidationError
 from django.db import models, transaction
 from django.db.models import Case, F, Max, Q, Value, When
-from django.db.models.functions import Extract
+from django.db.models.functions import Extract, Greatest
 from django.utils import timezone
 from django.utils.timezone import make_aware
 
-from alert.alerts import Email, PushNotification, Text
+from alert.alerts import Email, PushNotification, Text, send_channel_alerts
 from courses.models import Course, Section, StatusUpdate, UserProfile, string_dict_to_html
 from courses.util import (
     does_object_pass_filter,
@@ -113,8 +114,25 @@ class Registration(models.Model):
     channels (text, email, and/or push notification based on the User's settings).  The
     notification is then sent with the send_alert method on each Alert object.  The send_alert
     method calls other functions in alert/alerts.py to actually send out the alerts.
+    If settings.ALERT_BATCH_DISPATCH is enabled, send_course_alerts instead sends the alerts
+    itself in batches (see alert/tasks.py/dispatch_alerts), marking the sent registrations
+    with the Registration.mark_alerts_sent method.
     """
 
+    class Meta:
+        indexes = [
+            # The current registrations of a user (see RegistrationViewSet.get_queryset_current)
+            models.Index(
+                fields=["user", "section"],
+                condition=Q(is_head=True),
+                name="alert_reg_user_section_head",
+            ),
+            # The current registrations of a section (e.g. its active watchers)
+            models.Index(
+                fields=["section"], condition=Q(is_head=True), name="alert_reg_section_head"
+            ),
+        ]
+
     created_at = models.DateTimeField(
         auto_now_add=True, help_text="The datetime at which this registration was created."
     )
@@ -209,6 +227,18 @@ class Registration(models.Model):
         related_name="registrations",
         help_text="The section that the user registered to be notified about.",
     )
+    semester = models.CharField(
+        max_length=5,
+        db_index=True,
+        help_text=dedent(
+            """
+        The semester of the section that the user registered to be notified about (denormalized
+        from `section.course.semester` so that queries for a semester's registrations don't need
+        to join through the section and course tables). This field is set automatically when the
+        registration is saved.
+        """
+        ),
+    )
     cancelled = models.BooleanField(
         default=False,
         help_text=dedent(
@@ -352,6 +382,18 @@ class Registration(models.Model):
         """
         ),
     )
+    is_head = models.BooleanField(
+        default=True,
+        help_text=dedent(
+            """
+        True iff this registration is the head of its resubscribe chain (i.e. it has not been
+        resubscribed to). Maintained by `Registration.save`, `Registration.mark_alerts_sent`
+        and `Registration.bulk_load` (and backfilled / verified by the backfill_registration_heads
+        management command), so that the current registrations of a user or section
+        can be found with an index scan.
+        """
+        ),
+    )
 
     @staticmethod
     def is_active_filter():
@@ -438,6 +480,10 @@ class Registration(models.Model):
         understanding, they expect alerts to work by section (so the "LAST NOTIFIED"
         column should tell them the last time they were alerted about that section).
         """
+        if hasattr(self, "last_section_notification_sent_at"):
+            # Annotated by the registration list endpoints
+            # (see alert/views.py/annotate_registration_list)
+            return self.last_section_notification_sent_at
         return (
             self.section.registrations.filter(user=self.user, notification_sent_at__isnull=False)
             .aggregate(max_notification_sent_at=Max("notification_sent_at"))
@@ -475,8 +521,10 @@ class Registration(models.Model):
             are moved to the `profile` of the `user` object (this was only a concern during the
             PCA refresh transition process, when we switched away from using these legacy fields).
           - If `head_registration` is `None`, it is set to a self-reference.
+          - The denormalized `semester` field is set to the semester of `section`.
+          - The `is_head` field is preserved (it is only changed by the update below).
           - Any other registration whose `head_registration` equals `self.resubscribed_from`
-            are updated to have `self` as their `head_registration`.
+            are updated to have `self` as their `head_registration` (and `is_head` False).
           - The `original_created_at` field is set to the `created_at` of the tail of the
             resubscribe chain.
 
@@ -487,13 +535,16 @@ class Registration(models.Model):
         and `current_demand_distribution_estimate` cache are asynchronously updated
         (via a celery task) to reflect the resulting section demand change.
         """
-        from alert.tasks import section_demand_change
+        from alert.demand_index import update_demand_index
+        from alert.tasks import schedule_section_demand_change
         from courses.util import get_set_id, is_fk_set
 
         # ^ imported here to avoid circular imports
 
         with transaction.atomic():
             self.validate_phone()
+            if not self.semester:
+                self.semester = self.section.semester
             if self.user is not None:
                 if self.email is not None:
                     user_data, _ = UserProfile.objects.get_or_create(user=self.user)
@@ -513,6 +564,9 @@ class Registration(models.Model):
             # Find old registration
             old_registration = Registration.objects.get(id=self.id) if self.id else None
             was_active = bool(old_registration and old_registration.is_active)
+            if old_registration:
+                # is_head is maintained by the updates below (don't overwrite it with a stale value)
+                self.is_head = old_registration.is_head
 
             # Set head_registration to self if not set
             if not is_fk_set(self, "head_registration"):
@@ -522,7 +576,7 @@ class Registration(models.Model):
 
             if self.resubscribed_from_id:
                 Registration.objects.filter(head_registration_id=self.resubscribed_from_id).update(
-                    head_registration=self
+                    head_registration=self, is_head=False
                 )
 
             if self.original_created_at is None:
@@ -539,11 +593,23 @@ class Registration(models.Model):
                 if volume_change > 0 or section.registration_volume >= 1:
                     section.registration_volume += volume_change
                     section.save()
-                section_demand_change.delay(section.id, self.updated_at)
-
-    def alert(self, forced=False, sent_by="", close_notification=False):
+                    transaction.on_commit(lambda: update_demand_index([section]))
+                schedule_section_demand_change(section.id, self.updated_at, section.semester)
+
+    def alert(
+        self,
+        forced=False,
+        sent_by="",
+        close_notification=False,
+        accepted_at=None,
+        transient_errors=None,
+    ):
         """
         Returns true iff an alert was successfully sent through at least one medium to the user.
+        If an accepted_at dict is given, the time at which each channel finished sending the
+        alert successfully is recorded in it, and if a transient_errors set is given, each channel
+        that failed with a transient error (which may not recur if the alert is retried) is added
+        to it (see alert/alerts.py/send_channel_alerts).
         """
 
         if not forced:
@@ -555,47 +621,350 @@ class Registration(models.Model):
         push_notification = (
             self.user and self.user.profile and self.user.profile.push_notifications
         )  # specifies whether we should use a push notification instead of a text
-        text_result = False
+        channel_alerts = [Email(self)]
         if not push_notification and not close_notification:
             # never send close notifications by text
-            text_result = Text(self).send_alert(close_notification=close_notification)
-            if text_result is None:
-                logging.debug(
-                    "ERROR OCCURRED WHILE ATTEMPTING TEXT NOTIFICATION FOR " + self.__str__()
-                )
-        email_result = Email(self).send_alert(close_notification=close_notification)
+            channel_alerts.append(Text(self))
+        if push_notification:
+            channel_alerts.append(PushNotification(self))
+        # The channels are sent concurrently (see alert/alerts.py/send_channel_alerts)
+        results = {
+            alert.channel: result
+            for alert, result in zip(
+                channel_alerts,
+                send_channel_alerts(
+                    channel_alerts,
+                    close_notification=close_notification,
+                    accepted_at=accepted_at,
+                    transient_errors=transient_errors,
+                ),
+            )
+        }
+
+        text_result = results.get(Text.channel, False)
+        if text_result is None:
+            logging.debug("ERROR OCCURRED WHILE ATTEMPTING TEXT NOTIFICATION FOR " + self.__str__())
+        email_result = results[Email.channel]
         if email_result is None:
             logging.debug(
                 "ERROR OCCURRED WHILE ATTEMPTING EMAIL NOTIFICATION FOR " + self.__str__()
             )
-        push_notif_result = False
-        if push_notification:
-            push_notif_result = PushNotification(self).send_alert(
-                close_notification=close_notification
-            )
-            if push_notif_result is None:
-                logging.debug(
-                    "ERROR OCCURRED WHILE ATTEMPTING PUSH NOTIFICATION FOR " + self.__str__()
-                )
+        push_notif_result = results.get(PushNotification.channel, False)
+        if push_notif_result is None:
+            logging.debug("ERROR OCCURRED WHILE ATTEMPTING PUSH NOTIFICATION FOR " + self.__str__())
         if not email_result and not text_result and not push_notif_result:
             logging.debug("ALERT CALLED BUT NOTIFICATION NOT SENT FOR " + self.__str__())
             return False
         if not close_notification:
             logging.debug("NOTIFICATION SENT FOR " + self.__str__())
-            self.notification_sent = True
-            self.notification_sent_at = timezone.now()
-            self.notification_sent_by = sent_by
-            self.save()
-            if self.auto_resubscribe:
-                self.resubscribe()
-            return True
         else:
             logging.debug("CLOSE NOTIFICATION SENT FOR " + self.__str__())
-            self.close_notification_sent = True
-            self.close_notification_sent_at = timezone.now()
-            self.close_notification_sent_by = sent_by
-            self.save()
-            return True
+        Registration.mark_alerts_sent(
+            [self], close_notification=close_notification, sent_by=sent_by
+        )
+        return True
+
+    @staticmethod
+    def mark_alerts_sent(registrations, close_notification=False, sent_by=""):
+        """
+        Marks the given registrations as having been sent an alert (or a close notification,
+        if close_notification is set), and resubscribes those with auto_resubscribe enabled,
+        as `alert` does after a successful send, but in bulk (without calling `save` on
+        any registration):
+          - The registrations are marked with a single bulk UPDATE.
+          - The auto-resubscribe successors (see `resubscribe`) are created with
+            `create_successors`.
+          - The `registration_volume` of each affected section in the current semester is
+            adjusted once (by the net change in its number of active registrations), and
+            a single demand change is scheduled (see `apply_volume_changes`).
+        Returns the list of created successor registrations.
+        """
+        registrations = list(registrations)
+        if not registrations:
+            return []
+        now = timezone.now()
+        prefix = "close_" if close_notification else ""
+        fields = [f"{prefix}notification_sent", f"{prefix}notification_sent_at"]
+        fields += [f"{prefix}notification_sent_by", "updated_at"]
+        with transaction.atomic():
+            was_active = [registration.is_active for registration in registrations]
+            for registration in registrations:
+                for field, value in zip(fields, [True, now, sent_by, now]):
+                    setattr(registration, field, value)
+            Registration.objects.bulk_update(registrations, fields)
+            if close_notification:
+                # Close notifications don't deactivate registrations
+                return []
+
+            # Resubscribe (creating a new head for each resubscribe chain whose head is
+            # no longer active)
+            to_resubscribe = {
+                registration.head_registration_id: registration
+                for registration in registrations
+                if registration.auto_resubscribe
+            }
+            heads = [
+                head
+                for head in Registration.objects.filter(
+                    head_registration_id__in=to_resubscribe.keys(), is_head=True
+                )
+                if not head.is_active  # don't create duplicate registrations (see resubscribe)
+            ]
+            successors = Registration.create_successors(
+                heads, [to_resubscribe[head.head_registration_id] for head in heads]
+            )
+
+            # Adjust the registration volumes of the affected sections
+            volume_changes = Counter()
+            for registration, active in zip(registrations, was_active):
+                if active:
+                    volume_changes[registration.section_id, registration.semester] -= 1
+            for successor in successors:
+                volume_changes[successor.section_id, successor.semester] += 1
+            Registration.apply_volume_changes(volume_changes, now, registrations + successors)
+        return successors
+
+    @staticmethod
+    def create_successors(heads, sources=None):
+        """
+        Resubscribes to each of the given (inactive) heads of resubscribe chains, as `resubscribe`
+        does, but in bulk: each successor copies the contact info and settings of the
+        corresponding registration in sources (defaulting to the heads themselves), the successors
+        are created with a single bulk INSERT, and the `head_registration` pointers (and `is_head`
+        flags) of their resubscribe chains are updated with a single UPDATE. Registration volumes
+        are not adjusted (see `apply_volume_changes`). Returns the list of created successors.
+        """
+        from courses.util import get_set_ids
+
+        # ^ imported here to avoid circular imports
+
+        heads = list(heads)
+        if sources is None:
+            sources = heads
+        successors = [
+            Registration(
+                user_id=source.user_id,
+                email=source.email,
+                phone=source.phone,
+                section_id=head.section_id,
+                semester=head.semester,
+                auto_resubscribe=source.auto_resubscribe,
+                close_notification=source.close_notification,
+                resubscribed_from=head,
+                original_created_at=head.original_created_at,
+            )
+            for head, source in zip(heads, sources)
+        ]
+        if not successors:
+            return []
+        with transaction.atomic():
+            for successor, successor_id in zip(successors, get_set_ids(successors)):
+                successor.head_registration_id = successor_id
+            Registration.objects.bulk_create(successors)
+            Registration.objects.filter(
+                head_registration_id__in=[s.resubscribed_from_id for s in successors]
+            ).update(
+                head_registration_id=Case(
+                    *[
+                        When(head_registration_id=s.resubscribed_from_id, then=Value(s.id))
+                        for s in successors
+                    ]
+                ),
+                is_head=False,
+            )
+        return successors
+
+    @staticmethod
+    def create_new(registrations):
+        """
+        Creates the given new (unsaved) registrations, each of which starts its own resubscribe
+        chain, in bulk (as `save` would, one by one): their `semester` fields are set from their
+        sections (which should be selected), they are created with a single bulk INSERT as the
+        heads (and tails) of their chains, and the `registration_volume` of each affected
+        section is adjusted once (see `apply_volume_changes`). Returns the list of registrations.
+        """
+        from courses.util import get_set_ids
+
+        # ^ imported here to avoid circular imports
+
+        registrations = list(registrations)
+        if not registrations:
+            return []
+        with transaction.atomic():
+            for registration, registration_id in zip(registrations, get_set_ids(registrations)):
+                registration.head_registration_id = registration_id
+                registration.semester = registration.section.semester
+            Registration.objects.bulk_create(registrations)
+            # created_at is only set (auto_now_add) by the INSERT
+            Registration.objects.filter(id__in=[r.id for r in registrations]).update(
+                original_created_at=F("created_at")
+            )
+            volume_changes = Counter()
+            for registration in registrations:
+                registration.original_created_at = registration.created_at
+                if registration.is_active:
+                    volume_changes[registration.section_id, registration.semester] += 1
+            Registration.apply_volume_changes(volume_changes, timezone.now(), registrations)
+        return registrations
+
+    @staticmethod
+    def apply_volume_changes(volume_changes, updated_at, registrations=()):
+        """
+        Adjusts the `registration_volume` of sections by the given changes in their number of
+        active registrations (volume_changes maps `(section_id, semester)` tuples to changes;
+        only sections in the current semester are adjusted), with a single UPDATE, and
+        schedules a single demand change (at the given updated_at datetime) if any volume changed.
+        Any sections cached on the given registrations are replaced with the updated sections.
+        """
+        from alert.demand_index import update_demand_index
+        from alert.tasks import schedule_section_demand_change
+
+        # ^ imported here to avoid circular imports
+
+        current_semester = get_current_semester()
+        volume_changes = {
+            section_id: change
+            for (section_id, semester), change in volume_changes.items()
+            if change and semester == current_semester
+        }
+        if volume_changes:
+            Section.objects.filter(id__in=volume_changes.keys()).update(
+                registration_volume=Greatest(
+                    F("registration_volume")
+                    + Case(
+                        *[
+                            When(id=section_id, then=Value(change))
+                            for section_id, change in volume_changes.items()
+                        ]
+                    ),
+                    0,
+                )
+            )
+            sections = Section.objects.in_bulk(volume_changes.keys())
+            transaction.on_commit(lambda: update_demand_index(sections.values()))
+            schedule_section_demand_change(next(iter(sections)), updated_at, current_semester)
+            for registration in registrations:
+                # Replace any cached (now stale) sections
+                if registration.section_id in sections:
+                    registration.section = sections[registration.section_id]
+
+    @staticmethod
+    def bulk_load(rows, batch_size=1000):
+        """
+        Loads the given registrations (e.g. historical registrations from an external data
+        source) in bulk, rather than saving each one with `save(load_script=True)`. The
+        invariants enforced by `save` are established for whole resubscribe chains at once,
+        in Python:
+          - The `phone` field is converted to E164 format, or set to `None` if unparseable.
+          - The denormalized `semester` field is set to the semester of `section`
+            (with a single query for all sections).
+          - The `head_registration` of each registration is set to the head of its
+            resubscribe chain (and `is_head` is set for the head only), and its
+            `original_created_at` (if not given) to the `created_at` of the tail of its chain.
+        IDs are assigned with a single query, the registrations are inserted with bulk INSERTs
+        (of batch_size registrations each), and the `registration_volume` of each affected section
+        is recomputed once at the end. Demand distribution estimates are not updated (run
+        `recompute_demand_distribution_estimates` for the loaded semesters afterwards).
+
+        :param rows: An iterable of dicts of Registration field values (e.g. `section_id`,
+            `created_at`, `notification_sent`), each of which may also have a `load_id` key
+            (an identifier of the row, e.g. its id in the source data), and a
+            `resubscribed_from` key (the `load_id` of the row it was resubscribed from).
+            Rows with a `user` must not set the legacy `email` / `phone` fields.
+        :param batch_size: The number of registrations to insert per query.
+        :return: The list of created registrations (in the order of rows).
+        :raises ValueError: If a row is invalid, or the resubscribe chains are inconsistent
+            (an unknown or duplicate `load_id`, a registration resubscribed from more than once,
+            or a cycle).
+        """
+        from alert.demand_index import update_demand_index
+        from alert.management.commands.recomputestats import recompute_registration_volumes
+        from courses.util import get_set_ids
+
+        # ^ imported here to avoid circular imports
+
+        now = timezone.now()
+        registrations = []
+        by_load_id = dict()  # maps load ids to registrations
+        predecessor_load_ids = []  # the resubscribed_from load id of each registration
+        for row in rows:
+            row = dict(row)
+            load_id = row.pop("load_id", None)
+            predecessor_load_ids.append(row.pop("resubscribed_from", None))
+            registration = Registration(**row)
+            if registration.user_id is not None and (
+                registration.email is not None or registration.phone is not None
+            ):
+                raise ValueError(f"Row {row} sets both user and legacy email / phone fields.")
+            if registration.phone is not None:
+                registration.validate_phone()
+            if registration.created_at is None:
+                registration.created_at = now
+            if load_id is not None:
+                if load_id in by_load_id:
+                    raise ValueError(f"Duplicate load_id {load_id}.")
+                by_load_id[load_id] = registration
+            registrations.append(registration)
+        if not registrations:
+            return []
+
+        section_semesters = dict(
+            Section.objects.filter(id__in={r.section_id for r in registrations}).values_list(
+                "id", "course__semester"
+            )
+        )
+        for registration in registrations:
+            if registration.section_id not in section_semesters:
+                raise ValueError(f"Section with id {registration.section_id} does not exist.")
+            if not registration.semester:
+                registration.semester = section_semesters[registration.section_id]
+
+        # Link the resubscribe chains (by object identity, since ids aren't assigned yet)
+        successors = dict()  # maps id(registration) to the registration resubscribed from it
+        tails = []
+        for registration, predecessor_load_id in zip(registrations, predecessor_load_ids):
+            if predecessor_load_id is None:
+                tails.append(registration)
+                continue
+            if predecessor_load_id not in by_load_id:
+                raise ValueError(f"Unknown resubscribed_from load_id {predecessor_load_id}.")
+            predecessor = by_load_id[predecessor_load_id]
+            if id(predecessor) in successors:
+                raise ValueError(f"Load_id {predecessor_load_id} is resubscribed from twice.")
+            successors[id(predecessor)] = registration
+            registration.resubscribed_from = predecessor
+        get_set_ids(registrations)
+        num_linked = 0
+        for tail in tails:
+            chain = [tail]
+            while id(chain[-1]) in successors:
+                chain.append(successors[id(chain[-1])])
+            for registration in chain:
+                registration.head_registration_id = chain[-1].id
+                registration.is_head = registration is chain[-1]
+                if registration.original_created_at is None:
+                    registration.original_created_at = tail.created_at
+                if registration.resubscribed_from is not None:
+                    registration.resubscribed_from_id = registration.resubscribed_from.id
+            num_linked += len(chain)
+        if num_linked != len(registrations):
+            raise ValueError("The resubscribe chains of the given rows contain a cycle.")
+
+        with transaction.atomic():
+            created_at = [registration.created_at for registration in registrations]
+            Registration.objects.bulk_create(registrations, batch_size=batch_size)
+            # bulk_create overwrites created_at (auto_now_add), so restore the loaded values
+            for registration, registration_created_at in zip(registrations, created_at):
+                registration.created_at = registration_created_at
+            Registration.objects.bulk_update(registrations, ["created_at"], batch_size=batch_size)
+
+            recompute_registration_volumes(section_ids=list(section_semesters))
+            transaction.on_commit(
+                lambda: update_demand_index(
+                    Section.objects.filter(id__in=section_semesters).select_related("course")
+                )
+            )
+        return registrations
 
     def resubscribe(self):
         """
@@ -636,7 +1005,7 @@ class Registration(models.Model):
         """
         Returns the head of the resubscribe chain (the most recent registration).
         """
-        return self.get_resubscribe_group().get(resubscribed_to__isnull=True)
+        return self.get_resubscribe_group().get(is_head=True)
 
     def get_original_registration(self):
         """
@@ -846,20 +1215,12 @@ class PcaDemandDistributionEstimate(models.Model):
             return None
         return float(self.lowest_demand_section_volume) / float(self.lowest_demand_section.capacity)
 
-    def save(self, *args, **kwargs):
+    def set_add_drop_fields(self, add_drop_period):
         """
-        This save method first gets the add/drop period object for this
-        PcaDemandDistributionEstimate object's semester (either by calling the
-        get_or_create_add_drop_period method or by using a passed-in add_drop_period kwarg,
-        which can be used for efficiency in bulk operations over PcaDemandDistributionEstimate
-        objects).
+        Sets the in_add_drop_period and percent_through_add_drop_period fields of this
+        PcaDemandDistributionEstimate object, given the AddDropPeriod object for its semester
+        (without saving).
         """
-        if "add_drop_period" in kwargs:
-            add_drop_period = kwargs["add_drop_period"]
-            del kwargs["add_drop_period"]
-        else:
-            add_drop_period = get_or_create_add_drop_period(self.semester)
-        super().save(*args, **kwargs)
         created_at = self.created_at
         start = add_drop_period.estimated_start
         end = add_drop_period.estimated_end
@@ -872,7 +1233,24 @@ class PcaDemandDistributionEstimate(models.Model):
         else:
             self.in_add_drop_period = True
             self.percent_through_add_drop_period = (created_at - start) / (end - start)
-        super().save()
+
+    def save(self, *args, **kwargs):
+        """
+        This save method first gets the add/drop period object for this
+        PcaDemandDistributionEstimate object's semester (either by calling the
+        get_or_create_add_drop_period method or by using a passed-in add_drop_period kwarg,
+        which can be used for efficiency in bulk operations over PcaDemandDistributionEstimate
+        objects). Then it sets the in_add_drop_period and percent_through_add_drop_period
+        fields and calls the overridden save method (so the estimate is written with a single
+        query).
+        """
+        if "add_drop_period" in kwargs:
+            add_drop_period = kwargs["add_drop_period"]
+            del kwargs["add_drop_period"]
+        else:
+            add_drop_period = get_or_create_add_drop_period(self.semester)
+        self.set_add_drop_fields(add_drop_period)
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"PcaDemandDistributionEstimate {self.semester} @ {self.created_at}"
@@ -983,7 +1361,7 @@ class AddDropPeriod(models.Model):
             self.estimated_end = self.estimate_end()
             period = self.estimated_end - self.estimated_start
             for model, sem_filter_key in [
-                (StatusUpdate, "section__course__semester"),
+                (StatusUpdate, "semester"),
                 (PcaDemandDistributionEstimate, "semester"),
             ]:
                 sem_filter = {sem_filter_key: self.semester}
@@ -1086,3 +1464,59 @@ class AddDropPeriod(models.Model):
 
     def __str__(self):
         return f"AddDropPeriod {self.semester}"
+
+
+class AlertLatencyTrace(models.Model):
+    """
+    The timing of one alert fan-out (one call to alert/tasks.py/send_course_alerts triggered by
+    a registrar webhook request), recorded if settings.ALERT_LATENCY_TRACING_ENABLED is set
+    (see alert/latency.py). The time of each stage is stored compactly, as an offset in
+    milliseconds from the time at which the webhook request was received.
+    """
+
+    full_code = models.CharField(
+        max_length=32,
+        help_text="The full code of the section that triggered the alerts (from the registrar).",
+    )
+    semester = models.CharField(
+        max_length=5,
+        db_index=True,
+        help_text=dedent(
+            """
+        The semester of the section that triggered the alerts (of the form YYYYx where x is
+        A [for spring], B [summer], or C [fall]), e.g. `2019C` for fall 2019.
+        """
+        ),
+    )
+    course_status = models.CharField(
+        max_length=16, help_text="The new status of the section that triggered the alerts."
+    )
+    webhook_received_at = models.DateTimeField(
+        db_index=True,
+        help_text="The datetime at which the webhook request triggering the alerts was received.",
+    )
+    status_update_committed_ms = models.IntegerField(
+        null=True,
+        blank=True,
+        help_text="When the StatusUpdate for the webhook request was committed (ms offset).",
+    )
+    course_alerts_started_ms = models.IntegerField(
+        null=True,
+        blank=True,
+        help_text="When the send_course_alerts task started (ms offset).",
+    )
+    alerts = models.JSONField(
+        default=list,
+        blank=True,
+        help_text=dedent(
+            """
+        A list with one entry for each alert sent in this fan-out, of the form
+        `[alert_started_ms, email_accepted_ms, text_accepted_ms, push_accepted_ms]`
+        (see alert/latency.py/ALERT_SAMPLE_FIELDS), where each value is a ms offset,
+        or null if the alert was not accepted by that channel's provider.
+        """
+        ),
+    )
+
+    def __str__(self):
+        return f"AlertLatencyTrace {self.full_code} {self.semester} @ {self.webhook_received_at}"
@@ -0,0 +1,97 @@
+import logging
+import time
+
+import redis
+from django.conf import settings
+
+
+"""
+Alert Channel Rate Limiting
+===========================
+
+When settings.ALERT_RATE_LIMITING_ENABLED is set, every alert sent through a channel (email,
+text or push notification) first takes a token from that channel's token bucket, which refills
+at the provider's rate limit (settings.ALERT_CHANNEL_RATE_LIMITS maps each channel to a
+`(tokens per second, burst size)` tuple). The buckets are stored in Redis and updated atomically
+by a Lua script, so they are shared by all Celery workers: during a burst of openings, alerts
+are sent at (but not above) each provider's limit, rather than all at once.
+
+Taking tokens is a reservation: the script deducts them right away (the bucket may go negative)
+and returns how long the caller must wait before the tokens are available, so concurrent callers
+are served in the order they asked. If the wait would exceed settings.ALERT_RATE_LIMIT_MAX_WAIT
+seconds, nothing is reserved and the send is treated as a transient error (to be retried later,
+see alert/tasks.py). If Redis is unavailable, sends are not throttled.
+"""
+
+logger = logging.getLogger(__name__)
+r = redis.Redis.from_url(settings.REDIS_URL)
+
+# KEYS: the bucket's key
+# ARGV: tokens per second, burst size, current time, tokens requested, maximum wait (seconds)
+# Returns the number of seconds to wait before the tokens are available (as a string),
+# only reserving the tokens if this wait is at most the maximum wait
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local requested = tonumber(ARGV[4])
+local max_wait = tonumber(ARGV[5])
+local state = redis.call("HMGET", KEYS[1], "tokens", "updated_at")
+local tokens = tonumber(state[1])
+local updated_at = tonumber(state[2])
+if tokens == nil or updated_at == nil then
+    tokens = burst
+    updated_at = now
+end
+tokens = math.min(burst, tokens + math.max(0, now - updated_at) * rate)
+local wait = 0
+if tokens < requested then
+    wait = (requested - tokens) / rate
+end
+if wait <= max_wait then
+    redis.call("HSET", KEYS[1], "tokens", tostring(tokens - requested), "updated_at", ARGV[3])
+    redis.call("EXPIRE", KEYS[1], math.ceil((burst + requested) / rate) + 1)
+end
+return tostring(wait)
+"""
+token_bucket = r.register_script(TOKEN_BUCKET_SCRIPT)
+
+
+def rate_limit_key(channel):
+    return f"alert_rate_limit:{channel}"
+
+
+def reserve_channel_tokens(channel, count=1):
+    """
+    Reserves the given number of tokens from the given channel's token bucket, and returns
+    the number of seconds until they are available (nothing is reserved if this exceeds
+    settings.ALERT_RATE_LIMIT_MAX_WAIT). Returns 0 if rate limiting is disabled, and logs
+    Redis errors and returns 0 (not throttling the channel) if Redis is unavailable.
+    """
+    if not settings.ALERT_RATE_LIMITING_ENABLED or count <= 0:
+        return 0
+    rate, burst = settings.ALERT_CHANNEL_RATE_LIMITS[channel]
+    try:
+        return float(
+            token_bucket(
+                keys=[rate_limit_key(channel)],
+                args=[rate, burst, time.time(), count, settings.ALERT_RATE_LIMIT_MAX_WAIT],
+            )
+        )
+    except redis.exceptions.RedisError as e:
+        logger.error(f"Alert rate limiter unavailable, not throttling {channel} alerts: {e}")
+        return 0
+
+
+def acquire_channel_tokens(channel, count=1):
+    """
+    Takes the given number of tokens from the given channel's token bucket, sleeping until
+    they are available. Returns False (without taking any tokens) if they would not be available
+    within settings.ALERT_RATE_LIMIT_MAX_WAIT seconds, and True otherwise.
+    """
+    wait = reserve_channel_tokens(channel, count)
+    if wait > settings.ALERT_RATE_LIMIT_MAX_WAIT:
+        return False
+    if wait > 0:
+        time.sleep(wait)
+    return True
@@ -1,15 +1,26 @@
 import logging
+import random
+import time
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
 
-import numpy as np
 import redis
-import scipy.stats as stats
 from celery import shared_task
 from django.conf import settings
 from django.core.cache import cache
 from django.db import models, transaction
 from django.db.models import Case, Q, When
 from django.db.models.functions import Cast
+from django.utils.dateparse import parse_datetime
 
+from alert.alerts import send_alerts
+from alert.demand_fit import fit_closed_demand_distribution
+from alert.demand_index import (
+    get_demand_index_closed_moments,
+    get_demand_index_closed_raw_demands,
+    get_demand_index_extreme_sections,
+)
+from alert.latency import record_alert_samples, record_trace_stage
 from alert.management.commands.recomputestats import recompute_percent_open
 from alert.models import PcaDemandDistributionEstimate, Registration
 from courses.models import Section, StatusUpdate
@@ -32,37 +43,160 @@ def run_course_updates(semester=None):
     if semester is None:
         updates = StatusUpdate.objects.all()
     else:
-        updates = StatusUpdate.objects.filter(section__course__semester=semester)
+        updates = StatusUpdate.objects.filter(semester=semester)
     for u in updates:
         update_course_from_record(u)
     return {"result": "executed", "name": "pca.tasks.run_course_updates"}
 
 
 @shared_task(name="pca.tasks.send_alert")
-def send_alert(reg_id, close_notification, sent_by=""):
+def send_alert(reg_id, close_notification, sent_by="", trace=None, attempt=0):
+    started_at = time.time()
+    accepted_at = dict()
+    transient_errors = set()
     result = Registration.objects.get(id=reg_id).alert(
-        sent_by=sent_by, close_notification=close_notification
+        sent_by=sent_by,
+        close_notification=close_notification,
+        accepted_at=accepted_at,
+        transient_errors=transient_errors,
     )
+    record_alert_samples(trace, [(started_at, accepted_at)])
+    if not result and transient_errors:
+        schedule_alert_retry(
+            reg_id, close_notification, sent_by=sent_by, trace=trace, attempt=attempt
+        )
     return {"result": result, "task": "pca.tasks.send_alert"}
 
 
 def get_registrations_for_alerts(course_code, semester, course_status="O"):
+    """
+    Returns a list of the registrations for the given section that should be alerted of the
+    given course status, in the order they should be alerted: the registrations whose original
+    registrations were created earliest come first (so they are the first to get through
+    the channel rate limiters during a burst of openings, see alert/rate_limit.py).
+    """
     _, section = get_course_and_section(course_code, semester)
+    registrations = section.registrations.select_related("section", "user__profile").order_by(
+        "original_created_at", "id"
+    )
     if course_status == "O":
-        return list(section.registrations.filter(**Registration.is_active_filter()))
+        return list(registrations.filter(**Registration.is_active_filter()))
     elif course_status == "C":
-        return list(section.registrations.filter(**Registration.is_waiting_for_close_filter()))
+        return list(registrations.filter(**Registration.is_waiting_for_close_filter()))
     else:
         return []
 
 
+def dispatch_alerts(registrations, close_notification=False, sent_by="", trace=None):
+    """
+    Sends alerts for the given registrations (as returned by get_registrations_for_alerts)
+    in batches of settings.ALERT_BATCH_SIZE, with alert.alerts.send_alerts, marking the
+    registrations of each batch that were sent with Registration.mark_alerts_sent
+    (and recording the latencies of each batch in the given trace, see alert/latency.py).
+    Registrations whose alerts failed with only transient errors are retried individually
+    (see schedule_alert_retry). Returns the number of alerts sent.
+    """
+    num_sent = 0
+    registrations = iter(registrations)
+    while True:
+        batch = [reg for _, reg in zip(range(settings.ALERT_BATCH_SIZE), registrations)]
+        if not batch:
+            break
+        started_at = time.time()
+        accepted_at = []
+        transient_errors = []
+        results = send_alerts(
+            batch,
+            close_notification=close_notification,
+            accepted_at=accepted_at,
+            transient_errors=transient_errors,
+        )
+        sent = [reg for reg, result in zip(batch, results) if result]
+        Registration.mark_alerts_sent(sent, close_notification=close_notification, sent_by=sent_by)
+        record_alert_samples(trace, [(started_at, accepted) for accepted in accepted_at])
+        for reg, result, transient in zip(batch, results, transient_errors):
+            if not result and transient:
+                schedule_alert_retry(reg.id, close_notification, sent_by=sent_by, trace=trace)
+        num_sent += len(sent)
+    return num_sent
+
+
 @shared_task(name="pca.tasks.send_course_alerts")
-def send_course_alerts(course_code, course_status, semester=None, sent_by=""):
+def send_course_alerts(course_code, course_status, semester=None, sent_by="", trace=None):
+    record_trace_stage(trace, "course_alerts_started")
     if semester is None:
         semester = get_current_semester()
 
-    for reg in get_registrations_for_alerts(course_code, semester, course_status=course_status):
-        send_alert.delay(reg.id, close_notification=(course_status == "C"), sent_by=sent_by)
+    registrations = get_registrations_for_alerts(course_code, semester, course_status=course_status)
+    if settings.ALERT_BATCH_DISPATCH:
+        dispatch_alerts(
+            registrations,
+            close_notification=(course_status == "C"),
+            sent_by=sent_by,
+            trace=trace,
+        )
+        return
+    for reg in registrations:
+        send_alert.delay(
+            reg.id, close_notification=(course_status == "C"), sent_by=sent_by, trace=trace
+        )
+
+
+"""
+Alert Retry Scheduling
+======================
+
+An alert that could not be sent through any channel, but failed through at least one channel
+with a transient error (see alert.alerts.TransientAlertError, e.g. a 429 response from the
+provider or a saturated channel rate limiter), is retried with a delayed send_alert task, up to
+settings.ALERT_RETRY_MAX_ATTEMPTS times. The delays back off exponentially with "full jitter":
+the delay before retry n (from 1) is uniformly random between 0 and
+min(settings.ALERT_RETRY_MAX_DELAY, settings.ALERT_RETRY_BASE_DELAY * 2 ** n) seconds,
+which spreads out the retries of a burst of failed alerts rather than repeating the burst.
+A registration that is no longer active when its retry runs is not alerted (see
+Registration.alert).
+"""
+
+
+def get_alert_retry_delay(attempt):
+    """
+    Returns the number of seconds to wait before the given retry of an alert
+    (1 for the first retry), with exponential backoff and full jitter.
+    """
+    ceiling = min(settings.ALERT_RETRY_MAX_DELAY, settings.ALERT_RETRY_BASE_DELAY * 2**attempt)
+    return random.uniform(0, ceiling)
+
+
+def schedule_alert_retry(reg_id, close_notification, sent_by="", trace=None, attempt=0):
+    """
+    Schedules a retry of the alert for the registration with the given id, whose attempt
+    number `attempt` (0 for the first attempt) failed with a transient error.
+    Returns True if a retry was scheduled, and False if the alert has run out of retries.
+    """
+    attempt += 1
+    if attempt > settings.ALERT_RETRY_MAX_ATTEMPTS:
+        logger.error(f"Giving up on alert for registration {reg_id} after {attempt} attempts")
+        return False
+    delay = get_alert_retry_delay(attempt)
+    logger.warning(f"Retrying alert for registration {reg_id} in {delay:.1f}s (retry {attempt})")
+    send_alert.apply_async(
+        (reg_id, close_notification),
+        {"sent_by": sent_by, "trace": trace, "attempt": attempt},
+        countdown=delay,
+    )
+    return True
+
+
+@shared_task(name="pca.tasks.process_webhook_queue")
+def process_webhook_queue(partition):
+    """
+    Applies all unprocessed course status updates in the given partition of the webhook queue
+    (see alert/webhook_queue.py).
+    """
+    from alert.webhook_queue import drain_webhook_queue  # avoid circular imports
+
+    num_applied = drain_webhook_queue(partition)
+    return {"result": num_applied, "task": "pca.tasks.process_webhook_queue"}
 
 
 @shared_task(name="pca.tasks.recompute_percent_open")
@@ -76,7 +210,9 @@ def section_demand_change(section_id, updated_at):
     This function should be called when a section's demand changes (i.e. the number of
     active registrations changes, or the section's status is updated). It updates the
     `PcaDemandDistributionEstimate` model and `current_demand_distribution_estimate`
-    cache to reflect the demand change.
+    cache to reflect the demand change. If the demand index is enabled (see alert/demand_index.py),
+    the extreme sections and closed section raw demand moments are read from it rather than
+    from the database.
 
     :param: section_id: the id of the section involved in the demand change
     :param: updated_at: the datetime at which the demand change occurred
@@ -121,8 +257,14 @@ def section_demand_change(section_id, updated_at):
         )
 
         try:
-            lowest_demand_section = sections_qs[:1].get()
-            highest_demand_section = sections_qs[-1:].get()
+            # Read the extreme sections from the demand index if possible (avoiding a sort
+            # of all sections), otherwise from the database
+            extreme_sections = get_demand_index_extreme_sections(semester)
+            if extreme_sections is not None:
+                lowest_demand_section, highest_demand_section = extreme_sections
+            else:
+                lowest_demand_section = sections_qs[:1].get()
+                highest_demand_section = sections_qs[-1:].get()
         except Section.DoesNotExist:
             return  # Don't add a PcaDemandDistributionEstimate -- there are no valid sections yet
 
@@ -133,24 +275,26 @@ def section_demand_change(section_id, updated_at):
             or lowest_demand_section.raw_demand
             < current_demand_distribution_estimate.lowest_raw_demand
         ):
-            closed_sections_demand_values = np.asarray(
-                sections_qs.filter(status="C").values_list("raw_demand", flat=True)
+            # The closed-form lognormal fit only needs the moments of the closed section
+            # raw demands, which the demand index maintains (see alert/demand_fit.py)
+            closed_demand_moments = (
+                None
+                if settings.DEMAND_DISTRIBUTION_FULL_LOGNORM_FIT
+                else get_demand_index_closed_moments(semester)
             )
-            # "The term 'closed sections positive raw demand values' is
-            # sometimes abbreviated as 'csprdv'
-            csrdv_frac_zero, fit_shape, fit_loc, fit_scale = (None, None, None, None)
-            if len(closed_sections_demand_values) > 0:
-                closed_sections_positive_demand_values = closed_sections_demand_values[
-                    np.where(closed_sections_demand_values > 0)
-                ]
-                csrdv_frac_zero = 1 - len(closed_sections_positive_demand_values) / len(
-                    closed_sections_demand_values
-                )
-                if len(closed_sections_positive_demand_values) > 0:
-                    fit_shape, fit_loc, fit_scale = stats.lognorm.fit(
-                        closed_sections_positive_demand_values
+            if closed_demand_moments is not None:
+                csrdv_frac_zero, fit_shape, fit_loc, fit_scale = closed_demand_moments.estimate()
+            else:
+                closed_sections_demand_values = get_demand_index_closed_raw_demands(semester)
+                if closed_sections_demand_values is None:
+                    closed_sections_demand_values = sections_qs.filter(status="C").values_list(
+                        "raw_demand", flat=True
                     )
+                csrdv_frac_zero, fit_shape, fit_loc, fit_scale = fit_closed_demand_distribution(
+                    list(closed_sections_demand_values)
+                )
             new_demand_distribution_estimate = PcaDemandDistributionEstimate(
+                created_at=updated_at,
                 semester=semester,
                 highest_demand_section=highest_demand_section,
                 highest_demand_section_volume=highest_demand_section.registration_volume,
@@ -163,8 +307,6 @@ def section_demand_change(section_id, updated_at):
             )
             add_drop_period = get_or_create_add_drop_period(semester)
             new_demand_distribution_estimate.save(add_drop_period=add_drop_period)
-            new_demand_distribution_estimate.created_at = updated_at
-            new_demand_distribution_estimate.save(add_drop_period=add_drop_period)
             cache.set(
                 "current_demand_distribution_estimate",
                 new_demand_distribution_estimate,
@@ -173,3 +315,130 @@ def section_demand_change(section_id, updated_at):
                 ).total_seconds()
                 // ROUGH_MINIMUM_DEMAND_DISTRIBUTION_ESTIMATES,
             )  # set timeout to roughly follow ROUGH_MINIMUM_DEMAND_DISTRIBUTION_ESTIMATES
+
+
+"""
+Coalesced Demand Change Scheduling
+==================================
+
+Every StatusUpdate and every Registration activation/deactivation triggers a demand change,
+but each section_demand_change task locks and scans all sections of the semester. So rather
+than queueing one task per trigger, schedule_section_demand_change collapses all triggers for
+a semester within a window of settings.SECTION_DEMAND_CHANGE_COALESCE_WINDOW seconds into
+a single (delayed) coalesced_section_demand_change task, which carries the latest trigger.
+The latest trigger of each semester is kept in a Redis hash, which is compared and replaced
+atomically by a Lua script (so of concurrent triggers, the latest always wins). If Redis is
+unavailable, the coalesced task carries the trigger that scheduled it. The number of triggers
+and recomputations per semester are counted in the cache (see get_section_demand_change_stats).
+Coalescing is opt-in (settings.SECTION_DEMAND_CHANGE_COALESCE_WINDOW is 0 by default).
+"""
+
+# KEYS: the semester's latest demand change key
+# ARGV: the demand change's updated_at (in microseconds since the epoch), section id,
+#   and updated_at (as an ISO 8601 string)
+# Returns 1 if the given demand change replaced the latest one, and 0 if it is older
+SET_LATEST_DEMAND_CHANGE_SCRIPT = """
+local latest = redis.call("HGET", KEYS[1], "updated_at_us")
+if latest and tonumber(latest) > tonumber(ARGV[1]) then
+    return 0
+end
+redis.call("HSET", KEYS[1], "updated_at_us", ARGV[1], "section_id", ARGV[2], "updated_at", ARGV[3])
+return 1
+"""
+set_latest_demand_change = r.register_script(SET_LATEST_DEMAND_CHANGE_SCRIPT)
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def demand_change_cache_key(semester, name):
+    return f"section_demand_change:{semester}:{name}"
+
+
+def get_latest_demand_change(semester):
+    """
+    Returns a tuple (section_id, updated_at) of the latest demand change recorded for the given
+    semester by schedule_section_demand_change, or None if there is none (or Redis is
+    unavailable).
+    """
+    try:
+        section_id, updated_at = r.hmget(
+            demand_change_cache_key(semester, "latest"), ["section_id", "updated_at"]
+        )
+    except redis.exceptions.RedisError as e:
+        logger.error(f"Could not read latest demand change: {e}")
+        return None
+    if section_id is None or updated_at is None:
+        return None
+    return int(section_id), parse_datetime(updated_at.decode())
+
+
+def increment_demand_change_counter(semester, name):
+    key = demand_change_cache_key(semester, name)
+    try:
+        cache.incr(key)
+    except ValueError:  # the counter doesn't exist yet
+        cache.add(key, 1, timeout=None)
+
+
+def schedule_section_demand_change(section_id, updated_at, semester):
+    """
+    Schedules a section_demand_change task for the given section (whose semester must be given),
+    coalescing it with all other demand changes in the same semester within the
+    SECTION_DEMAND_CHANGE_COALESCE_WINDOW (the resulting task carries the latest updated_at).
+    If the window is 0, the task is queued immediately (as with section_demand_change.delay).
+    """
+    window = settings.SECTION_DEMAND_CHANGE_COALESCE_WINDOW
+    increment_demand_change_counter(semester, "triggers")
+    if not window:
+        increment_demand_change_counter(semester, "recomputations")
+        section_demand_change.delay(section_id, updated_at)
+        return
+
+    try:
+        set_latest_demand_change(
+            keys=[demand_change_cache_key(semester, "latest")],
+            args=[
+                (updated_at - EPOCH) // timedelta(microseconds=1),
+                section_id,
+                updated_at.isoformat(),
+            ],
+        )
+    except redis.exceptions.RedisError as e:
+        logger.error(f"Could not record latest demand change: {e}")
+    if cache.add(demand_change_cache_key(semester, "scheduled"), True, timeout=window):
+        coalesced_section_demand_change.apply_async(
+            (semester, section_id, updated_at), countdown=window
+        )
+    # Otherwise, this change will be picked up by the already scheduled task
+
+
+@shared_task(name="pca.tasks.coalesced_section_demand_change")
+def coalesced_section_demand_change(semester, section_id, updated_at):
+    """
+    Runs section_demand_change for the latest demand change in the given semester
+    (or for the given section_id and updated_at, if they are later than the latest demand
+    change recorded in Redis). See schedule_section_demand_change.
+    """
+    if isinstance(updated_at, str):
+        updated_at = parse_datetime(updated_at)
+    latest = get_latest_demand_change(semester)
+    if latest is not None and latest[1] > updated_at:
+        section_id, updated_at = latest
+    increment_demand_change_counter(semester, "recomputations")
+    section_demand_change(section_id, updated_at)
+    return {"result": "executed", "task": "pca.tasks.coalesced_section_demand_change"}
+
+
+def get_section_demand_change_stats(semester):
+    """
+    Returns a dict with the number of demand change `triggers` and demand distribution
+    `recomputations` for the given semester (counted since the cache was last cleared),
+    as well as the number of triggers that were `merged` into another recomputation.
+    """
+    triggers = cache.get(demand_change_cache_key(semester, "triggers"), 0)
+    recomputations = cache.get(demand_change_cache_key(semester, "recomputations"), 0)
+    return {
+        "triggers": triggers,
+        "recomputations": recomputations,
+        "merged": max(triggers - recomputations, 0),
+    }
@@ -11,5 +11,7 @@ router.register(r"registrationhistory", RegistrationHistoryViewSet, basename="re
 
 urlpatterns = [
     path("webhook", views.accept_webhook, name="webhook"),
+    path("webhook/batch", views.accept_webhook_batch, name="webhook-batch"),
+    path("latency", views.alert_latency, name="alert-latency"),
     path("", include(router.urls)),
 ]
@@ -1,19 +1,29 @@
 import base64
 import json
 import logging
+from collections import Counter
 
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.db import IntegrityError, transaction
-from django.db.models import Max
+from django.db.models import OuterRef, Subquery
 from django.http import HttpResponse, JsonResponse
 from django.utils import timezone
 from django.views.decorators.csrf import csrf_exempt
 from django_auto_prefetching import AutoPrefetchViewSetMixin
 from rest_framework import status, viewsets
+from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
+from alert.fanout_dedup import claim_alert_fanout, release_alert_fanout
+from alert.latency import (
+    get_alert_latency_percentiles,
+    get_alert_latency_traces,
+    record_trace_stage,
+    start_alert_trace,
+)
+from alert.management.commands.recomputestats import get_semesters
 from alert.models import Registration, RegStatus, register_for_course
 from alert.serializers import (
     RegistrationCreateSerializer,
@@ -22,12 +32,17 @@ from alert.serializers import (
 )
 from alert.tasks import send_course_alerts
 from alert.util import pca_registration_open, should_send_pca_alert
+from alert.webhook_queue import enqueue_webhook_update
+from courses.models import Section, StatusUpdate
 from courses.util import (
     get_current_semester,
     get_or_create_course_and_section,
     record_update,
+    record_updates,
+    separate_course_code,
     translate_semester_inv,
     update_course_from_record,
+    validate_status_update,
 )
 from PennCourses.docs_settings import PcxAutoSchema, reverse_func
 
@@ -35,8 +50,27 @@ from PennCourses.docs_settings import PcxAutoSchema, reverse_func
 logger = logging.getLogger(__name__)
 
 
-def alert_for_course(c_id, semester, sent_by, course_status):
-    send_course_alerts.delay(c_id, course_status=course_status, semester=semester, sent_by=sent_by)
+def alert_for_course(c_id, semester, sent_by, course_status, received_at=None):
+    """
+    Queues a send_course_alerts task for the given section, unless it is a duplicate of
+    a fan-out already queued for the same status transition (if deduplication is enabled,
+    see alert/fanout_dedup.py). If received_at (the datetime at which the triggering webhook
+    request was received) is given, the latency of the alerts is traced (if enabled, see
+    alert/latency.py), and the trace is returned.
+    """
+    transition_at = received_at or timezone.now()
+    if not claim_alert_fanout(c_id, semester, course_status, transition_at):
+        return None
+    trace = start_alert_trace(c_id, semester, course_status, received_at)
+    try:
+        send_course_alerts.delay(
+            c_id, course_status=course_status, semester=semester, sent_by=sent_by, trace=trace
+        )
+    except Exception:
+        # Let a later trigger for the same transition queue the fan-out
+        release_alert_fanout(c_id, semester, course_status, transition_at)
+        raise
+    return trace
 
 
 def extract_basic_auth(auth_header):
@@ -55,8 +89,11 @@ def extract_basic_auth(auth_header):
     return auth_parts[0].decode(), auth_parts[1].decode()
 
 
-@csrf_exempt
-def accept_webhook(request):
+def check_webhook_request(request):
+    """
+    Checks the authentication, method and content type of a request to a webhook route.
+    Returns an error HttpResponse if the request should be rejected, or None otherwise.
+    """
     auth_header = request.META.get("Authorization", request.META.get("HTTP_AUTHORIZATION", ""))
 
     username, password = extract_basic_auth(auth_header)
@@ -74,64 +111,145 @@ def accept_webhook(request):
     if "json" not in request.content_type.lower():
         return HttpResponse("Request expected in JSON", status=415)
 
-    try:
-        data = json.loads(request.body)
-    except json.JSONDecodeError:
-        return HttpResponse("Error decoding JSON body", status=400)
+    return None
+
 
+def parse_webhook_update(data):
+    """
+    Extracts the fields of a (JSON-decoded) registrar course status update.
+    Returns a tuple of the form `(fields, error)`. If the update can be processed, `fields` is
+    a dict with the keys `course_id`, `course_status`, `prev_status` and `course_term`, and
+    `error` is None. Otherwise `fields` is None and `error` is a `(status_code, message)` tuple
+    describing the response that should be returned for this update.
+    Raises a ValueError if the term of the update cannot be parsed.
+    """
     course_id = data.get("section_id_normalized", None)
     if course_id is None:
-        return HttpResponse("Course ID could not be extracted from response", status=400)
+        return None, (400, "Course ID could not be extracted from response")
 
     course_status = data.get("status", None)
     if course_status is None:
-        return HttpResponse("Course Status could not be extracted from response", status=400)
+        return None, (400, "Course Status could not be extracted from response")
 
     prev_status = data.get("previous_status", None) or ""
 
-    try:
-        course_term = data.get("term", None)
-        if course_term is None:
-            return HttpResponse("Course Term could not be extracted from response", status=400)
-        if any(course_term.endswith(s) for s in ["10", "20", "30"]):
-            course_term = translate_semester_inv(course_term)
-        if course_term.upper().endswith("B"):
-            return JsonResponse({"message": "webhook ignored (summer class)"})
+    course_term = data.get("term", None)
+    if course_term is None:
+        return None, (400, "Course Term could not be extracted from response")
+    if any(course_term.endswith(s) for s in ["10", "20", "30"]):
+        course_term = translate_semester_inv(course_term)
+    if course_term.upper().endswith("B"):
+        return None, (200, "webhook ignored (summer class)")
 
-        _, section, _, _ = get_or_create_course_and_section(course_id, course_term)
+    return {
+        "course_id": course_id,
+        "course_status": course_status,
+        "prev_status": prev_status,
+        "course_term": course_term,
+    }, None
 
-        # Ignore duplicate updates
+
+def apply_webhook_update(fields, request_body, created_at=None, received_at=None):
+    """
+    Applies a registrar course status update, given its fields (as returned by
+    parse_webhook_update) and its raw request body: triggers alerts if appropriate, and records
+    the update. Returns the message that should be included in the webhook response.
+    Raises a ValidationError if the update is a duplicate (or is otherwise invalid),
+    or a ValueError if its course code cannot be parsed.
+
+    :param created_at: The time at which the update was received, if it is being applied
+        after the fact (e.g. from the webhook queue). In this case the update is skipped if the
+        section already has a status update at or after this time, which makes applying the
+        same queued update more than once idempotent.
+    :param received_at: The time at which the update was received (if it is not given by
+        created_at), for alert latency tracing (see alert/latency.py).
+    """
+    course_id = fields["course_id"]
+    course_status = fields["course_status"]
+    prev_status = fields["prev_status"]
+    course_term = fields["course_term"]
+
+    _, section, _, _ = get_or_create_course_and_section(course_id, course_term)
+
+    if (
+        created_at is not None
+        and section.last_status_update_at is not None
+        and created_at <= section.last_status_update_at
+    ):
+        return "webhook already applied"
+
+    # Ignore duplicate updates
+    if section.last_status_update_new_status == course_status:
         last_status_update = section.last_status_update
-        if last_status_update and last_status_update.new_status == course_status:
-            raise ValidationError(
-                f"Status update received changing section {section} from "
-                f"{prev_status} to {course_status}, "
-                f"after previous status update from {last_status_update.old_status} "
-                f"to {last_status_update.new_status} (duplicate or erroneous).",
+        raise ValidationError(
+            f"Status update received changing section {section} from "
+            f"{prev_status} to {course_status}, "
+            f"after previous status update from {last_status_update.old_status} "
+            f"to {last_status_update.new_status} (duplicate or erroneous).",
+        )
+
+    alert_for_course_called = False
+    trace = None
+    if should_send_pca_alert(course_term, course_status):
+        try:
+            trace = alert_for_course(
+                course_id,
+                semester=course_term,
+                sent_by="WEB",
+                course_status=course_status,
+                received_at=created_at or received_at,
             )
+            alert_for_course_called = True
+            message = "webhook recieved, alerts sent"
+        except ValueError:
+            message = "course code could not be parsed"
+    else:
+        message = "webhook recieved"
 
-        alert_for_course_called = False
-        if should_send_pca_alert(course_term, course_status):
-            try:
-                alert_for_course(
-                    course_id, semester=course_term, sent_by="WEB", course_status=course_status
-                )
-                alert_for_course_called = True
-                response = JsonResponse({"message": "webhook recieved, alerts sent"})
-            except ValueError:
-                response = JsonResponse({"message": "course code could not be parsed"})
-        else:
-            response = JsonResponse({"message": "webhook recieved"})
-
-        u = record_update(
-            section,
-            course_term,
-            prev_status,
-            course_status,
-            alert_for_course_called,
-            request.body,
+    u = record_update(
+        section,
+        course_term,
+        prev_status,
+        course_status,
+        alert_for_course_called,
+        request_body,
+        created_at=created_at,
+    )
+    update_course_from_record(u)
+    transaction.on_commit(lambda: record_trace_stage(trace, "status_update_committed"))
+    return message
+
+
+@csrf_exempt
+def accept_webhook(request):
+    """
+    Accepts a registrar course status update. If settings.WEBHOOK_QUEUE_ENABLED is set,
+    the update is only validated and appended to the webhook queue (to be applied
+    asynchronously, see alert/webhook_queue.py), and the response is sent immediately
+    (unless Redis is unavailable, in which case the update is applied synchronously).
+    """
+    received_at = timezone.now()
+    error_response = check_webhook_request(request)
+    if error_response is not None:
+        return error_response
+
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return HttpResponse("Error decoding JSON body", status=400)
+
+    try:
+        fields, error = parse_webhook_update(data)
+        if error is not None:
+            status_code, message = error
+            if status_code == 200:
+                return JsonResponse({"message": message})
+            return HttpResponse(message, status=status_code)
+        if settings.WEBHOOK_QUEUE_ENABLED and enqueue_webhook_update(fields, request.body):
+            return JsonResponse({"message": "webhook queued"})
+        response = JsonResponse(
+            {"message": apply_webhook_update(fields, request.body, received_at=received_at)}
         )
-        update_course_from_record(u)
     except (ValidationError, ValueError) as e:
         logger.error(e, extra={"request": request})
         response = JsonResponse(
@@ -141,6 +259,245 @@ def accept_webhook(request):
     return response
 
 
+def resolve_webhook_sections(section_keys):
+    """
+    Given an iterable of (normalized full_code, semester) tuples, returns a dict mapping each
+    of these tuples to the corresponding Section object (with its course and last status update
+    selected), fetching all existing sections with a single query and creating any missing ones.
+    """
+    section_keys = set(section_keys)
+    if not section_keys:
+        return dict()
+    sections = {
+        (section.full_code, section.course.semester): section
+        for section in Section.objects.filter(
+            full_code__in={full_code for full_code, _ in section_keys},
+            course__semester__in={semester for _, semester in section_keys},
+        ).select_related("course", "last_status_update")
+    }
+    for full_code, semester in section_keys - sections.keys():
+        _, section, _, _ = get_or_create_course_and_section(full_code, semester)
+        sections[full_code, semester] = section
+    return {key: sections[key] for key in section_keys}
+
+
+@csrf_exempt
+def accept_webhook_batch(request):
+    """
+    Accepts a JSON array of registrar course status updates in a single POST request, where
+    each element is of the same form as the body of a request to accept_webhook (this allows
+    bursts of status updates to be replayed or forwarded efficiently). Updates are applied in
+    the order given. The response contains a `results` list with one `{"status", "message"}`
+    object per update, matching the status code and message that accept_webhook would
+    have returned for that update.
+    All sections are resolved with a single query, the StatusUpdate objects are inserted
+    in bulk, and alerts / demand recomputations are queued at most once per distinct section
+    (for its last status update in the batch). So an alert is only sent for a section if its
+    last status update in the batch triggers one (e.g. no open alert is sent for a section that
+    opens and then closes within the batch), and earlier updates of the section are recorded
+    as not having sent alerts.
+    """
+    received_at = timezone.now()
+    error_response = check_webhook_request(request)
+    if error_response is not None:
+        return error_response
+
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return HttpResponse("Error decoding JSON body", status=400)
+    if not isinstance(data, list):
+        return HttpResponse("Request expected a JSON array of status updates", status=400)
+
+    error_result = {"status": 200, "message": "We got an error but webhook should ignore it"}
+    results = [None] * len(data)
+    parsed = []  # list of (index, fields, section_key, request_body) tuples
+    for i, item in enumerate(data):
+        try:
+            if not isinstance(item, dict):
+                raise ValueError(f"Status update {item} is not a JSON object")
+            fields, error = parse_webhook_update(item)
+            if error is not None:
+                status_code, message = error
+                results[i] = {"status": status_code, "message": message}
+                continue
+            validate_status_update(
+                fields["course_term"], fields["prev_status"], fields["course_status"]
+            )
+            full_code = "-".join(separate_course_code(fields["course_id"]))
+            # Each update's request body is stored as bytes, like accept_webhook's request.body
+            request_body = json.dumps(item).encode()
+            parsed.append((i, fields, (full_code, fields["course_term"]), request_body))
+        except (ValidationError, ValueError) as e:
+            logger.error(e, extra={"request": request})
+            results[i] = error_result
+
+    sections = resolve_webhook_sections(key for _, _, key, _ in parsed)
+    last_statuses = {  # maps section id to (old_status, new_status) of its last update
+        section.id: (
+            section.last_status_update and section.last_status_update.old_status,
+            section.last_status_update_new_status,
+        )
+        for section in sections.values()
+    }
+
+    should_send_alert = dict()  # memoizes should_send_pca_alert by (term, status)
+    # Maps section id to (alert_for_course arguments, result index, StatusUpdate) of the alert
+    # triggered by its last status update so far
+    alerts = dict()
+    status_updates = []
+    for i, fields, section_key, request_body in parsed:
+        course_status = fields["course_status"]
+        prev_status = fields["prev_status"]
+        course_term = fields["course_term"]
+        section = sections[section_key]
+
+        # Ignore duplicate updates
+        last = last_statuses[section.id]
+        if last[1] == course_status:
+            logger.error(
+                f"Status update received changing section {section} from "
+                f"{prev_status} to {course_status}, "
+                f"after previous status update from {last[0]} "
+                f"to {last[1]} (duplicate or erroneous).",
+                extra={"request": request},
+            )
+            results[i] = error_result
+            continue
+
+        if (course_term, course_status) not in should_send_alert:
+            should_send_alert[course_term, course_status] = should_send_pca_alert(
+                course_term, course_status
+            )
+        alert_sent = should_send_alert[course_term, course_status]
+        superseded = alerts.pop(section.id, None)
+        if superseded is not None:
+            # This update supersedes the section's earlier alert in the batch
+            _, superseded_index, superseded_update = superseded
+            results[superseded_index] = {"status": 200, "message": "webhook recieved"}
+            superseded_update.alert_sent = False
+
+        last_statuses[section.id] = (prev_status, course_status)
+        status_update = StatusUpdate(
+            section=section,
+            old_status=prev_status,
+            new_status=course_status,
+            alert_sent=alert_sent,
+            request_body=request_body,
+        )
+        status_updates.append(status_update)
+        if alert_sent:
+            alerts[section.id] = (
+                (fields["course_id"], course_term, course_status),
+                i,
+                status_update,
+            )
+            results[i] = {"status": 200, "message": "webhook recieved, alerts sent"}
+        else:
+            results[i] = {"status": 200, "message": "webhook recieved"}
+
+    record_updates(status_updates)
+    for (course_id, course_term, course_status), _, _ in alerts.values():
+        trace = alert_for_course(
+            course_id,
+            semester=course_term,
+            sent_by="WEB",
+            course_status=course_status,
+            received_at=received_at,
+        )
+        transaction.on_commit(
+            lambda trace=trace: record_trace_stage(trace, "status_update_committed")
+        )
+
+    return JsonResponse({"results": results})
+
+
+def alert_latency(request):
+    """
+    Returns a JSON report of alert latency percentiles per semester and stage / channel
+    (see alert/latency.py), for staff users only. The `semesters` query parameter is a
+    comma-separated list of semesters (or "all"), defaulting to the current semester,
+    and the optional `days` query parameter restricts the report to the last this many days.
+    """
+    if not request.user.is_authenticated or not request.user.is_staff:
+        return HttpResponse("Only staff users can access alert latencies.", status=403)
+    try:
+        semesters = get_semesters(semesters=request.GET.get("semesters"))
+        days = int(request.GET["days"]) if "days" in request.GET else None
+    except ValueError as e:
+        return HttpResponse(str(e), status=400)
+    return JsonResponse(
+        {"semesters": get_alert_latency_percentiles(get_alert_latency_traces(semesters, days))}
+    )
+
+
+def annotate_registration_list(registrations):
+    """
+    Loads everything RegistrationSerializer reads for the given queryset of registrations in the
+    queryset itself: their sections and users (with select_related), and their
+    `last_notification_sent_at` values (as an annotation, see
+    Registration.last_notification_sent_at). So listing any number of registrations
+    takes a constant number of queries.
+    """
+    return registrations.select_related("section", "user").annotate(
+        last_section_notification_sent_at=Subquery(
+            Registration.objects.filter(
+                section_id=OuterRef("section_id"),
+                user_id=OuterRef("user_id"),
+                notification_sent_at__isnull=False,
+            )
+            .order_by("-notification_sent_at")
+            .values("notification_sent_at")[:1]
+        )
+    )
+
+
+def resolve_registration_sections(section_codes, semester):
+    """
+    Given an iterable of section codes (in any format accepted by separate_course_code), returns
+    a dict mapping each code to the corresponding Section object in the given semester
+    (with its course selected), or to None if it can't be parsed or no such section exists,
+    fetching all sections with a single query.
+    """
+    full_codes = dict()
+    for section_code in set(section_codes):
+        try:
+            full_codes[section_code] = "-".join(separate_course_code(section_code))
+        except ValueError:
+            full_codes[section_code] = None
+    sections = {
+        section.full_code: section
+        for section in Section.objects.filter(
+            full_code__in={full_code for full_code in full_codes.values() if full_code},
+            course__semester=semester,
+        ).select_related("course")
+    }
+    return {code: sections.get(full_code) for code, full_code in full_codes.items()}
+
+
+def parse_bulk_registration_request(request):
+    """
+    Returns a tuple `(items, error_response)` for a request to one of the bulk registration
+    endpoints, where items is the list of objects in the request body (or None if the request
+    is invalid, in which case error_response is the Response to return).
+    """
+    items = request.data
+    if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+        return None, Response(
+            {"message": "Request expected a JSON array of objects"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    if len(items) > settings.PCA_BULK_REGISTRATION_LIMIT:
+        return None, Response(
+            {
+                "message": "You can only include up to %d sections in one request."
+                % settings.PCA_BULK_REGISTRATION_LIMIT
+            },
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    return items, None
+
+
 class RegistrationViewSet(AutoPrefetchViewSetMixin, viewsets.ModelViewSet):
     """
     retrieve: Get one of the logged-in user's PCA registrations for the current semester, using
@@ -272,13 +629,75 @@ class RegistrationViewSet(AutoPrefetchViewSetMixin, viewsets.ModelViewSet):
                     404: "Registration not found with given id.",
                 },
             },
+            reverse_func("registrations-bulk"): {
+                "POST": {
+                    200: "[DESCRIBE_RESPONSE_SCHEMA]Results of each registration returned.",
+                    400: "Bad request (not an array of objects, or too many sections).",
+                    406: "No contact information (phone or email) set for user.",
+                    503: "Registration not currently open.",
+                },
+                "PUT": {
+                    200: "[DESCRIBE_RESPONSE_SCHEMA]Results of each update returned.",
+                    400: "Bad request (not an array of objects, or too many sections).",
+                },
+            },
+        },
+        override_request_schema={
+            reverse_func("registrations-bulk"): {
+                "POST": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "section": {"type": "string"},
+                            "auto_resubscribe": {"type": "boolean"},
+                            "close_notification": {"type": "boolean"},
+                        },
+                    },
+                },
+                "PUT": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "section": {"type": "string"},
+                            "resubscribe": {"type": "boolean"},
+                            "deleted": {"type": "boolean"},
+                            "cancelled": {"type": "boolean"},
+                            "auto_resubscribe": {"type": "boolean"},
+                            "close_notification": {"type": "boolean"},
+                        },
+                    },
+                },
+            }
         },
         override_response_schema={
             reverse_func("registrations-list"): {
                 "POST": {
                     201: {"properties": {"message": {"type": "string"}, "id": {"type": "integer"}}},
                 }
-            }
+            },
+            reverse_func("registrations-bulk"): {
+                method: {
+                    200: {
+                        "properties": {
+                            "results": {
+                                "type": "array",
+                                "items": {
+                                    "type": "object",
+                                    "properties": {
+                                        "section": {"type": "string"},
+                                        "status": {"type": "integer"},
+                                        detail_key: {"type": "string"},
+                                        "id": {"type": "integer"},
+                                    },
+                                },
+                            }
+                        }
+                    }
+                }
+                for method, detail_key in [("POST", "message"), ("PUT", "detail")]
+            },
         },
     )
     http_method_names = ["get", "post", "put"]
@@ -536,6 +955,278 @@ class RegistrationViewSet(AutoPrefetchViewSetMixin, viewsets.ModelViewSet):
             return self.update(request, request.data.get("id"))
         return self.handle_registration(request)
 
+    @action(detail=False, methods=["post"], url_path="bulk", url_name="bulk")
+    def bulk_create(self, request):
+        """
+        Use this route to create PCA registrations for multiple sections with a single request
+        (e.g. when a user sets up alerts for several sections at once). The body of the request
+        must be an array of objects, each of the same form as the body of a request to Create
+        Registration (except that the id field is ignored). All sections are resolved with a single
+        query, all registrations are created in a single transaction, and a single demand change
+        is scheduled.
+
+        The response contains a `results` array with one object per object in the request body
+        (in the same order), with its `section`, and the `status` code and `message` that
+        Create Registration would have returned for it (a 201 if the registration was created,
+        in which case its `id` is also included, or a 400, 404, 406 or 409). A section included
+        more than once gets a 400 after its first occurrence. If the request body is not an array
+        of objects or contains more than settings.PCA_BULK_REGISTRATION_LIMIT (100) objects,
+        a 400 is returned. If the authenticated user does not have either a phone or an email
+        set in their profile, a 406 is returned. If registration is not currently open on PCA,
+        a 503 is returned.
+        """
+        if not pca_registration_open():
+            return Response(
+                {"message": "Registration is not open."},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            )
+        items, error_response = parse_bulk_registration_request(request)
+        if error_response is not None:
+            return error_response
+        profile = request.user.profile
+        if not profile.email and not profile.phone and not profile.push_notifications:
+            return Response(
+                {
+                    "message": "You must set a phone number and/or an email address to "
+                    "register for an alert."
+                },
+                status=status.HTTP_406_NOT_ACCEPTABLE,
+            )
+
+        sections = resolve_registration_sections(
+            [item["section"] for item in items if isinstance(item.get("section"), str)],
+            get_current_semester(),
+        )
+        active_section_ids = set(
+            Registration.objects.filter(
+                user=request.user,
+                section__in=[section for section in sections.values() if section],
+                **Registration.is_active_filter(),
+            ).values_list("section_id", flat=True)
+        )
+        results = [None] * len(items)
+        to_create = dict()  # maps the index of each item to its new registration
+        seen_section_ids = set()
+        for i, item in enumerate(items):
+            section_code = item.get("section")
+            if not isinstance(section_code, str):
+                results[i] = {
+                    "section": section_code,
+                    "status": status.HTTP_400_BAD_REQUEST,
+                    "message": "You must include a not null section",
+                }
+                continue
+            section = sections[section_code]
+            if section is None:
+                results[i] = {
+                    "section": section_code,
+                    "status": status.HTTP_404_NOT_FOUND,
+                    "message": "%s did not match any course in our database. Please try again!"
+                    % section_code,
+                }
+            elif section.id in seen_section_ids:
+                results[i] = {
+                    "section": section.full_code,
+                    "status": status.HTTP_400_BAD_REQUEST,
+                    "message": "Section %s is included more than once in this request."
+                    % section.full_code,
+                }
+            elif section.id in active_section_ids:
+                results[i] = {
+                    "section": section.full_code,
+                    "status": status.HTTP_409_CONFLICT,
+                    "message": "You've already registered to get alerts for %s!"
+                    % section.full_code,
+                }
+            elif (
+                item.get("close_notification", False)
+                and not profile.email
+                and not profile.push_notifications
+            ):
+                results[i] = {
+                    "section": section.full_code,
+                    "status": status.HTTP_406_NOT_ACCEPTABLE,
+                    "message": "You can only enable close notifications on a registration if the "
+                    "user enables some form of communication other than just texts (we don't "
+                    "send any close notifications by text).",
+                }
+            else:
+                to_create[i] = Registration(
+                    section=section,
+                    user=request.user,
+                    source="PCA",
+                    auto_resubscribe=item.get("auto_resubscribe", False),
+                    close_notification=item.get("close_notification", False),
+                )
+            if section is not None:
+                seen_section_ids.add(section.id)
+
+        Registration.create_new(to_create.values())
+        for i, registration in to_create.items():
+            results[i] = {
+                "section": registration.section.full_code,
+                "status": status.HTTP_201_CREATED,
+                "message": "Your registration for %s was successful!"
+                % registration.section.full_code,
+                "id": registration.id,
+            }
+        return Response({"results": results}, status=status.HTTP_200_OK)
+
+    @bulk_create.mapping.put
+    def bulk_update(self, request):
+        """
+        Use this route to update the user's current PCA registrations for multiple sections with
+        a single request. The body of the request must be an array of objects, each with a
+        `section` field (the dash-separated full code of a section in the current semester) and
+        the parameters of a request to Update Registration for the user's current registration for
+        that section (the most recent undeleted registration at the head of its resubscribe chain,
+        as returned by List Registrations), with the same order of precedence. All sections and
+        registrations are resolved with a single query each, all changes are made in a single
+        transaction, and a single demand change is scheduled.
+
+        The response contains a `results` array with one object per object in the request body
+        (in the same order), with its `section`, and the `status` code and `detail` (or `message`)
+        that Update Registration would have returned for it (including the `id` of the new
+        registration if it was resubscribed to). If the user has no current registration for the
+        given section, a 404 is returned for it, and a section included more than once gets
+        a 400 after its first occurrence. If the request body is not an array of objects or
+        contains more than settings.PCA_BULK_REGISTRATION_LIMIT (100) objects, a 400 is returned.
+        """
+        items, error_response = parse_bulk_registration_request(request)
+        if error_response is not None:
+            return error_response
+        profile = request.user.profile
+        now = timezone.now()
+
+        sections = resolve_registration_sections(
+            [item["section"] for item in items if isinstance(item.get("section"), str)],
+            get_current_semester(),
+        )
+        results = [None] * len(items)
+        with transaction.atomic():
+            current = (
+                self.get_queryset()
+                .filter(
+                    section__in=[section for section in sections.values() if section],
+                    deleted=False,
+                    is_head=True,
+                )
+                .order_by("section_id", "-created_at", "-id")
+                .distinct("section_id")
+            )
+            registrations = {
+                registration.section_id: registration
+                for registration in Registration.objects.filter(id__in=current.values("id"))
+                .select_related("section")
+                .select_for_update(of=("self",))
+            }
+            was_active = dict()  # maps each changed registration to whether it was active
+            to_resubscribe = dict()  # maps the index of each item to the registration
+            for i, item in enumerate(items):
+                section_code = item.get("section")
+                section = sections.get(section_code) if isinstance(section_code, str) else None
+                registration = registrations.get(section.id) if section else None
+                if registration is None:
+                    results[i] = {
+                        "section": section_code,
+                        "status": status.HTTP_404_NOT_FOUND,
+                        "detail": "You have no current registration for this section.",
+                    }
+                    continue
+                result = {"section": section.full_code, "status": status.HTTP_200_OK}
+                results[i] = result
+                if registration in was_active or registration in to_resubscribe.values():
+                    result.update(
+                        status=status.HTTP_400_BAD_REQUEST,
+                        detail="Section %s is included more than once in this request."
+                        % section.full_code,
+                    )
+                elif item.get("resubscribe", False):
+                    if not pca_registration_open():
+                        result.update(
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            message="Registration is not open.",
+                        )
+                    elif not registration.notification_sent and not registration.cancelled:
+                        result.update(
+                            status=status.HTTP_400_BAD_REQUEST,
+                            detail="You can only resubscribe to a registration that "
+                            "has already been sent or has been cancelled.",
+                        )
+                    else:
+                        to_resubscribe[i] = registration
+                elif item.get("deleted", False):
+                    was_active[registration] = registration.is_active
+                    registration.deleted = True
+                    registration.deleted_at = now
+                    result["detail"] = "Registration deleted"
+                elif item.get("cancelled", False):
+                    if registration.notification_sent:
+                        result.update(
+                            status=status.HTTP_400_BAD_REQUEST,
+                            detail="You cannot cancel a sent registration.",
+                        )
+                    elif registration.cancelled:
+                        result["detail"] = "no changes made"
+                    else:
+                        was_active[registration] = registration.is_active
+                        registration.cancelled = True
+                        registration.cancelled_at = now
+                        result["detail"] = "Registration cancelled"
+                elif "auto_resubscribe" in item or "close_notification" in item:
+                    auto_resubscribe = item.get("auto_resubscribe", registration.auto_resubscribe)
+                    close_notification = item.get(
+                        "close_notification", registration.close_notification
+                    )
+                    if close_notification and not profile.email and not profile.push_notifications:
+                        result.update(
+                            status=status.HTTP_406_NOT_ACCEPTABLE,
+                            detail="You cannot enable close_notifications with only "
+                            "your phone number saved in your user profile.",
+                        )
+                        continue
+                    changes = []
+                    if registration.auto_resubscribe != auto_resubscribe:
+                        changes.append(f"auto_resubscribe updated to {auto_resubscribe}")
+                    if registration.close_notification != close_notification:
+                        changes.append(f"close_notification updated to {close_notification}")
+                    if changes:
+                        was_active[registration] = registration.is_active
+                        registration.auto_resubscribe = auto_resubscribe
+                        registration.close_notification = close_notification
+                    result["detail"] = ", ".join(changes) or "no changes made"
+                else:
+                    result["detail"] = "no changes made"
+
+            changed = list(was_active)
+            for registration in changed:
+                registration.updated_at = now
+            Registration.objects.bulk_update(
+                changed,
+                [
+                    "deleted",
+                    "deleted_at",
+                    "cancelled",
+                    "cancelled_at",
+                    "auto_resubscribe",
+                    "close_notification",
+                    "updated_at",
+                ],
+            )
+            successors = Registration.create_successors(to_resubscribe.values())
+            for i, successor in zip(to_resubscribe, successors):
+                results[i].update(detail="Resubscribed successfully", id=successor.id)
+
+            volume_changes = Counter()
+            for registration, active in was_active.items():
+                volume_changes[registration.section_id, registration.semester] += int(
+                    registration.is_active
+                ) - int(active)
+            for successor in successors:
+                volume_changes[successor.section_id, successor.semester] += 1
+            Registration.apply_volume_changes(volume_changes, now, changed + successors)
+        return Response({"results": results}, status=status.HTTP_200_OK)
+
     queryset = Registration.objects.none()  # included redundantly for docs
 
     def get_queryset(self):
@@ -551,15 +1242,17 @@ class RegistrationViewSet(AutoPrefetchViewSetMixin, viewsets.ModelViewSet):
         registrations = Registration.objects.filter(
             user=self.request.user,
             deleted=False,
-            resubscribed_to__isnull=True,
-            section__course__semester=get_current_semester(),
+            is_head=True,
+            semester=get_current_semester(),
         )
         # Now resolve conflicts where multiple registrations exist for the same section
-        # (by taking the registration with the later created_at date)
-        return registrations.filter(
-            created_at__in=registrations.values("section")
-            .annotate(max_created_at=Max("created_at"))
-            .values_list("max_created_at", flat=True)
+        # (by taking the registration with the later created_at date, with DISTINCT ON)
+        return annotate_registration_list(
+            Registration.objects.filter(
+                id__in=registrations.order_by("section_id", "-created_at", "-id")
+                .distinct("section_id")
+                .values("id")
+            )
         )
 
 
@@ -598,6 +1291,6 @@ class RegistrationHistoryViewSet(AutoPrefetchViewSetMixin, viewsets.ReadOnlyMode
     queryset = Registration.objects.none()  # included redundantly for docs
 
     def get_queryset(self):
-        return Registration.objects.filter(
-            user=self.request.user, section__course__semester=get_current_semester()
-        ).prefetch_related("section")
+        return annotate_registration_list(
+            Registration.objects.filter(user=self.request.user, semester=get_current_semester())
+        )
@@ -0,0 +1,244 @@
+import json
+import logging
+import zlib
+
+import redis
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from courses.util import separate_course_code
+
+
+"""
+Webhook Queue
+=============
+
+When settings.WEBHOOK_QUEUE_ENABLED is set, accept_webhook (in alert/views.py) acknowledges
+each registrar course status update as soon as it has been authenticated and validated,
+after appending the raw request body (and the time it was received) to a Redis stream.
+The updates are then applied asynchronously by the process_webhook_queue Celery task.
+
+The queue is split into settings.WEBHOOK_QUEUE_PARTITIONS streams, and all updates for the same
+section are appended to the same partition. Each partition is consumed by at most one
+worker at a time (guarded by a Redis lock), which applies its entries in order and
+acknowledges each entry only after it has been applied (at-least-once delivery).
+Applying an entry is idempotent, since an update is skipped if its section already has a
+status update at or after the time the update was received (see apply_webhook_update).
+If applying an entry raises an unexpected error, the entry is left pending and the drain
+stops (to be retried after settings.WEBHOOK_QUEUE_RETRY_DELAY seconds, preserving the order of
+the partition's updates); once an entry has been delivered settings.WEBHOOK_QUEUE_MAX_DELIVERIES
+times, it is moved to the partition's dead-letter stream instead, so that one bad entry can't
+stall its partition.
+Entries are retained (up to roughly settings.WEBHOOK_QUEUE_MAXLEN per partition) after they
+have been acknowledged, so they can be replayed with the webhookqueue management command.
+Note that the Redis server should be configured with appendonly persistence for the queue
+to survive a Redis restart. If Redis is unavailable, accept_webhook applies the update
+synchronously (as it would with the queue disabled).
+"""
+
+logger = logging.getLogger(__name__)
+r = redis.Redis.from_url(settings.REDIS_URL)
+
+CONSUMER_GROUP = "webhook-queue"
+CONSUMER_NAME = "webhook-queue-consumer"  # only one consumer per partition holds its lock
+
+
+def webhook_queue_key(partition):
+    return f"webhook_queue:{partition}"
+
+
+def webhook_queue_dead_letter_key(partition):
+    return f"webhook_queue:{partition}:dead"
+
+
+def get_webhook_queue_partition(course_id):
+    """
+    Returns the partition of the webhook queue that updates for the given section should
+    be appended to. Raises a ValueError if the given course code cannot be parsed.
+    """
+    full_code = "-".join(separate_course_code(course_id))
+    return zlib.crc32(full_code.encode()) % settings.WEBHOOK_QUEUE_PARTITIONS
+
+
+def enqueue_webhook_update(fields, request_body):
+    """
+    Appends the given registrar course status update (with fields as returned by
+    parse_webhook_update, and the given raw request body) to the webhook queue,
+    and makes sure a process_webhook_queue task is scheduled for its partition.
+    Returns True if the update was queued, and False (logging the error) if Redis is
+    unavailable or the task could not be scheduled, in which case the caller should apply the
+    update synchronously (the queued entry is then skipped, since applying it is idempotent).
+    """
+    from alert.tasks import process_webhook_queue  # avoid circular imports
+
+    partition = get_webhook_queue_partition(fields["course_id"])
+    key = webhook_queue_key(partition)
+    pipe = r.pipeline(transaction=False)
+    pipe.xadd(
+        key,
+        {"body": request_body, "received_at": timezone.now().isoformat()},
+        maxlen=settings.WEBHOOK_QUEUE_MAXLEN,
+        approximate=True,
+    )
+    # The flag expires in case the scheduled task is lost before it starts draining
+    pipe.set(f"{key}:scheduled", 1, nx=True, ex=settings.WEBHOOK_QUEUE_SCHEDULED_TIMEOUT)
+    try:
+        _, newly_scheduled = pipe.execute()
+    except redis.exceptions.RedisError as e:
+        logger.error(f"Could not queue webhook update, applying it synchronously: {e}")
+        return False
+    if newly_scheduled:
+        try:
+            process_webhook_queue.delay(partition)
+        except Exception as e:
+            logger.error(
+                f"Could not schedule webhook queue task, applying update synchronously: {e}"
+            )
+            try:
+                r.delete(f"{key}:scheduled")
+            except redis.exceptions.RedisError as e:
+                logger.error(f"Could not clear webhook queue scheduled flag: {e}")
+            return False
+    return True
+
+
+def apply_webhook_queue_entry(entry):
+    """
+    Applies the given webhook queue entry (a dict with the keys `body` and `received_at`,
+    as stored in the stream). Errors are logged (as they are by accept_webhook) and do not
+    stop the queue, since the registrar would have been told to ignore them anyway.
+    Returns the webhook response message for the update.
+    """
+    from alert.views import apply_webhook_update, parse_webhook_update
+
+    # ^ imported here to avoid circular imports
+
+    try:
+        body = entry[b"body"]
+        fields, error = parse_webhook_update(json.loads(body))
+        if error is not None:
+            return error[1]
+        created_at = parse_datetime(entry[b"received_at"].decode())
+        return apply_webhook_update(fields, body, created_at=created_at)
+    except (ValidationError, ValueError) as e:
+        logger.error(e)
+        return "We got an error but webhook should ignore it"
+
+
+def ensure_webhook_queue_group(key):
+    try:
+        r.xgroup_create(key, CONSUMER_GROUP, id="0", mkstream=True)
+    except redis.exceptions.ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise e
+
+
+def dead_letter_webhook_queue_entry(partition, entry_id, entry, error):
+    """
+    Moves the given pending entry of the given partition (whose application raised the given
+    error) to the partition's dead-letter stream, if it has been delivered at least
+    settings.WEBHOOK_QUEUE_MAX_DELIVERIES times. The caller should acknowledge the entry if it
+    was moved. Returns True if the entry was moved, and False if it should be retried.
+    """
+    key = webhook_queue_key(partition)
+    pending = r.xpending_range(key, CONSUMER_GROUP, min=entry_id, max=entry_id, count=1)
+    if pending and pending[0]["times_delivered"] < settings.WEBHOOK_QUEUE_MAX_DELIVERIES:
+        return False
+    r.xadd(
+        webhook_queue_dead_letter_key(partition),
+        {**entry, b"entry_id": entry_id, b"error": repr(error)},
+        maxlen=settings.WEBHOOK_QUEUE_MAXLEN,
+        approximate=True,
+    )
+    logger.error(f"Moved webhook queue entry {entry_id.decode()} to {partition} dead letters")
+    return True
+
+
+def drain_webhook_queue(partition, count=100):
+    """
+    Applies all unprocessed entries in the given partition of the webhook queue, in order.
+    Entries that were delivered to a previous consumer but never acknowledged (e.g. because
+    the worker crashed) are applied first. If an entry raises an unexpected error, it is
+    either left pending and the drain is stopped (and retried later), or it is dead-lettered
+    (see dead_letter_webhook_queue_entry). Returns the number of entries applied.
+    """
+    from alert.tasks import process_webhook_queue  # avoid circular imports
+
+    key = webhook_queue_key(partition)
+    ensure_webhook_queue_group(key)
+    r.delete(f"{key}:scheduled")
+    num_applied = 0
+    while True:
+        with r.lock(f"{key}:lock", timeout=300, blocking_timeout=300):
+            # Read pending (delivered but unacknowledged) entries first, then new entries
+            entries = []
+            for start_id in ["0", ">"]:
+                response = r.xreadgroup(CONSUMER_GROUP, CONSUMER_NAME, {key: start_id}, count=count)
+                entries = response[0][1] if response else []
+                if entries:
+                    break
+            if not entries:
+                break
+            for entry_id, entry in entries:
+                # Entries trimmed from the stream while pending are returned empty
+                if not entry:
+                    r.xack(key, CONSUMER_GROUP, entry_id)
+                    continue
+                try:
+                    apply_webhook_queue_entry(entry)
+                except Exception as e:
+                    logger.exception(f"Could not apply webhook queue entry {entry_id.decode()}")
+                    if not dead_letter_webhook_queue_entry(partition, entry_id, entry, e):
+                        # Leave the entry pending, so it is retried before any later entries
+                        process_webhook_queue.apply_async(
+                            (partition,), countdown=settings.WEBHOOK_QUEUE_RETRY_DELAY
+                        )
+                        return num_applied
+                    r.xack(key, CONSUMER_GROUP, entry_id)
+                    continue
+                r.xack(key, CONSUMER_GROUP, entry_id)
+                num_applied += 1
+    return num_applied
+
+
+def replay_webhook_queue(partition, start="-", end="+", count=1000):
+    """
+    Re-applies all entries (acknowledged or not) in the given partition of the webhook queue
+    with stream ids between start and end (inclusive), in order. Since applying an entry is
+    idempotent, this only has an effect for updates that are missing from the database
+    (e.g. after restoring the database from a backup). Returns the number of entries replayed.
+    """
+    key = webhook_queue_key(partition)
+    num_replayed = 0
+    while True:
+        with r.lock(f"{key}:lock", timeout=300, blocking_timeout=300):
+            entries = r.xrange(key, min=start, max=end, count=count)
+            if not entries:
+                break
+            for _, entry in entries:
+                apply_webhook_queue_entry(entry)
+                num_replayed += 1
+        start = "(" + entries[-1][0].decode()
+    return num_replayed
+
+
+def get_webhook_queue_stats(partition):
+    """
+    Returns a dict describing the given partition of the webhook queue, with the keys
+    `length` (the number of retained entries), `pending` (the number of entries delivered to
+    a consumer but not yet acknowledged), `dead_letters` (the number of retained dead-lettered
+    entries), `last_entry_id` and `last_delivered_id`.
+    """
+    key = webhook_queue_key(partition)
+    ensure_webhook_queue_group(key)
+    group = next(g for g in r.xinfo_groups(key) if g["name"].decode() == CONSUMER_GROUP)
+    stream = r.xinfo_stream(key)
+    return {
+        "length": stream["length"],
+        "pending": group["pending"],
+        "dead_letters": r.xlen(webhook_queue_dead_letter_key(partition)),
+        "last_entry_id": stream["last-generated-id"].decode(),
+        "last_delivered_id": group["last-delivered-id"].decode(),
+    }
@@ -19,6 +19,7 @@ from courses.models import (
     Room,
     Section,
     StatusUpdate,
+    StatusUpdateRequestBody,
     Topic,
     UserProfile,
 )
@@ -181,8 +182,9 @@ class PreNGSSRequirementAdmin(admin.ModelAdmin):
 
 class StatusUpdateAdmin(admin.ModelAdmin):
     autocomplete_fields = ("section",)
-    readonly_fields = ("created_at",)
-    list_filter = ("section__course__semester",)
+    exclude = ("request_body", "request_body_ref")
+    readonly_fields = ("created_at", "raw_request_body")
+    list_filter = ("semester",)
     list_select_related = ["section", "section__course", "section__course__department"]
     search_fields = ("section__full_code",)
 
@@ -200,6 +202,7 @@ admin.site.register(PreNGSSRestriction)
 admin.site.register(Instructor, InstructorAdmin)
 admin.site.register(Meeting, MeetingAdmin)
 admin.site.register(StatusUpdate, StatusUpdateAdmin)
+admin.site.register(StatusUpdateRequestBody)
 admin.site.register(Attribute, AttributeAdmin)
 
 # https://github.com/sibtc/django-admin-user-profile
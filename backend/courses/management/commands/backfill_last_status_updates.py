@@ -0,0 +1,63 @@
+from textwrap import dedent
+
+from django.core.management.base import BaseCommand, CommandError
+
+from alert.management.commands.recomputestats import get_semesters
+from courses.util import find_inconsistent_last_status_updates, recompute_last_status_updates
+
+
+class Command(BaseCommand):
+    help = dedent(
+        """
+    Backfill (or check) the denormalized Section.last_status_update, last_status_update_at and
+    last_status_update_new_status fields from the StatusUpdate table. The migration adding these
+    fields backfills them, and they are automatically maintained when status updates are saved
+    or bulk recorded (and recomputed by recomputestats after deduplicating status updates), so
+    this script only needs to be run if status updates were written or deleted some other way
+    (e.g. with raw SQL). Pass --check to report any inconsistent sections without modifying the
+    database (the command fails if any are found).
+    """
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--semesters",
+            type=str,
+            help=dedent(
+                """
+                The semesters argument should be a comma-separated list of semesters
+            corresponding to the semesters for which you want to backfill/check the
+            last status update fields of sections, i.e. "2019C,2020A,2020C" for fall 2019,
+            spring 2020, and fall 2020. If you pass "all" to this argument (the default),
+            this script will backfill/check sections from all semesters.
+                """
+            ),
+            nargs="?",
+            default="all",
+        )
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Only check for inconsistent sections (don't modify the database).",
+        )
+
+    def handle(self, *args, **kwargs):
+        semesters = None
+        if kwargs["semesters"] != "all":
+            semesters = get_semesters(semesters=kwargs["semesters"])
+
+        if kwargs["check"]:
+            section_ids = find_inconsistent_last_status_updates(semesters=semesters)
+            if section_ids:
+                raise CommandError(
+                    f"{len(section_ids)} sections have inconsistent last status update fields "
+                    f"(section ids: {section_ids[:100]}"
+                    f"{', ...' if len(section_ids) > 100 else ''}). "
+                    "Run this command without --check to fix them."
+                )
+            print("All last status update fields are consistent.")
+            return
+
+        print("Backfilling last status update fields...")
+        num_updated = recompute_last_status_updates(semesters=semesters)
+        print(f"Done. Updated {num_updated} sections.")
@@ -0,0 +1,109 @@
+from textwrap import dedent
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import F
+
+from alert.management.commands.recomputestats import get_semesters
+from alert.models import Registration
+from courses.models import StatusUpdate
+
+
+# Maps each model with a denormalized semester column to the SQL that sets that column from its
+# section's course (for rows whose section is in one of the semesters given by %(semesters)s)
+SEMESTER_COLUMN_BACKFILL_SQL = {
+    model: f"""
+    UPDATE {model._meta.db_table} AS t
+    SET semester = c.semester
+    FROM courses_section AS s
+    INNER JOIN courses_course AS c ON c.id = s.course_id
+    WHERE s.id = t.section_id AND c.semester = ANY(%(semesters)s)
+        AND t.semester IS DISTINCT FROM c.semester
+    """
+    for model in [StatusUpdate, Registration]
+}
+
+
+def find_inconsistent_semester_columns(semesters):
+    """
+    Returns a dict mapping each model with a denormalized semester column (StatusUpdate and
+    Registration) to the number of its objects from the given semesters whose semester column
+    doesn't match the semester of their section.
+    """
+    return {
+        model: model.objects.filter(section__course__semester__in=semesters)
+        .exclude(semester=F("section__course__semester"))
+        .count()
+        for model in SEMESTER_COLUMN_BACKFILL_SQL
+    }
+
+
+def backfill_semester_columns(semesters):
+    """
+    Sets the denormalized semester column of all StatusUpdate and Registration objects from
+    the given semesters (that don't already have the right value). Returns a dict mapping each
+    model to the number of its objects updated.
+    """
+    num_updated = dict()
+    with connection.cursor() as cursor:
+        for model, sql in SEMESTER_COLUMN_BACKFILL_SQL.items():
+            cursor.execute(sql, {"semesters": list(semesters)})
+            num_updated[model] = cursor.rowcount
+    return num_updated
+
+
+class Command(BaseCommand):
+    help = dedent(
+        """
+    Backfill (or check) the denormalized semester columns of the StatusUpdate and Registration
+    tables from the semesters of their sections. The migration adding these columns backfills
+    them, and they are automatically set when status updates and registrations are saved,
+    so this script only needs to be run if rows were written some other way (e.g. with raw SQL).
+    Pass --check to report inconsistent rows without modifying the database (the command fails
+    if any are found).
+    """
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--semesters",
+            type=str,
+            help=dedent(
+                """
+                The semesters argument should be a comma-separated list of semesters
+            corresponding to the semesters for which you want to backfill/check the semester
+            columns, i.e. "2019C,2020A,2020C" for fall 2019, spring 2020, and fall 2020.
+            If you pass "all" to this argument (the default), this script will backfill/check
+            rows from all semesters.
+                """
+            ),
+            nargs="?",
+            default="all",
+        )
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Only check for inconsistent rows (don't modify the database).",
+        )
+
+    def handle(self, *args, **kwargs):
+        semesters = get_semesters(semesters=kwargs["semesters"])
+
+        if kwargs["check"]:
+            inconsistent = {
+                model._meta.verbose_name_plural: count
+                for model, count in find_inconsistent_semester_columns(semesters).items()
+                if count
+            }
+            if inconsistent:
+                raise CommandError(
+                    f"Found rows with inconsistent semester columns: {inconsistent}. "
+                    "Run this command without --check to fix them."
+                )
+            print("All semester columns are consistent.")
+            return
+
+        print(f"Backfilling semester columns for semesters {semesters}...")
+        num_updated = backfill_semester_columns(semesters)
+        for model, count in num_updated.items():
+            print(f"Updated {count} {model._meta.verbose_name_plural}.")
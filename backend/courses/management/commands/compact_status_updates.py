@@ -0,0 +1,122 @@
+from datetime import timedelta
+from textwrap import dedent
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from tqdm import tqdm
+
+from alert.management.commands.recomputestats import get_semesters
+from courses.models import StatusUpdate, StatusUpdateRequestBody
+
+
+BATCH_SIZE = 5000  # The number of status updates to compact at a time
+
+
+def compact_status_updates(semesters, batch_size=BATCH_SIZE, verbose=False):
+    """
+    Moves the inline request bodies of all status updates from the given semesters into the
+    StatusUpdateRequestBody table (see StatusUpdate.compact_request_bodies), in batches
+    of batch_size status updates (each batch is atomic). Returns the number of status updates
+    compacted.
+    """
+    status_updates = StatusUpdate.objects.filter(semester__in=semesters).exclude(request_body="")
+    num_compacted = 0
+    with tqdm(total=status_updates.count(), disable=not verbose) as progress:
+        while True:
+            with transaction.atomic():
+                batch = status_updates.only("id", "request_body").select_for_update(of=("self",))
+                batch = list(batch[:batch_size])
+                if not batch:
+                    break
+                StatusUpdate.compact_request_bodies(batch)
+                StatusUpdate.objects.bulk_update(batch, ["request_body", "request_body_ref"])
+            num_compacted += len(batch)
+            progress.update(len(batch))
+    return num_compacted
+
+
+def drop_old_request_bodies(semesters, days):
+    """
+    Drops the request bodies (inline or compacted) of all status updates from the given
+    semesters that were created more than the given number of days ago.
+    Returns the number of status updates modified.
+    """
+    return (
+        StatusUpdate.objects.filter(
+            semester__in=semesters,
+            created_at__lt=timezone.now() - timedelta(days=days),
+        )
+        .exclude(request_body="", request_body_ref__isnull=True)
+        .update(request_body="", request_body_ref=None)
+    )
+
+
+def delete_unreferenced_request_bodies():
+    """
+    Deletes all StatusUpdateRequestBody objects not referenced by any status update
+    (see StatusUpdateRequestBody.delete_unreferenced). Returns the number of objects deleted.
+    """
+    return StatusUpdateRequestBody.delete_unreferenced()
+
+
+class Command(BaseCommand):
+    help = dedent(
+        """
+    Compact the request bodies of existing status updates, by moving them into the compressed,
+    deduplicated StatusUpdateRequestBody table (new status updates are compacted when they are
+    saved if settings.STATUS_UPDATE_COMPACT_REQUEST_BODIES is enabled). Optionally drops request
+    bodies older than a given number of days entirely. Unreferenced request bodies are deleted
+    at the end.
+    """
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--semesters",
+            type=str,
+            help=dedent(
+                """
+                The semesters argument should be a comma-separated list of semesters
+            corresponding to the semesters for which you want to compact status updates,
+            i.e. "2019C,2020A,2020C" for fall 2019, spring 2020, and fall 2020. If you pass "all"
+            to this argument (the default), this script will compact status updates from
+            all semesters.
+                """
+            ),
+            nargs="?",
+            default="all",
+        )
+        parser.add_argument(
+            "--drop-older-than",
+            type=int,
+            default=None,
+            help=(
+                "If specified, the request bodies of status updates created more than this many "
+                "days ago are dropped (rather than compacted)."
+            ),
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=BATCH_SIZE,
+            help=f"The number of status updates to compact at a time (default {BATCH_SIZE}).",
+        )
+
+    def handle(self, *args, **kwargs):
+        semesters = get_semesters(semesters=kwargs["semesters"])
+
+        if kwargs["drop_older_than"] is not None:
+            print(f"Dropping request bodies older than {kwargs['drop_older_than']} days...")
+            num_dropped = drop_old_request_bodies(semesters, kwargs["drop_older_than"])
+            print(f"Dropped the request bodies of {num_dropped} status updates.")
+
+        print(f"Compacting request bodies of status updates from semesters {semesters}...")
+        num_compacted = compact_status_updates(
+            semesters, batch_size=kwargs["batch_size"], verbose=True
+        )
+        num_deleted = delete_unreferenced_request_bodies()
+        print(
+            f"Done. Compacted {num_compacted} status updates "
+            f"(and deleted {num_deleted} unreferenced request bodies)."
+        )
@@ -72,7 +72,7 @@ class Command(BaseCommand):
             )
             for update in tqdm(
                 StatusUpdate.objects.filter(
-                    section__course__semester__in=semesters,
+                    semester__in=semesters,
                     section__course__full_code__startswith=kwargs["courses_query"],
                 ).select_related("section")
             ):
@@ -82,7 +82,7 @@ class Command(BaseCommand):
                         str(field)
                         for field in [
                             update.section.full_code,
-                            update.section.semester,
+                            update.semester,
                             update.created_at.strftime("%Y-%m-%d %H:%M:%S.%f %Z"),
                             update.old_status,
                             update.new_status,
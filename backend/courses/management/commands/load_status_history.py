@@ -12,10 +12,12 @@ from tqdm import tqdm
 from alert.management.commands.recomputestats import recompute_stats
 from alert.models import AddDropPeriod
 from courses.models import Section, StatusUpdate
-from courses.util import get_or_create_add_drop_period
 from PennCourses.settings.base import TIME_ZONE
 
 
+BATCH_SIZE = 5000  # The number of status updates to insert at a time
+
+
 class Command(BaseCommand):
     help = (
         "Load course status history into the database from a CSV file with the 6 columns:\n"
@@ -69,6 +71,7 @@ class Command(BaseCommand):
             with open(src) as history_file:
                 print(f"Beginning to load status history from {src}")
                 history_reader = csv.reader(history_file)
+                status_updates = []
                 for row in tqdm(history_reader, total=row_count):
                     full_code = row[0]
                     semester = row[1]
@@ -84,16 +87,19 @@ class Command(BaseCommand):
                     if (full_code, semester) not in sections_map.keys():
                         raise ValueError(f"Section {full_code} {semester} not found in db.")
                     section_id = sections_map[full_code, semester]
-                    status_update = StatusUpdate(
-                        section_id=section_id,
-                        old_status=old_status,
-                        new_status=new_status,
-                        created_at=created_at,
-                        alert_sent=alert_sent,
+                    status_updates.append(
+                        StatusUpdate(
+                            section_id=section_id,
+                            old_status=old_status,
+                            new_status=new_status,
+                            created_at=created_at,
+                            alert_sent=alert_sent,
+                        )
                     )
-                    if semester not in add_drop_periods:
-                        add_drop_periods[semester] = get_or_create_add_drop_period(semester)
-                    status_update.save(add_drop_period=add_drop_periods[semester])
+                    if len(status_updates) >= BATCH_SIZE:
+                        StatusUpdate.bulk_record(status_updates, add_drop_periods=add_drop_periods)
+                        status_updates = []
+                StatusUpdate.bulk_record(status_updates, add_drop_periods=add_drop_periods)
 
                 print(f"Finished loading status history from {src}... processed {row_count} rows. ")
 
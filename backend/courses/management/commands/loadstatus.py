@@ -3,6 +3,7 @@ import logging
 from django.core.management.base import BaseCommand
 from tqdm import tqdm
 
+from alert.demand_index import rebuild_demand_index
 from courses import registrar
 from courses.models import Course, Section
 from courses.util import get_course_and_section, get_current_semester
@@ -23,6 +24,7 @@ def set_all_status(semester=None):
             continue
         section.status = status["status"]
         section.save()
+    rebuild_demand_index(semester)
 
 
 class Command(BaseCommand):
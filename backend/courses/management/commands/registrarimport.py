@@ -10,7 +10,12 @@ from courses.management.commands.load_crosswalk import load_crosswalk
 from courses.management.commands.loadstatus import set_all_status
 from courses.management.commands.reset_topics import fill_topics
 from courses.models import Department, Section
-from courses.util import get_current_semester, in_dev, upsert_course_from_opendata
+from courses.util import (
+    get_current_semester,
+    in_dev,
+    upsert_course_from_opendata,
+    warm_section_id_cache,
+)
 from review.management.commands.clearcache import clear_cache
 
 
@@ -28,6 +33,9 @@ def registrar_import(semester=None, query=""):
         upsert_course_from_opendata(info, semester, missing_sections)
     Section.objects.filter(full_code__in=missing_sections).update(status="X")
 
+    print("Warming section id cache...")
+    warm_section_id_cache(semester)
+
     print("Updating department names...")
     departments = registrar.get_departments()
     for dept_code, dept_name in tqdm(departments.items()):
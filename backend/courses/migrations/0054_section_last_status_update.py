@@ -0,0 +1,61 @@
+# Generated by Django 4.0.5 on 2026-10-18 06:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("courses", "0053_alter_ngssrestriction_code"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="section",
+            name="last_status_update",
+            field=models.ForeignKey(
+                blank=True,
+                help_text="\nThe last StatusUpdate object for this section (by created_at), or null if no status\nupdates have occurred for this section yet (precomputed for efficiency). This field,\nalong with `last_status_update_at` and `last_status_update_new_status`,\nis maintained by the save and bulk_record methods of StatusUpdate (and recomputed\nwhen a status update is deleted), and can be backfilled/checked with the\n`backfill_last_status_updates` management command.\n",
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to="courses.statusupdate",
+            ),
+        ),
+        migrations.AddField(
+            model_name="section",
+            name="last_status_update_at",
+            field=models.DateTimeField(
+                blank=True,
+                help_text="\nThe created_at time of this section's last StatusUpdate (precomputed for efficiency),\nor null if no status updates have occurred for this section yet.\n",
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="section",
+            name="last_status_update_new_status",
+            field=models.CharField(
+                blank=True,
+                choices=[("O", "Open"), ("C", "Closed"), ("X", "Cancelled"), ("", "Unlisted")],
+                help_text='The new_status of this section\'s last StatusUpdate (precomputed for efficiency), or null if no status updates have occurred for this section yet. Options and meanings: <table width=100%><tr><td>"O"</td><td>"Open"</td></tr><tr><td>"C"</td><td>"Closed"</td></tr><tr><td>"X"</td><td>"Cancelled"</td></tr><tr><td>""</td><td>"Unlisted"</td></tr></table>',
+                max_length=16,
+                null=True,
+            ),
+        ),
+        migrations.RunSQL(
+            """
+            UPDATE courses_section AS s
+            SET last_status_update_id = u.id,
+                last_status_update_at = u.created_at,
+                last_status_update_new_status = u.new_status
+            FROM (
+                SELECT DISTINCT ON (section_id) id, section_id, created_at, new_status
+                FROM courses_statusupdate
+                ORDER BY section_id, created_at DESC, id DESC
+            ) AS u
+            WHERE s.id = u.section_id
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 4.0.5 on 2026-10-18 07:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("courses", "0054_section_last_status_update"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StatusUpdateRequestBody",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                (
+                    "digest",
+                    models.CharField(
+                        help_text="The SHA-256 hex digest of the (uncompressed) request body.",
+                        max_length=64,
+                        unique=True,
+                    ),
+                ),
+                (
+                    "compressed_body",
+                    models.BinaryField(help_text="The zlib-compressed request body."),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name="statusupdate",
+            name="request_body_ref",
+            field=models.ForeignKey(
+                blank=True,
+                help_text="\nThe compressed request body of this status update, if it has been compacted\n(in which case the `request_body` field is empty). Request bodies are compacted when they\nare saved if settings.STATUS_UPDATE_COMPACT_REQUEST_BODIES is enabled, and existing\nstatus updates can be compacted with the `compact_status_updates` management command.\nUse the `raw_request_body` property to read a status update's request body either way.\n",
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="status_updates",
+                to="courses.statusupdaterequestbody",
+            ),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.0.5 on 2026-10-18 07:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("courses", "0055_statusupdate_request_body_ref"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="statusupdate",
+            name="semester",
+            field=models.CharField(
+                db_index=True,
+                default="",
+                help_text="\nThe semester of this status update's section (denormalized from `section.course.semester`\nso that queries for a semester's status updates don't need to join through the section\nand course tables). This field is set automatically when the status update is saved.\n",
+                max_length=5,
+            ),
+            preserve_default=False,
+        ),
+        migrations.RunSQL(
+            """
+            UPDATE courses_statusupdate AS t
+            SET semester = c.semester
+            FROM courses_section AS s
+            INNER JOIN courses_course AS c ON c.id = s.course_id
+            WHERE s.id = t.section_id
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -1,12 +1,16 @@
+import hashlib
 import math
 import uuid
+import zlib
+from contextlib import nullcontext
 from textwrap import dedent
 
 import phonenumbers
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import models, transaction
+from django.db import connection, models, transaction
 from django.db.models import Case, OuterRef, Q, Subquery, Value, When
 from django.db.models.signals import post_save
 from django.dispatch import receiver
@@ -777,6 +781,42 @@ class Section(models.Model):
             """
         ),
     )
+    last_status_update = models.ForeignKey(
+        "StatusUpdate",
+        on_delete=models.SET_NULL,
+        related_name="+",
+        null=True,
+        blank=True,
+        help_text=dedent(
+            """
+            The last StatusUpdate object for this section (by created_at), or null if no status
+            updates have occurred for this section yet (precomputed for efficiency). This field,
+            along with `last_status_update_at` and `last_status_update_new_status`,
+            is maintained by the save and bulk_record methods of StatusUpdate (and recomputed
+            when a status update is deleted), and can be backfilled/checked with the
+            `backfill_last_status_updates` management command.
+            """
+        ),
+    )
+    last_status_update_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text=dedent(
+            """
+            The created_at time of this section's last StatusUpdate (precomputed for efficiency),
+            or null if no status updates have occurred for this section yet.
+            """
+        ),
+    )
+    last_status_update_new_status = models.CharField(
+        max_length=16,
+        choices=STATUS_CHOICES,
+        null=True,
+        blank=True,
+        help_text="The new_status of this section's last StatusUpdate (precomputed for "
+        "efficiency), or null if no status updates have occurred for this section yet. "
+        "Options and meanings: " + string_dict_to_html(dict(STATUS_CHOICES)),
+    )
 
     registration_volume = models.PositiveIntegerField(
         default=0, help_text="The number of active PCA registrations watching this section."
@@ -860,20 +900,91 @@ class Section(models.Model):
         else:
             return self.percent_open
 
+    def save(self, *args, **kwargs):
+        self.full_code = f"{self.course.full_code}-{self.code}"
+        super().save(*args, **kwargs)
+
+
+class StatusUpdateRequestBody(models.Model):
+    """
+    A compressed raw webhook request body, stored once per distinct body (content-addressed
+    by its SHA-256 digest). When settings.STATUS_UPDATE_COMPACT_REQUEST_BODIES is enabled,
+    StatusUpdate objects reference these objects (with their `request_body_ref` field)
+    rather than storing their request bodies inline, which keeps courses_statusupdate small.
+    """
+
+    digest = models.CharField(
+        max_length=64,
+        unique=True,
+        help_text="The SHA-256 hex digest of the (uncompressed) request body.",
+    )
+    compressed_body = models.BinaryField(help_text="The zlib-compressed request body.")
+
+    # The key of the Postgres advisory lock that store() holds (shared) until the end of its
+    # transaction, and that delete_unreferenced() takes exclusively, so that a request body
+    # can't be deleted between being looked up by store() and being referenced by a status update
+    STORE_LOCK_KEY = 0x5C0DE5
+
+    def __str__(self):
+        return self.digest
+
     @property
-    def last_status_update(self):
+    def body(self):
         """
-        Returns the last StatusUpdate object for this section, or None if no status updates
-        have occured for this section yet.
+        The decompressed request body.
         """
-        try:
-            return StatusUpdate.objects.filter(section=self).latest("created_at")
-        except StatusUpdate.DoesNotExist:
-            return None
+        return zlib.decompress(bytes(self.compressed_body)).decode()
 
-    def save(self, *args, **kwargs):
-        self.full_code = f"{self.course.full_code}-{self.code}"
-        super().save(*args, **kwargs)
+    @staticmethod
+    def get_digest(body):
+        return hashlib.sha256(body.encode()).hexdigest()
+
+    @staticmethod
+    def store(bodies):
+        """
+        Stores the given request bodies (strings), skipping any that are already stored,
+        and returns a dict mapping each given body to the id of its StatusUpdateRequestBody
+        object. Uses 3 queries, regardless of the number of bodies. This should be called in
+        the same transaction as the one that saves the status updates referencing the returned
+        ids, since these objects are only protected from delete_unreferenced until it commits.
+        """
+        digests = {body: StatusUpdateRequestBody.get_digest(body) for body in set(bodies)}
+        if not digests:
+            return dict()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT pg_advisory_xact_lock_shared(%s)", [StatusUpdateRequestBody.STORE_LOCK_KEY]
+            )
+        StatusUpdateRequestBody.objects.bulk_create(
+            [
+                StatusUpdateRequestBody(digest=digest, compressed_body=zlib.compress(body.encode()))
+                for body, digest in digests.items()
+            ],
+            ignore_conflicts=True,
+        )
+        ids = dict(
+            StatusUpdateRequestBody.objects.filter(digest__in=digests.values()).values_list(
+                "digest", "id"
+            )
+        )
+        return {body: ids[digest] for body, digest in digests.items()}
+
+    @staticmethod
+    def delete_unreferenced():
+        """
+        Deletes all StatusUpdateRequestBody objects not referenced by any status update,
+        waiting for any concurrent calls to store() to commit (see STORE_LOCK_KEY).
+        Returns the number of objects deleted.
+        """
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT pg_advisory_xact_lock(%s)", [StatusUpdateRequestBody.STORE_LOCK_KEY]
+                )
+            num_deleted, _ = StatusUpdateRequestBody.objects.filter(
+                status_updates__isnull=True
+            ).delete()
+        return num_deleted
 
 
 class StatusUpdate(models.Model):
@@ -888,6 +999,17 @@ class StatusUpdate(models.Model):
         on_delete=models.CASCADE,
         help_text="The section which this status update applies to.",
     )
+    semester = models.CharField(
+        max_length=5,
+        db_index=True,
+        help_text=dedent(
+            """
+        The semester of this status update's section (denormalized from `section.course.semester`
+        so that queries for a semester's status updates don't need to join through the section
+        and course tables). This field is set automatically when the status update is saved.
+        """
+        ),
+    )
     old_status = models.CharField(
         max_length=16,
         choices=STATUS_CHOICES,
@@ -906,6 +1028,22 @@ class StatusUpdate(models.Model):
     )
     # ^^^ alert_sent is true iff alert_for_course was called in accept_webhook in alert/views.py
     request_body = models.TextField()
+    request_body_ref = models.ForeignKey(
+        StatusUpdateRequestBody,
+        null=True,
+        blank=True,
+        on_delete=models.PROTECT,
+        related_name="status_updates",
+        help_text=dedent(
+            """
+        The compressed request body of this status update, if it has been compacted
+        (in which case the `request_body` field is empty). Request bodies are compacted when they
+        are saved if settings.STATUS_UPDATE_COMPACT_REQUEST_BODIES is enabled, and existing
+        status updates can be compacted with the `compact_status_updates` management command.
+        Use the `raw_request_body` property to read a status update's request body either way.
+        """
+        ),
+    )
 
     percent_through_add_drop_period = models.FloatField(
         null=True,
@@ -927,54 +1065,199 @@ class StatusUpdate(models.Model):
             f"@ {str(self.created_at)}"
         )
 
+    @property
+    def raw_request_body(self):
+        """
+        The raw request body of this status update, whether it is stored inline (in the
+        `request_body` field) or has been compacted (see `request_body_ref`).
+        """
+        if self.request_body_ref_id is not None:
+            return self.request_body_ref.body
+        return self.request_body
+
+    @staticmethod
+    def compact_request_bodies(status_updates):
+        """
+        Moves the request bodies of the given StatusUpdate objects into the
+        StatusUpdateRequestBody table, setting their `request_body_ref` fields (and clearing
+        their `request_body` fields) without saving them. Status updates with empty
+        request bodies are left as they are. Uses 3 queries (see StatusUpdateRequestBody.store),
+        which should be in the same transaction as the one saving the status updates.
+        """
+        status_updates = [u for u in status_updates if u.request_body]
+        for u in status_updates:
+            if not isinstance(u.request_body, str):
+                u.request_body = str(u.request_body)  # as it would be saved to a TextField
+        ids = StatusUpdateRequestBody.store(u.request_body for u in status_updates)
+        for u in status_updates:
+            u.request_body_ref_id = ids[u.request_body]
+            u.request_body = ""
+
+    def set_add_drop_fields(self, add_drop_period):
+        """
+        Sets the in_add_drop_period and percent_through_add_drop_period fields of this
+        StatusUpdate object, given the AddDropPeriod object for its semester (without saving).
+        """
+        start = add_drop_period.estimated_start
+        end = add_drop_period.estimated_end
+        self.in_add_drop_period = start <= self.created_at <= end
+        self.percent_through_add_drop_period = add_drop_period.get_percent_through_add_drop(
+            self.created_at
+        )
+
+    def update_section_last_status_update(self, added):
+        """
+        Updates the denormalized last_status_update, last_status_update_at and
+        last_status_update_new_status fields of this (saved) StatusUpdate's section. A newly added
+        status update replaces the section's last status update unless the section already has
+        a later one (with a single conditional UPDATE query); if an existing status update was
+        modified, the section's last status update is recomputed from the StatusUpdate table.
+        """
+        from courses.util import recompute_last_status_updates, set_last_status_update
+
+        # ^ imported here to avoid circular imports
+
+        if added:
+            set_last_status_update(self.section, self)
+        else:
+            recompute_last_status_updates(section_ids=[self.section_id])
+            self.section.refresh_from_db(
+                fields=[
+                    "last_status_update",
+                    "last_status_update_at",
+                    "last_status_update_new_status",
+                ]
+            )
+
     def save(self, *args, **kwargs):
         """
         This overridden save method first gets the add/drop period object for the semester of this
         StatusUpdate object (either by using the get_or_create_add_drop_period method or by using
         a passed-in add_drop_period kwarg, which can be used for efficiency in bulk operations
-        over many StatusUpdate objects). Then it calls the overridden save method, and after that
-        it sets the percent_through_add_drop_period field.
+        over many StatusUpdate objects). Then it sets the percent_through_add_drop_period field
+        and calls the overridden save method (so the StatusUpdate is written with a single
+        query). Finally, it updates the denormalized last_status_update fields of its section
+        (see update_section_last_status_update), sets the has_status_updates field of its section
+        (with an UPDATE query, only if necessary) and schedules a section_demand_change task.
+        If settings.STATUS_UPDATE_COMPACT_REQUEST_BODIES is enabled, the request body is
+        compacted first (see compact_request_bodies).
         """
         from alert.models import validate_add_drop_semester
-        from alert.tasks import section_demand_change
+        from alert.tasks import schedule_section_demand_change
         from courses.util import get_or_create_add_drop_period
 
         # ^ imported here to avoid circular imports
 
-        add_drop_period = None
-        if "add_drop_period" in kwargs:
-            add_drop_period = kwargs["add_drop_period"]
-            del kwargs["add_drop_period"]
-
-        super().save(*args, **kwargs)
+        add_drop_period = kwargs.pop("add_drop_period", None)
+        self.semester = self.section.semester
+        adding = self._state.adding
 
         # If this is a valid add/drop semester, set the percent_through_add_drop_period field
         try:
             validate_add_drop_semester(self.section.semester)
+            valid_add_drop_semester = True
         except ValidationError:
+            valid_add_drop_semester = False
+        if valid_add_drop_semester:
+            if add_drop_period is None:
+                add_drop_period = get_or_create_add_drop_period(self.section.semester)
+            self.set_add_drop_fields(add_drop_period)
+
+        compact = settings.STATUS_UPDATE_COMPACT_REQUEST_BODIES and self.request_body
+        # A compacted request body must be stored in the same transaction as this status update
+        with transaction.atomic(savepoint=False) if compact else nullcontext():
+            if compact:
+                StatusUpdate.compact_request_bodies([self])
+            super().save(*args, **kwargs)
+        self.update_section_last_status_update(adding)
+        if not valid_add_drop_semester:
             return
 
-        if add_drop_period is None:
-            add_drop_period = get_or_create_add_drop_period(self.section.semester)
+        if not self.section.has_status_updates:
+            Section.objects.filter(id=self.section_id).update(has_status_updates=True)
+            self.section.has_status_updates = True
 
-        created_at = self.created_at
-        start = add_drop_period.estimated_start
-        end = add_drop_period.estimated_end
-        if created_at < start:
-            self.in_add_drop_period = False
-            self.percent_through_add_drop_period = 0
-        elif created_at > end:
-            self.in_add_drop_period = False
-            self.percent_through_add_drop_period = 1
-        else:
-            self.in_add_drop_period = True
-            self.percent_through_add_drop_period = (created_at - start) / (end - start)
-        super().save()
+        schedule_section_demand_change(self.section_id, self.created_at, self.section.semester)
 
-        self.section.has_status_updates = True
-        self.section.save()
+    @staticmethod
+    def bulk_record(status_updates, add_drop_periods=None):
+        """
+        A bulk version of save for many new StatusUpdate objects (e.g. when loading status history,
+        or recording a batch of webhook updates). Sets the derived add/drop fields of each
+        StatusUpdate, inserts them all with a single bulk_create, sets the has_status_updates
+        field of their sections with a single UPDATE query (and updates the sections'
+        denormalized last_status_update fields), and schedules one section_demand_change task per
+        semester (rather than one per StatusUpdate). The demand change tasks are scheduled once
+        the current transaction (if any) commits. If settings.STATUS_UPDATE_COMPACT_REQUEST_BODIES
+        is enabled, all request bodies are compacted first (see compact_request_bodies).
+
+        :param status_updates: A list of unsaved StatusUpdate objects.
+        :param add_drop_periods: An optional dict mapping semester to AddDropPeriod object,
+            which can be used for efficiency. AddDropPeriods for missing semesters are
+            fetched using get_or_create_add_drop_period.
+        :return: The list of created StatusUpdate objects.
+        """
+        from alert.models import validate_add_drop_semester
+        from alert.tasks import schedule_section_demand_change
+        from courses.util import get_or_create_add_drop_period, recompute_last_status_updates
+
+        # ^ imported here to avoid circular imports
+
+        if not status_updates:
+            return []
+        add_drop_periods = dict(add_drop_periods or dict())
+        section_semesters = {  # maps section id to semester
+            u.section_id: u.section.semester
+            for u in status_updates
+            if StatusUpdate.section.is_cached(u) and Section.course.is_cached(u.section)
+        }
+        section_semesters.update(
+            Section.objects.filter(
+                id__in={u.section_id for u in status_updates} - section_semesters.keys()
+            ).values_list("id", "course__semester")
+        )
+
+        valid_semesters = dict()  # maps semester to whether it is a valid add/drop semester
+        last_updated_at = dict()  # maps semester to (section id, latest created_at)
+        for u in status_updates:
+            semester = section_semesters[u.section_id]
+            u.semester = semester
+            if semester not in valid_semesters:
+                try:
+                    validate_add_drop_semester(semester)
+                    valid_semesters[semester] = True
+                except ValidationError:
+                    valid_semesters[semester] = False
+            if not valid_semesters[semester]:
+                continue
+            if semester not in add_drop_periods:
+                add_drop_periods[semester] = get_or_create_add_drop_period(semester)
+            u.set_add_drop_fields(add_drop_periods[semester])
+            if semester not in last_updated_at or u.created_at > last_updated_at[semester][1]:
+                last_updated_at[semester] = (u.section_id, u.created_at)
+
+        with transaction.atomic():
+            if settings.STATUS_UPDATE_COMPACT_REQUEST_BODIES:
+                StatusUpdate.compact_request_bodies(status_updates)
+            created = StatusUpdate.objects.bulk_create(status_updates)
+            section_ids = {
+                u.section_id
+                for u in status_updates
+                if valid_semesters[section_semesters[u.section_id]]
+            }
+            Section.objects.filter(id__in=section_ids, has_status_updates=False).update(
+                has_status_updates=True
+            )
+            recompute_last_status_updates(section_ids=section_semesters.keys())
+
+            for semester, (section_id, created_at) in last_updated_at.items():
+                transaction.on_commit(
+                    lambda args=(section_id, created_at, semester): (
+                        schedule_section_demand_change(*args)
+                    )
+                )
 
-        section_demand_change.delay(self.section.id, self.created_at)
+        return created
 
 
 """
@@ -2,17 +2,22 @@ import json
 import logging
 import os
 import re
+import threading
 import uuid
+from collections import OrderedDict
 from decimal import Decimal
 
+from django.conf import settings
 from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist, ValidationError
-from django.db import connection
+from django.db import connection, transaction
+from django.db.models import Q
 from django.db.models.aggregates import Count
 from django.db.models.expressions import Subquery, Value
 from django.db.models.functions.comparison import Coalesce
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
+from django.utils import timezone
 from options.models import Option, get_value
 from rest_framework.exceptions import APIException
 
@@ -188,6 +193,28 @@ def get_set_id(obj):
         return obj.pk
 
 
+def get_set_ids(objs):
+    """
+    Sets the IDs of the given objects of the same model (those which haven't yet been created)
+    to the next IDs of their model, with a single query. Returns the list of the objects' IDs.
+    """
+    objs = list(objs)
+    to_set = [obj for obj in objs if not obj.id]
+    if to_set:
+        meta = to_set[0]._meta
+        with connection.cursor() as cursor:
+            # NOTE: this relies on PostgreSQL-specific details for autoincrement (see get_set_id)
+            cursor.execute(
+                "SELECT nextval('{0}_{1}_{2}_seq'::regclass) FROM generate_series(1, %s)".format(
+                    meta.app_label.lower(), meta.object_name.lower(), meta.pk.name
+                ),
+                [len(to_set)],
+            )
+            for obj, (id_,) in zip(to_set, cursor.fetchall()):
+                obj.id = obj.pk = id_
+    return [obj.id for obj in objs]
+
+
 def is_fk_set(obj, fk_field):
     """
     Returns true if the specified foreign key field has been
@@ -230,6 +257,121 @@ def get_or_create_course(dept_code, course_id, semester, defaults=None):
     )
 
 
+"""
+Section ID Resolver
+===================
+
+Mapping a section code and semester to a Section normally takes a Department, Course and
+Section lookup. Since this happens on hot paths (e.g. every webhook request), we resolve
+(normalized full_code, semester) keys to section ids using a bounded in-process LRU cache,
+backed by the shared Django cache (Redis in production). The shared cache is warmed by the
+registrarimport script (see warm_section_id_cache), and entries are invalidated when
+sections are created or deleted. Resolving a cached key to a section id costs no SQL
+queries, so a cache hit loads the Section (with its course) in a single primary key lookup,
+rather than with the department/course/section joins. The Section row itself is not cached,
+since callers (e.g. the webhook) read and update its status. Stale in-process entries (e.g. for
+a section deleted by another process) are evicted as soon as the Section they point to is found
+not to exist.
+"""
+
+section_id_lru = OrderedDict()  # maps (full_code, semester) to section id
+section_id_lru_lock = threading.Lock()
+
+
+def section_id_cache_key(full_code, semester):
+    return f"section_id:{semester}:{full_code}"
+
+
+def remember_section_id(full_code, semester, section_id, shared=True):
+    """
+    Saves the given section id under the given (normalized full_code, semester) key in the
+    in-process LRU cache (and in the shared cache, if shared=True).
+    """
+    with section_id_lru_lock:
+        section_id_lru[full_code, semester] = section_id
+        section_id_lru.move_to_end((full_code, semester))
+        while len(section_id_lru) > settings.SECTION_ID_CACHE_SIZE:
+            section_id_lru.popitem(last=False)
+    if shared:
+        cache.set(section_id_cache_key(full_code, semester), section_id, timeout=90000)
+
+
+def forget_section_id(full_code, semester):
+    """
+    Removes the given (normalized full_code, semester) key from the section id caches.
+    """
+    with section_id_lru_lock:
+        section_id_lru.pop((full_code, semester), None)
+    cache.delete(section_id_cache_key(full_code, semester))
+
+
+def get_cached_section_id(full_code, semester):
+    """
+    Returns the cached id of the section with the given normalized full_code and semester,
+    or None if it is not cached.
+    """
+    with section_id_lru_lock:
+        section_id = section_id_lru.get((full_code, semester))
+        if section_id is not None:
+            section_id_lru.move_to_end((full_code, semester))
+            return section_id
+    section_id = cache.get(section_id_cache_key(full_code, semester))
+    if section_id is not None:
+        remember_section_id(full_code, semester, section_id, shared=False)
+    return section_id
+
+
+def warm_section_id_cache(semester):
+    """
+    Saves the ids of all sections in the given semester to the shared section id cache.
+    """
+    cache.set_many(
+        {
+            section_id_cache_key(full_code, semester): section_id
+            for section_id, full_code in Section.objects.filter(
+                course__semester=semester
+            ).values_list("id", "full_code")
+        },
+        timeout=90000,
+    )
+
+
+def get_cached_section(full_code, semester, section_manager):
+    """
+    Returns the Section object (with its course selected) with the given normalized full_code
+    and semester if its id is cached (loading it with one primary key lookup), otherwise None.
+    """
+    section_id = get_cached_section_id(full_code, semester)
+    if section_id is None:
+        return None
+    try:
+        return section_manager.select_related("course").get(id=section_id)
+    except Section.DoesNotExist:
+        forget_section_id(full_code, semester)
+        return None
+
+
+@receiver(post_save, sender=Section, dispatch_uid="cache_created_section_id")
+def cache_created_section_id(sender, instance, created, **kwargs):
+    """
+    This function caches the id of a newly created section (replacing any stale entry).
+    """
+    if created:
+        remember_section_id(instance.full_code, instance.course.semester, instance.id)
+
+
+@receiver(post_delete, sender=Section, dispatch_uid="invalidate_deleted_section_id")
+def invalidate_deleted_section_id(sender, instance, **kwargs):
+    """
+    This function removes the id of a deleted section from the section id caches.
+    """
+    try:
+        forget_section_id(instance.full_code, instance.course.semester)
+    except Course.DoesNotExist:
+        with section_id_lru_lock:
+            section_id_lru.clear()
+
+
 def get_or_create_course_and_section(
     course_code, semester, section_manager=None, course_defaults=None, section_defaults=None
 ):
@@ -237,12 +379,19 @@ def get_or_create_course_and_section(
         section_manager = Section.objects
     dept_code, course_id, section_id = separate_course_code(course_code)
 
+    full_code = f"{dept_code}-{course_id}-{section_id}"
+    section = get_cached_section(full_code, semester, section_manager)
+    if section is not None:
+        return section.course, section, False, False
+
     course, course_c = get_or_create_course(
         dept_code, course_id, semester, defaults=course_defaults
     )
     section, section_c = section_manager.get_or_create(
         course=course, code=section_id, defaults=section_defaults
     )
+    if not section_c:
+        remember_section_id(full_code, semester, section.id)
 
     return course, section, course_c, section_c
 
@@ -252,57 +401,189 @@ def get_course_and_section(course_code, semester, section_manager=None):
         section_manager = Section.objects
 
     dept_code, course_id, section_id = separate_course_code(course_code)
+
+    full_code = f"{dept_code}-{course_id}-{section_id}"
+    section = get_cached_section(full_code, semester, section_manager)
+    if section is not None:
+        return section.course, section
+
     course = Course.objects.get(department__code=dept_code, code=course_id, semester=semester)
     section = section_manager.get(course=course, code=section_id)
+    remember_section_id(full_code, semester, section.id)
     return course, section
 
 
-def update_percent_open(section, new_status_update):
+def compute_percent_open(section, last_update_at, new_status_update, add_drop):
     """
-    This function updates a section's percent_open field when a new status update is processed.
+    Returns the value that the given section's percent_open field should take once
+    new_status_update is processed, given the created_at time of the section's previous last
+    status update (or None if it has none) and its AddDropPeriod object.
+    Returns None if percent_open should not change.
     """
-    add_drop = get_or_create_add_drop_period(section.semester)
-    last_status_update = section.last_status_update
     if new_status_update.created_at < add_drop.estimated_start:
-        return
-    if last_status_update is None:
-        section.percent_open = Decimal(int(new_status_update.old_status == "O"))
+        return None
+    if last_update_at is None:
+        return Decimal(int(new_status_update.old_status == "O"))
+    if last_update_at >= add_drop.estimated_end:
+        return None
+    seconds_before_last = Decimal(
+        max((last_update_at - add_drop.estimated_start).total_seconds(), 0)
+    )
+    seconds_since_last = Decimal(
+        max(
+            (
+                min(new_status_update.created_at, add_drop.estimated_end)
+                - max(last_update_at, add_drop.estimated_start)
+            ).total_seconds(),
+            0,
+        )
+    )
+    if seconds_before_last + seconds_since_last == 0:
+        return None
+    return (
+        Decimal(section.percent_open) * seconds_before_last
+        + int(new_status_update.old_status == "O") * seconds_since_last
+    ) / (seconds_before_last + seconds_since_last)
+
+
+def update_percent_open(section, new_status_update, last_update_at):
+    """
+    This function updates a section's percent_open field when a new status update is processed,
+    given the created_at time of the section's previous last status update (or None if it
+    has none).
+    """
+    add_drop = get_or_create_add_drop_period(section.semester)
+    percent_open = compute_percent_open(section, last_update_at, new_status_update, add_drop)
+    if percent_open is not None:
+        section.percent_open = percent_open
         section.save()
-    else:
-        if last_status_update.created_at >= add_drop.estimated_end:
-            return
-        seconds_before_last = Decimal(
-            max((last_status_update.created_at - add_drop.estimated_start).total_seconds(), 0)
+
+
+def set_last_status_update(section, status_update):
+    """
+    Sets the denormalized last_status_update, last_status_update_at and
+    last_status_update_new_status fields of the given section to reflect the given
+    (saved) StatusUpdate object, unless the section already has a later status update.
+    This is done with a single conditional UPDATE query, so that a status update recorded
+    out of order (with an earlier created_at) never replaces a later one.
+    Returns True if the fields were updated, False otherwise.
+    """
+    updated = (
+        Section.objects.filter(id=section.id)
+        .filter(
+            Q(last_status_update_at__isnull=True)
+            | Q(last_status_update_at__lte=status_update.created_at)
         )
-        seconds_since_last = Decimal(
-            max(
-                (
-                    min(new_status_update.created_at, add_drop.estimated_end)
-                    - max(last_status_update.created_at, add_drop.estimated_start)
-                ).total_seconds(),
-                0,
-            )
+        .update(
+            last_status_update=status_update,
+            last_status_update_at=status_update.created_at,
+            last_status_update_new_status=status_update.new_status,
         )
-        section.percent_open = (
-            Decimal(section.percent_open) * seconds_before_last
-            + int(new_status_update.old_status == "O") * seconds_since_last
-        ) / (seconds_before_last + seconds_since_last)
-        section.save()
+    )
+    if updated:
+        section.last_status_update = status_update
+        section.last_status_update_at = status_update.created_at
+        section.last_status_update_new_status = status_update.new_status
+    return bool(updated)
+
+
+# Selects the id, created_at and new_status of the last status update for section U1
+# (breaking created_at ties by id, as in record_update)
+LAST_STATUS_UPDATE_SQL = """
+    LEFT JOIN LATERAL (
+        SELECT U3."id", U3."created_at", U3."new_status" FROM "courses_statusupdate" U3
+        WHERE U3."section_id" = U1."id"
+        ORDER BY U3."created_at" DESC, U3."id" DESC
+        LIMIT 1
+    ) U2 ON true
+"""
 
 
-def record_update(section, semester, old_status, new_status, alerted, req, created_at=None):
-    from alert.models import validate_add_drop_semester  # avoid circular imports
+def sections_filter_sql(semesters=None, section_ids=None):
+    """
+    Returns a (sql, params) tuple for a WHERE condition restricting section U1 to the
+    given list of semesters and/or section ids (each filter is skipped if it is None).
+    """
+    conditions, params = ["true"], []
+    if semesters is not None:
+        conditions.append(
+            """U1."course_id" IN (SELECT "id" FROM "courses_course" WHERE "semester" IN %s)"""
+        )
+        params.append(tuple(semesters))
+    if section_ids is not None:
+        conditions.append("""U1."id" IN %s""")
+        params.append(tuple(section_ids) or (None,))
+    return " AND ".join(conditions), params
 
-    u = StatusUpdate(
-        section=section,
-        old_status=old_status,
-        new_status=new_status,
-        alert_sent=alerted,
-        request_body=req,
-    )
-    if created_at is not None:
-        u.created_at = created_at
-    u.save()
+
+def recompute_last_status_updates(semesters=None, section_ids=None):
+    """
+    Recomputes the denormalized Section.last_status_update, Section.last_status_update_at and
+    Section.last_status_update_new_status fields for all sections in the given list of
+    semesters and/or iterable of section ids (or for all sections, if both are None).
+    Returns the number of sections updated.
+    """
+    condition, params = sections_filter_sql(semesters=semesters, section_ids=section_ids)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+        UPDATE "courses_section" U0
+        SET "last_status_update_id" = U2."id",
+            "last_status_update_at" = U2."created_at",
+            "last_status_update_new_status" = U2."new_status"
+        FROM "courses_section" U1
+        {LAST_STATUS_UPDATE_SQL}
+        WHERE U0."id" = U1."id" AND {condition} AND (
+            U0."last_status_update_id" IS DISTINCT FROM U2."id"
+            OR U0."last_status_update_at" IS DISTINCT FROM U2."created_at"
+            OR U0."last_status_update_new_status" IS DISTINCT FROM U2."new_status"
+        )
+        """,
+            params,
+        )
+        return cursor.rowcount
+
+
+@receiver(post_delete, sender=StatusUpdate, dispatch_uid="recompute_deleted_last_status_update")
+def recompute_deleted_last_status_update(sender, instance, **kwargs):
+    """
+    This function recomputes the denormalized last status update fields of the section of
+    a deleted status update (deleting a section's last status update only nulls its
+    `last_status_update` foreign key).
+    """
+    recompute_last_status_updates(section_ids=[instance.section_id])
+
+
+def find_inconsistent_last_status_updates(semesters=None):
+    """
+    Returns a list of the ids of all sections in the given list of semesters (or of all sections,
+    if semesters is None) whose denormalized last_status_update fields do not match their
+    actual last status update.
+    """
+    condition, params = sections_filter_sql(semesters=semesters)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+        SELECT U1."id" FROM "courses_section" U1
+        {LAST_STATUS_UPDATE_SQL}
+        WHERE {condition} AND (
+            U1."last_status_update_id" IS DISTINCT FROM U2."id"
+            OR U1."last_status_update_at" IS DISTINCT FROM U2."created_at"
+            OR U1."last_status_update_new_status" IS DISTINCT FROM U2."new_status"
+        )
+        ORDER BY U1."id"
+        """,
+            params,
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def validate_status_update(semester, old_status, new_status):
+    """
+    Raises a ValidationError if either of the given statuses is not a valid section status,
+    or if the given semester is not a fall or spring semester (or is incorrectly formatted).
+    """
+    from alert.models import validate_add_drop_semester  # avoid circular imports
 
     valid_status_choices = dict(Section.STATUS_CHOICES).keys()
 
@@ -315,13 +596,93 @@ def record_update(section, semester, old_status, new_status, alerted, req, creat
     validate_status("Old status", old_status)
     validate_status("New status", new_status)
 
-    # Raises ValidationError if semester is not fall or spring (and correctly formatted)
     validate_add_drop_semester(semester)
-    update_percent_open(section, u)
+
+
+def record_update(section, semester, old_status, new_status, alerted, req, created_at=None):
+    u = StatusUpdate(
+        section=section,
+        old_status=old_status,
+        new_status=new_status,
+        alert_sent=alerted,
+        request_body=req,
+    )
+    if created_at is not None:
+        u.created_at = created_at
+    last_update_at = section.last_status_update_at
+    u.save()  # also updates the section's last_status_update fields
+
+    validate_status_update(semester, old_status, new_status)
+    update_percent_open(section, u, last_update_at)
 
     return u
 
 
+def record_updates(status_updates):
+    """
+    A bulk version of record_update followed by update_course_from_record, for recording
+    many (already validated) status updates at once, e.g. from a batch of webhook requests.
+    Inserts the given unsaved StatusUpdate objects using StatusUpdate.bulk_record, and updates
+    the status and percent_open fields of every affected section with a single bulk_update.
+    Status updates for the same section are applied in the order given.
+    The section attribute of each StatusUpdate should be set to a Section object, and
+    updates for the same section should share the same Section object.
+
+    :param status_updates: A list of unsaved StatusUpdate objects.
+    :return: The list of created StatusUpdate objects.
+    """
+    from alert.demand_index import update_demand_index
+    from alert.models import validate_add_drop_semester
+
+    # ^ imported here to avoid circular imports
+
+    if not status_updates:
+        return []
+    sections = {u.section.id: u.section for u in status_updates}
+    last_updates = dict()  # maps section id to the last StatusUpdate in this batch
+
+    add_drop_periods = dict()  # maps semester to AddDropPeriod object (or None if unsupported)
+    for u in status_updates:
+        section = u.section
+        semester = section.semester
+        if semester not in add_drop_periods:
+            try:
+                validate_add_drop_semester(semester)
+                add_drop_periods[semester] = get_or_create_add_drop_period(semester)
+            except ValidationError:
+                add_drop_periods[semester] = None
+        add_drop = add_drop_periods[semester]
+        if add_drop is not None:
+            percent_open = compute_percent_open(section, section.last_status_update_at, u, add_drop)
+            if percent_open is not None:
+                section.percent_open = percent_open
+            section.has_status_updates = True
+        section.status = u.new_status
+        if section.last_status_update_at is None or section.last_status_update_at <= u.created_at:
+            section.last_status_update_at = u.created_at
+            section.last_status_update_new_status = u.new_status
+            last_updates[section.id] = u
+
+    now = timezone.now()
+    with transaction.atomic():
+        created = StatusUpdate.bulk_record(
+            status_updates,
+            add_drop_periods={
+                semester: add_drop
+                for semester, add_drop in add_drop_periods.items()
+                if add_drop is not None
+            },
+        )
+        for section in sections.values():
+            section.updated_at = now
+        for section_id, u in last_updates.items():
+            sections[section_id].last_status_update = u
+        Section.objects.bulk_update(sections.values(), ["status", "percent_open", "updated_at"])
+        transaction.on_commit(lambda: update_demand_index(sections.values()))
+
+    return created
+
+
 def merge_instructors(user, name):
     """
     Merge the instructor corresponding to the given user into the
@@ -568,9 +929,12 @@ def add_restrictions(course, restrictions):
 
 
 def update_course_from_record(update):
+    from alert.demand_index import update_demand_index  # avoid circular imports
+
     section = update.section
     section.status = update.new_status
     section.save()
+    transaction.on_commit(lambda: update_demand_index([section]))
 
 
 # averages review data for a given field, given a list of Review objects
@@ -373,6 +373,6 @@ class StatusUpdateView(generics.ListAPIView):
     def get_queryset(self):
         return StatusUpdate.objects.filter(
             section__full_code=self.kwargs["full_code"],
-            section__course__semester=get_current_semester(),
+            semester=get_current_semester(),
             in_add_drop_period=True,
         ).order_by("created_at")
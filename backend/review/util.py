@@ -4,7 +4,7 @@ from math import isclose
 from typing import Dict, List
 
 import scipy.stats as stats
-from django.db.models import Count, F
+from django.db.models import Count
 from django.http import Http404
 
 from courses.models import Section
@@ -291,8 +291,9 @@ def get_status_updates_map(section_map):
         section_id__in=[
             section_id for semester in section_map.keys() for section_id in section_map[semester]
         ],
+        semester__in=section_map.keys(),
         in_add_drop_period=True,
-    ).annotate(semester=F("section__course__semester"))
+    ).defer("request_body")
     status_updates_map = dict()
     # status_updates_map: maps semester to section id to the status updates for that section
     for semester in section_map.keys():
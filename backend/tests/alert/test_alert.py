@@ -1,27 +1,56 @@
 import base64
 import importlib
 import json
+import math
 import os
+import socketserver
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
 from datetime import datetime, timedelta
-from unittest.mock import patch
+from io import StringIO
+from smtplib import SMTPDataError, SMTPRecipientsRefused, SMTPServerDisconnected
+from unittest.mock import ANY, patch
 
+import numpy as np
+import redis
+import scipy.stats as stats
 from dateutil.tz.tz import gettz
 from ddt import data, ddt, unpack
 from django.contrib.auth.models import User
 from django.core.cache import cache
-from django.core.management import call_command
+from django.core.management import CommandError, call_command
+from django.db import connection
 from django.db.models.signals import post_save
-from django.test import Client, TestCase
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
 from django.utils.dateparse import parse_datetime
 from options.models import Option
 from rest_framework.test import APIClient
-
-from alert import tasks
-from alert.models import SOURCE_PCA, AddDropPeriod, Registration, RegStatus, register_for_course
+from twilio.base.exceptions import TwilioRestException
+
+from alert import alerts, demand_index, fanout_dedup, latency, rate_limit, tasks
+from alert.demand_fit import ClosedDemandMoments, fit_closed_demand_distribution
+from alert.models import (
+    SOURCE_PCA,
+    AddDropPeriod,
+    AlertLatencyTrace,
+    Registration,
+    RegStatus,
+    register_for_course,
+)
 from alert.tasks import get_registrations_for_alerts
-from courses.models import StatusUpdate
+from alert.views import alert_for_course
+from alert.webhook_queue import (
+    apply_webhook_queue_entry,
+    drain_webhook_queue,
+    get_webhook_queue_partition,
+    webhook_queue_key,
+)
+from courses.models import Section, StatusUpdate
 from courses.util import (
     get_add_drop_period,
     get_or_create_course_and_section,
@@ -108,6 +137,10 @@ class RegistrationSaveAutoHeadRegistrationTest(TestCase):
         a = self.create_reg("CIS-120-001")
         self.assertEqual(a.head_registration, a)
 
+    def test_semester_set(self):
+        a = self.create_reg("CIS-120-001")
+        self.assertEqual(TEST_SEMESTER, Registration.objects.get(id=a.id).semester)
+
     def test_delete_max_id(self):
         self.create_reg("CIS-120-001")
         self.create_reg("CIS-160-001")
@@ -935,6 +968,302 @@ class WebhookViewTestCase(TestCase):
         self.assertEqual(0, StatusUpdate.objects.count())
 
 
+@patch("alert.views.alert_for_course")
+class WebhookBatchViewTestCase(TestCase):
+    def setUp(self):
+        set_semester()
+        self.client = Client()
+        auth = base64.standard_b64encode("webhook:password".encode("ascii"))
+        self.headers = {
+            "Authorization": f"Basic {auth.decode()}",
+        }
+        Option.objects.update_or_create(
+            key="SEND_FROM_WEBHOOK", value_type="BOOL", defaults={"value": "TRUE"}
+        )
+
+    def make_body(self, code, prev_status, status, term=TEST_SEMESTER):
+        return {
+            "section_id_normalized": code,
+            "previous_status": prev_status,
+            "status": status,
+            "term": translate_semester(term),
+        }
+
+    def post_batch(self, bodies):
+        return self.client.post(
+            reverse("webhook-batch", urlconf="alert.urls"),
+            data=json.dumps(bodies),
+            content_type="application/json",
+            **self.headers,
+        )
+
+    def test_batch_results(self, mock_alert):
+        res = self.post_batch(
+            [
+                self.make_body("ANTH-3610-401", "X", "O"),
+                self.make_body("CIS-1200-001", "O", "C"),
+                {"previous_status": "X", "status": "O", "term": "201910"},
+                self.make_body("CIS-1200-001", "C", "C"),
+                self.make_body("CIS-1200-001", "C", "O", term="2019B"),
+                self.make_body("CIS-1200-001", "C", "O", term="3021C"),
+            ]
+        )
+        self.assertEqual(200, res.status_code)
+        self.assertEqual(
+            [
+                {"status": 200, "message": "webhook recieved, alerts sent"},
+                {"status": 200, "message": "webhook recieved, alerts sent"},
+                {"status": 400, "message": "Course ID could not be extracted from response"},
+                {"status": 200, "message": "We got an error but webhook should ignore it"},
+                {"status": 200, "message": "webhook ignored (summer class)"},
+                {"status": 200, "message": "webhook recieved"},
+            ],
+            json.loads(res.content)["results"],
+        )
+        self.assertEqual(3, StatusUpdate.objects.count())
+        self.assertEqual(2, mock_alert.call_count)
+        anth = StatusUpdate.objects.get(section__full_code="ANTH-3610-401")
+        self.assertTrue(anth.alert_sent)
+        self.assertEqual("O", anth.section.status)
+        self.assertTrue(anth.section.has_status_updates)
+        self.assertFalse(
+            StatusUpdate.objects.get(section__course__semester="3021C").alert_sent,
+        )
+
+    def test_batch_matches_single_webhook_duplicate(self, mock_alert):
+        self.client.post(
+            reverse("webhook", urlconf="alert.urls"),
+            data=json.dumps(self.make_body("ANTH-3610-401", "X", "O")),
+            content_type="application/json",
+            **self.headers,
+        )
+        res = self.post_batch([self.make_body("ANTH-3610-401", "X", "O")])
+        self.assertEqual(
+            [{"status": 200, "message": "We got an error but webhook should ignore it"}],
+            json.loads(res.content)["results"],
+        )
+        self.assertEqual(1, StatusUpdate.objects.count())
+
+    def test_batch_same_section_in_order(self, mock_alert):
+        res = self.post_batch(
+            [
+                self.make_body("ANTH-3610-401", "C", "O"),
+                self.make_body("ANTH 3610 401", "O", "C"),
+                self.make_body("ANTH-3610-401", "C", "O"),
+            ]
+        )
+        self.assertEqual(
+            ["webhook recieved", "webhook recieved", "webhook recieved, alerts sent"],
+            [r["message"] for r in json.loads(res.content)["results"]],
+        )
+        updates = StatusUpdate.objects.order_by("id")
+        self.assertEqual(["O", "C", "O"], [u.new_status for u in updates])
+        self.assertEqual([False, False, True], [u.alert_sent for u in updates])
+        self.assertEqual(1, len({u.section_id for u in updates}))
+        self.assertEqual("O", updates[0].section.status)
+        mock_alert.assert_called_once_with(
+            "ANTH-3610-401",
+            semester=TEST_SEMESTER,
+            sent_by="WEB",
+            course_status="O",
+            received_at=ANY,
+        )
+
+    def test_batch_alert_superseded(self, mock_alert):
+        res = self.post_batch(
+            [
+                self.make_body("ANTH-3610-401", "C", "O"),
+                self.make_body("ANTH-3610-401", "O", "X"),
+            ]
+        )
+        self.assertEqual(
+            ["webhook recieved", "webhook recieved"],
+            [r["message"] for r in json.loads(res.content)["results"]],
+        )
+        self.assertFalse(mock_alert.called)
+        self.assertFalse(StatusUpdate.objects.filter(alert_sent=True).exists())
+
+    def test_batch_request_body_matches_single_webhook(self, mock_alert):
+        single_body = self.make_body("ANTH-3610-401", "C", "O")
+        self.client.post(
+            reverse("webhook", urlconf="alert.urls"),
+            data=json.dumps(single_body),
+            content_type="application/json",
+            **self.headers,
+        )
+        batch_body = self.make_body("CIS-1200-001", "C", "O")
+        self.post_batch([batch_body])
+        for full_code, body in [("ANTH-3610-401", single_body), ("CIS-1200-001", batch_body)]:
+            self.assertEqual(
+                str(json.dumps(body).encode()),
+                StatusUpdate.objects.get(section__full_code=full_code).raw_request_body,
+            )
+
+    def test_batch_not_list(self, mock_alert):
+        res = self.post_batch(self.make_body("ANTH-3610-401", "X", "O"))
+        self.assertEqual(400, res.status_code)
+        self.assertFalse(mock_alert.called)
+        self.assertEqual(0, StatusUpdate.objects.count())
+
+    def test_batch_bad_json(self, mock_alert):
+        res = self.client.post(
+            reverse("webhook-batch", urlconf="alert.urls"),
+            data="blah",
+            content_type="application/json",
+            **self.headers,
+        )
+        self.assertEqual(400, res.status_code)
+        self.assertEqual(0, StatusUpdate.objects.count())
+
+    def test_batch_wrong_password(self, mock_alert):
+        self.headers["Authorization"] = (
+            "Basic " + base64.standard_b64encode("webhook:abc123".encode("ascii")).decode()
+        )
+        res = self.post_batch([self.make_body("ANTH-3610-401", "X", "O")])
+        self.assertEqual(401, res.status_code)
+        self.assertFalse(mock_alert.called)
+        self.assertEqual(0, StatusUpdate.objects.count())
+
+
+@patch("alert.webhook_queue.r")
+@patch("alert.views.alert_for_course")
+@override_settings(WEBHOOK_QUEUE_ENABLED=True)
+class WebhookQueueTestCase(TestCase):
+    def setUp(self):
+        set_semester()
+        self.client = Client()
+        auth = base64.standard_b64encode("webhook:password".encode("ascii"))
+        self.headers = {
+            "Authorization": f"Basic {auth.decode()}",
+        }
+        self.body = {
+            "section_id_normalized": "ANTH-3610-401",
+            "previous_status": "X",
+            "status": "O",
+            "status_code_normalized": "Open",
+            "term": translate_semester(TEST_SEMESTER),
+        }
+        Option.objects.update_or_create(
+            key="SEND_FROM_WEBHOOK", value_type="BOOL", defaults={"value": "TRUE"}
+        )
+
+    def post_webhook(self, body):
+        return self.client.post(
+            reverse("webhook", urlconf="alert.urls"),
+            data=json.dumps(body),
+            content_type="application/json",
+            **self.headers,
+        )
+
+    def make_entry(self, body, received_at):
+        return {
+            b"body": json.dumps(body).encode(),
+            b"received_at": received_at.isoformat().encode(),
+        }
+
+    @patch("alert.tasks.process_webhook_queue.delay")
+    def test_queued_without_queries(self, mock_process, mock_alert, mock_redis):
+        mock_redis.pipeline.return_value.execute.return_value = ["1-0", True]
+        with self.assertNumQueries(0):
+            res = self.post_webhook(self.body)
+        self.assertEqual(200, res.status_code)
+        self.assertEqual("webhook queued", json.loads(res.content)["message"])
+        pipe = mock_redis.pipeline.return_value
+        key, entry = pipe.xadd.call_args[0]
+        partition = get_webhook_queue_partition("ANTH-3610-401")
+        self.assertEqual(webhook_queue_key(partition), key)
+        self.assertEqual(self.body, json.loads(entry["body"]))
+        mock_process.assert_called_once_with(partition)
+        pipe.set.assert_called_once_with(
+            f"{webhook_queue_key(partition)}:scheduled", 1, nx=True, ex=600
+        )
+        self.assertFalse(mock_alert.called)
+        self.assertEqual(0, StatusUpdate.objects.count())
+
+    @patch("alert.tasks.process_webhook_queue.delay", side_effect=ConnectionRefusedError())
+    def test_schedule_failed(self, mock_process, mock_alert, mock_redis):
+        mock_redis.pipeline.return_value.execute.return_value = ["1-0", True]
+        res = self.post_webhook(self.body)
+        self.assertEqual(200, res.status_code)
+        self.assertEqual("webhook recieved, alerts sent", json.loads(res.content)["message"])
+        partition = get_webhook_queue_partition("ANTH-3610-401")
+        mock_redis.delete.assert_called_once_with(f"{webhook_queue_key(partition)}:scheduled")
+        self.assertEqual("O", StatusUpdate.objects.get().new_status)
+
+    @patch("alert.tasks.process_webhook_queue.delay")
+    def test_already_scheduled(self, mock_process, mock_alert, mock_redis):
+        mock_redis.pipeline.return_value.execute.return_value = ["1-0", None]
+        res = self.post_webhook(self.body)
+        self.assertEqual(200, res.status_code)
+        self.assertFalse(mock_process.called)
+
+    @patch("alert.tasks.process_webhook_queue.delay")
+    def test_redis_unavailable(self, mock_process, mock_alert, mock_redis):
+        mock_redis.pipeline.return_value.execute.side_effect = redis.exceptions.ConnectionError()
+        res = self.post_webhook(self.body)
+        self.assertEqual(200, res.status_code)
+        self.assertEqual("webhook recieved, alerts sent", json.loads(res.content)["message"])
+        self.assertFalse(mock_process.called)
+        self.assertTrue(mock_alert.called)
+        self.assertEqual("O", StatusUpdate.objects.get().new_status)
+
+    def test_invalid_not_queued(self, mock_alert, mock_redis):
+        del self.body["section_id_normalized"]
+        res = self.post_webhook(self.body)
+        self.assertEqual(400, res.status_code)
+        self.assertFalse(mock_redis.pipeline.called)
+
+    def test_apply_entry(self, mock_alert, mock_redis):
+        received_at = timezone.now() - timedelta(seconds=5)
+        message = apply_webhook_queue_entry(self.make_entry(self.body, received_at))
+        self.assertEqual("webhook recieved, alerts sent", message)
+        self.assertTrue(mock_alert.called)
+        u = StatusUpdate.objects.get()
+        self.assertEqual(received_at, u.created_at)
+        self.assertEqual("O", u.section.status)
+
+    @patch("alert.tasks.process_webhook_queue.apply_async")
+    def test_drain_failed_entry_retried(self, mock_retry, mock_alert, mock_redis):
+        bad_entry = {b"body": json.dumps(self.body).encode()}  # no received_at
+        mock_redis.xreadgroup.return_value = [[b"webhook_queue:0", [(b"1-0", bad_entry)]]]
+        mock_redis.xpending_range.return_value = [{"times_delivered": 1}]
+        self.assertEqual(0, drain_webhook_queue(0))
+        self.assertFalse(mock_redis.xack.called)
+        mock_retry.assert_called_once_with((0,), countdown=60)
+
+    @patch("alert.tasks.process_webhook_queue.apply_async")
+    def test_drain_failed_entry_dead_lettered(self, mock_retry, mock_alert, mock_redis):
+        bad_entry = {b"body": json.dumps(self.body).encode()}  # no received_at
+        entry = self.make_entry(self.body, timezone.now() - timedelta(seconds=5))
+        mock_redis.xreadgroup.side_effect = [
+            [[b"webhook_queue:0", [(b"1-0", bad_entry), (b"2-0", entry)]]],
+            [],
+            [],
+        ]
+        mock_redis.xpending_range.return_value = [{"times_delivered": 5}]
+        self.assertEqual(1, drain_webhook_queue(0))
+        key, dead_entry = mock_redis.xadd.call_args[0]
+        self.assertEqual("webhook_queue:0:dead", key)
+        self.assertEqual(b"1-0", dead_entry[b"entry_id"])
+        self.assertIn("KeyError", dead_entry[b"error"])
+        self.assertEqual([b"1-0", b"2-0"], [call[0][2] for call in mock_redis.xack.call_args_list])
+        self.assertFalse(mock_retry.called)
+        self.assertEqual("O", StatusUpdate.objects.get().new_status)
+
+    def test_apply_entry_idempotent(self, mock_alert, mock_redis):
+        received_at = timezone.now() - timedelta(seconds=5)
+        entry = self.make_entry(self.body, received_at)
+        apply_webhook_queue_entry(entry)
+        closed_body = {**self.body, "previous_status": "O", "status": "C"}
+        closed_entry = self.make_entry(closed_body, received_at + timedelta(seconds=1))
+        apply_webhook_queue_entry(closed_entry)
+        self.assertEqual(2, StatusUpdate.objects.count())
+        self.assertEqual("webhook already applied", apply_webhook_queue_entry(entry))
+        self.assertEqual("webhook already applied", apply_webhook_queue_entry(closed_entry))
+        self.assertEqual(2, StatusUpdate.objects.count())
+        self.assertEqual(2, mock_alert.call_count)
+
+
 class CourseStatusUpdateTestCase(TestCase):
     def setUp(self):
         set_semester()
@@ -1109,7 +1438,7 @@ class AlertRegistrationTestCase(TestCase):
         This helper simulates a webhook status update for a class opening (if close_notification is
         false), or for a class closing (if close_notification is True). It simulates the working
         of the entire system by mocking the alerts.send_email, alerts.send_text, and
-        requests.post (the function used for sending push notifications) functions. Note that it
+        requests.Session.post (the method used for sending push notifications). Note that it
         does NOT test the aforementioned functions, but rather ensures that they are called as
         specified.  Specifically, by default it will ensure they are called for the default
         user's contact information. However, you can customize this check by passing in a list
@@ -1162,7 +1491,7 @@ class AlertRegistrationTestCase(TestCase):
         with patch("alert.alerts.send_email", return_value=True) as send_email_mock:
             with patch("alert.alerts.send_text", return_value=True) as send_text_mock:
                 with patch(
-                    "requests.post", return_value=MockResponse(200)
+                    "requests.Session.post", return_value=MockResponse(200)
                 ) as push_notification_mock:
                     override_delay(
                         [
@@ -2911,3 +3240,1518 @@ class AlertRegistrationTestCase(TestCase):
             upload_to_s3=False,
             semesters=TEST_SEMESTER,
         )
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    SECTION_DEMAND_CHANGE_COALESCE_WINDOW=2,
+)
+@patch("alert.tasks.r")
+@patch("alert.tasks.set_latest_demand_change")
+@patch("alert.tasks.section_demand_change")
+@patch("alert.tasks.coalesced_section_demand_change.apply_async")
+class CoalescedDemandChangeTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.now = datetime(2019, 1, 10, 12, 0, 30, 250, tzinfo=gettz("UTC"))
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_triggers_coalesced(self, mock_apply_async, mock_demand_change, mock_set, mock_redis):
+        for i in range(3):
+            tasks.schedule_section_demand_change(i, self.now + timedelta(seconds=i), "2019A")
+        tasks.schedule_section_demand_change(3, self.now, "2019C")
+        self.assertEqual(2, mock_apply_async.call_count)
+        self.assertEqual(("2019A", 0, self.now), mock_apply_async.call_args_list[0][0][0])
+        self.assertEqual(2, mock_apply_async.call_args_list[0][1]["countdown"])
+        self.assertFalse(mock_demand_change.delay.called)
+        self.assertEqual(
+            {
+                "keys": ["section_demand_change:2019A:latest"],
+                "args": [
+                    int(self.now.timestamp()) * 10**6 + 2 * 10**6 + 250,
+                    2,
+                    (self.now + timedelta(seconds=2)).isoformat(),
+                ],
+            },
+            mock_set.call_args_list[2][1],
+        )
+
+        latest_updated_at = self.now + timedelta(seconds=2)
+        mock_redis.hmget.return_value = [b"2", latest_updated_at.isoformat().encode()]
+        tasks.coalesced_section_demand_change("2019A", 0, self.now.isoformat())
+        mock_redis.hmget.assert_called_once_with(
+            "section_demand_change:2019A:latest", ["section_id", "updated_at"]
+        )
+        mock_demand_change.assert_called_once_with(2, latest_updated_at)
+        self.assertEqual(
+            {"triggers": 3, "recomputations": 1, "merged": 2},
+            tasks.get_section_demand_change_stats("2019A"),
+        )
+
+    def test_later_than_latest(self, mock_apply_async, mock_demand_change, mock_set, mock_redis):
+        earlier = self.now - timedelta(seconds=1)
+        mock_redis.hmget.return_value = [b"0", earlier.isoformat().encode()]
+        tasks.coalesced_section_demand_change("2019A", 1, self.now)
+        mock_demand_change.assert_called_once_with(1, self.now)
+
+    def test_redis_unavailable(self, mock_apply_async, mock_demand_change, mock_set, mock_redis):
+        mock_set.side_effect = redis.exceptions.ConnectionError()
+        mock_redis.hmget.side_effect = redis.exceptions.ConnectionError()
+        tasks.schedule_section_demand_change(1, self.now, "2019A")
+        mock_apply_async.assert_called_once()
+        tasks.coalesced_section_demand_change("2019A", 1, self.now)
+        mock_demand_change.assert_called_once_with(1, self.now)
+
+    def test_schedule_after_window(
+        self, mock_apply_async, mock_demand_change, mock_set, mock_redis
+    ):
+        tasks.schedule_section_demand_change(0, self.now, "2019A")
+        cache.delete(tasks.demand_change_cache_key("2019A", "scheduled"))  # window elapsed
+        tasks.schedule_section_demand_change(1, self.now + timedelta(seconds=3), "2019A")
+        self.assertEqual(2, mock_apply_async.call_count)
+
+    @override_settings(SECTION_DEMAND_CHANGE_COALESCE_WINDOW=0)
+    def test_no_window(self, mock_apply_async, mock_demand_change, mock_set, mock_redis):
+        tasks.schedule_section_demand_change(0, self.now, "2019A")
+        tasks.schedule_section_demand_change(1, self.now, "2019A")
+        self.assertFalse(mock_apply_async.called)
+        self.assertEqual(2, mock_demand_change.delay.call_count)
+        self.assertEqual(0, tasks.get_section_demand_change_stats("2019A")["merged"])
+
+
+@patch("alert.demand_index.r")
+@override_settings(DEMAND_INDEX_ENABLED=True)
+class DemandIndexTestCase(TestCase):
+    def setUp(self):
+        set_semester()
+        _, self.low, _, _ = get_or_create_course_and_section("CIS-1200-001", TEST_SEMESTER)
+        _, self.high, _, _ = get_or_create_course_and_section("CIS-1600-001", TEST_SEMESTER)
+        for section, volume, status in [(self.low, 0, "O"), (self.high, 6, "C")]:
+            section.capacity = 3
+            section.registration_volume = volume
+            section.status = status
+            section.has_status_updates = True
+            section.save()
+
+    def test_extreme_sections(self, mock_redis):
+        mock_redis.pipeline.return_value.execute.return_value = [
+            1,
+            [(str(self.high.id).encode(), 2.0)],
+            [(str(self.high.id).encode(), 2.0)],
+            [(str(self.low.id).encode(), 0.0)],
+            [(str(self.low.id).encode(), 0.0)],
+        ]
+        with self.assertNumQueries(1):
+            low, high = demand_index.get_demand_index_extreme_sections(TEST_SEMESTER)
+        self.assertEqual((self.low.id, 0.0), (low.id, low.raw_demand))
+        self.assertEqual((self.high.id, 2.0), (high.id, high.raw_demand))
+
+    def test_empty_index(self, mock_redis):
+        mock_redis.pipeline.return_value.execute.return_value = [1, [], [], [], []]
+        with self.assertRaises(Section.DoesNotExist):
+            demand_index.get_demand_index_extreme_sections(TEST_SEMESTER)
+
+    def test_index_not_built(self, mock_redis):
+        mock_redis.pipeline.return_value.execute.return_value = [0, [], [], [], []]
+        self.assertIsNone(demand_index.get_demand_index_extreme_sections(TEST_SEMESTER))
+        mock_redis.pipeline.return_value.execute.return_value = [0, []]
+        self.assertIsNone(demand_index.get_demand_index_closed_raw_demands(TEST_SEMESTER))
+
+    def test_redis_unavailable(self, mock_redis):
+        mock_redis.pipeline.return_value.execute.side_effect = redis.exceptions.ConnectionError()
+        self.assertIsNone(demand_index.get_demand_index_extreme_sections(TEST_SEMESTER))
+        demand_index.update_demand_index([self.high])  # doesn't raise
+
+    def test_closed_raw_demands(self, mock_redis):
+        mock_redis.pipeline.return_value.execute.return_value = [
+            1,
+            [(str(self.high.id).encode(), 2.0)],
+        ]
+        self.assertEqual([2.0], demand_index.get_demand_index_closed_raw_demands(TEST_SEMESTER))
+
+    def test_closed_moments(self, mock_redis):
+        mock_redis.pipeline.return_value.execute.return_value = [
+            1,
+            [b"3", b"2", b"0.5", b"1.25", b"-0.75"],
+        ]
+        moments = demand_index.get_demand_index_closed_moments(TEST_SEMESTER)
+        self.assertEqual(
+            (3, 2, 0.5, 1.25, -0.75),
+            (moments.num_closed, moments.num_positive, moments.sum_log, moments.sum_log_sq)
+            + (moments.shift,),
+        )
+        # Hashes built before the logs were shifted have no shift
+        mock_redis.pipeline.return_value.execute.return_value = [
+            1,
+            [b"3", b"2", b"0.5", b"1.25", None],
+        ]
+        self.assertEqual(0.0, demand_index.get_demand_index_closed_moments(TEST_SEMESTER).shift)
+        mock_redis.pipeline.return_value.execute.return_value = [1, [None] * 5]
+        self.assertIsNone(demand_index.get_demand_index_closed_moments(TEST_SEMESTER))
+        mock_redis.pipeline.return_value.execute.return_value = [0, [None] * 5]
+        self.assertIsNone(demand_index.get_demand_index_closed_moments(TEST_SEMESTER))
+
+    def assert_section_demand_updated(self, pipe, section, partition, raw_demand):
+        pipe.evalsha.assert_any_call(
+            demand_index.update_section_demand.sha,
+            3,
+            demand_index.demand_index_key(TEST_SEMESTER, "closed"),
+            demand_index.demand_index_key(TEST_SEMESTER, "other"),
+            demand_index.demand_index_key(TEST_SEMESTER, "moments"),
+            section.id,
+            partition,
+            raw_demand,
+        )
+
+    def test_update_moves_partition(self, mock_redis):
+        pipe = mock_redis.pipeline.return_value
+        pipe.execute.return_value = [1, False, None, 0.0]  # indexed as open
+        with self.assertNumQueries(0):
+            demand_index.update_demand_index([self.high])
+        pipe.evalsha.assert_called_once()
+        self.assert_section_demand_updated(pipe, self.high, "closed", 2.0)
+
+    def test_update_adds_new_eligible_section(self, mock_redis):
+        pipe = mock_redis.pipeline.return_value
+        pipe.execute.return_value = [1, False, None, None, 1, False, None, None]
+        self.low.capacity = 0
+        self.low.save()
+        with self.assertNumQueries(1):
+            demand_index.update_demand_index([self.high, self.low])
+        pipe.evalsha.assert_called_once()
+        self.assert_section_demand_updated(pipe, self.high, "closed", 2.0)
+        pipe.sadd.assert_called_once_with(
+            demand_index.demand_index_key(TEST_SEMESTER, "excluded"), self.low.id
+        )
+
+    def test_update_skips_excluded_and_unbuilt(self, mock_redis):
+        pipe = mock_redis.pipeline.return_value
+        pipe.execute.return_value = [1, True, None, None, 0, False, None, None]
+        self.high.capacity = 0
+        self.high.save()
+        with self.assertNumQueries(0):
+            demand_index.update_demand_index([self.high, self.low])
+        self.assertFalse(pipe.evalsha.called)
+        self.assertFalse(pipe.sadd.called)
+
+    def test_update_readds_eligible_excluded_section(self, mock_redis):
+        pipe = mock_redis.pipeline.return_value
+        pipe.execute.return_value = [1, True, None, None, 1, True, None, None]
+        self.low.has_status_updates = False  # no longer eligible, but still excluded
+        self.low.save()
+        with self.assertNumQueries(1):
+            demand_index.update_demand_index([self.high, self.low])
+        pipe.evalsha.assert_called_once()
+        self.assert_section_demand_updated(pipe, self.high, "closed", 2.0)
+        pipe.srem.assert_called_once_with(
+            demand_index.demand_index_key(TEST_SEMESTER, "excluded"), self.high.id
+        )
+        self.assertFalse(pipe.sadd.called)
+
+    def test_rebuild(self, mock_redis):
+        _, excluded, _, _ = get_or_create_course_and_section("CIS-1210-001", TEST_SEMESTER)
+        excluded.capacity = 0
+        excluded.has_status_updates = True
+        excluded.save()
+        demand_index.rebuild_demand_index(TEST_SEMESTER)
+        pipe = mock_redis.pipeline.return_value
+        pipe.zadd.assert_any_call(
+            demand_index.demand_index_key(TEST_SEMESTER, "closed"), {self.high.id: 2.0}
+        )
+        pipe.zadd.assert_any_call(
+            demand_index.demand_index_key(TEST_SEMESTER, "other"), {self.low.id: 0.0}
+        )
+        pipe.sadd.assert_called_once_with(
+            demand_index.demand_index_key(TEST_SEMESTER, "excluded"), excluded.id
+        )
+        pipe.hset.assert_called_once_with(
+            demand_index.demand_index_key(TEST_SEMESTER, "moments"),
+            mapping={
+                "num_closed": 1,
+                "num_positive": 1,
+                "sum_log": 0.0,
+                "sum_log_sq": 0.0,
+                "shift": math.log(2),
+            },
+        )
+        pipe.set.assert_called_once_with(demand_index.demand_index_key(TEST_SEMESTER, "built"), 1)
+
+    @override_settings(DEMAND_INDEX_ENABLED=False)
+    def test_disabled(self, mock_redis):
+        demand_index.rebuild_demand_index(TEST_SEMESTER)
+        demand_index.update_demand_index([self.high])
+        self.assertIsNone(demand_index.get_demand_index_extreme_sections(TEST_SEMESTER))
+        self.assertIsNone(demand_index.get_demand_index_closed_moments(TEST_SEMESTER))
+        self.assertFalse(mock_redis.pipeline.called)
+
+
+class ClosedDemandMomentsTestCase(TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.raw_demands = np.concatenate(
+            [np.zeros(20), rng.integers(1, 60, 300) / rng.choice([10, 20, 40, 100], 300)]
+        )
+
+    def assert_params_close(self, expected, actual):
+        for expected_param, actual_param in zip(expected, actual):
+            self.assertTrue(
+                math.isclose(expected_param, actual_param, rel_tol=1e-9, abs_tol=1e-12),
+                f"{expected} != {actual}",
+            )
+
+    def test_matches_lognorm_fit_with_loc_zero(self):
+        frac_zero, *params = ClosedDemandMoments.from_raw_demands(self.raw_demands).estimate()
+        self.assertAlmostEqual(20 / 320, frac_zero)
+        self.assert_params_close(stats.lognorm.fit(self.raw_demands[20:], floc=0), params)
+
+    def test_running_sums(self):
+        moments = ClosedDemandMoments()
+        for raw_demand in self.raw_demands:
+            moments.add(raw_demand)
+            moments.add(raw_demand * 2)
+        for raw_demand in self.raw_demands[::-1]:
+            moments.remove(raw_demand * 2)
+        batch = ClosedDemandMoments.from_raw_demands(self.raw_demands)
+        self.assertEqual(batch.estimate()[0], moments.estimate()[0])
+        self.assert_params_close(batch.lognorm_params(), moments.lognorm_params())
+
+        for raw_demand in self.raw_demands:
+            moments.remove(raw_demand)
+        self.assertEqual(
+            (0, 0, 0.0, 0.0),
+            (moments.num_closed, moments.num_positive, moments.sum_log, moments.sum_log_sq),
+        )
+        self.assertEqual((None, None, None, None), moments.estimate())
+
+    def test_identical_demands(self):
+        for raw_demand, count in [(0.5, 7), (1 / 3, 10), (0.1, 1000), (57.3, 3)]:
+            batch = ClosedDemandMoments.from_raw_demands([raw_demand] * count)
+            self.assertEqual((0, None, None, None), batch.estimate())
+            moments = ClosedDemandMoments()
+            for other_demand in [0, 2.5, 0.7]:
+                moments.add(other_demand)
+            for _ in range(count):
+                moments.add(raw_demand)
+            for other_demand in [0, 2.5, 0.7]:
+                moments.remove(other_demand)
+            # The logs are shifted by the log of the first positive demand added (2.5)
+            self.assertEqual((0, None, None, None), moments.estimate())
+
+    def test_degenerate(self):
+        self.assertEqual((0.5, None, None, None), fit_closed_demand_distribution([0, 1.5]))
+        self.assertEqual((0, None, None, None), fit_closed_demand_distribution([0.5, 0.5]))
+        self.assertEqual((None, None, None, None), fit_closed_demand_distribution([]))
+
+    @override_settings(DEMAND_DISTRIBUTION_FULL_LOGNORM_FIT=True)
+    def test_full_fit(self):
+        with patch("alert.demand_fit.stats.lognorm.fit", return_value=(1, 2, 3)) as mock_fit:
+            self.assertEqual(
+                (1 - 300 / 320, 1, 2, 3), fit_closed_demand_distribution(self.raw_demands)
+            )
+        np.testing.assert_array_equal(self.raw_demands[20:], mock_fit.call_args[0][0])
+
+
+class WebhookLoadTestTestCase(TestCase):
+    def setUp(self):
+        set_semester()
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.src = os.path.join(tmp_dir.name, "status_history.csv")
+        self.output = os.path.join(tmp_dir.name, "results.json")
+        with open(self.src, "w") as f:
+            f.write(
+                "CIS-1200-001,2019A,2019-01-10 10:00:00.000000 UTC,C,O,False\n"
+                "CIS-1200-001,2019A,2019-01-10 10:00:01.000000 UTC,O,C,False\n"
+                "CIS-1600-001,2019A,2019-01-10 10:00:00.500000 UTC,C,O,False\n"
+            )
+
+    def read_results(self):
+        with open(self.output) as f:
+            return json.load(f)
+
+    def test_replay(self):
+        call_command("webhookloadtest", src=self.src, output=self.output, speedup=0, force=True)
+        results = self.read_results()
+        self.assertEqual(3, results["updates"])
+        self.assertEqual(3, results["requests"])
+        self.assertEqual({"200": 3}, results["status_codes"])
+        self.assertGreater(results["sql_queries_per_request"]["total"], 0)
+        self.assertIsNotNone(results["latency_ms"]["p99"])
+        self.assertEqual(3, results["celery_tasks_enqueued"]["total"])  # demand changes
+        self.assertEqual(3, StatusUpdate.objects.count())
+        self.assertEqual(
+            ["O", "C"],
+            list(
+                StatusUpdate.objects.filter(section__full_code="CIS-1200-001")
+                .order_by("created_at")
+                .values_list("new_status", flat=True)
+            ),
+        )
+
+    def test_replay_batches(self):
+        call_command(
+            "webhookloadtest",
+            src=self.src,
+            output=self.output,
+            speedup=0,
+            batch_size=2,
+            limit=3,
+            force=True,
+        )
+        results = self.read_results()
+        self.assertEqual(3, results["updates"])
+        self.assertEqual(2, results["requests"])
+        self.assertEqual(3, StatusUpdate.objects.count())
+
+    def test_requires_debug(self):
+        with self.assertRaises(CommandError):
+            call_command("webhookloadtest", src=self.src)
+
+
+class SMTPStandInHandler(socketserver.StreamRequestHandler):
+    """
+    Speaks just enough SMTP to stand in for a real SMTP server in tests.
+    """
+
+    def reply(self, line):
+        self.wfile.write(line + b"\r\n")
+
+    def handle(self):
+        server = self.server
+        server.num_connections += 1
+        self.reply(b"220 localhost")
+        in_data = False
+        rejected = False
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            if in_data:
+                if line.startswith(b"Subject: Rejected"):
+                    rejected = True
+                if line == b".\r\n":
+                    in_data = False
+                    if rejected:
+                        rejected = False
+                        self.reply(b"554 Message rejected")
+                        continue
+                    server.num_messages += 1
+                    self.reply(b"250 OK")
+                    if server.drop_after and server.num_messages % server.drop_after == 0:
+                        return  # drop the connection without a QUIT
+                continue
+            command = line[:4].upper()
+            if command == b"EHLO":
+                self.reply(b"250-localhost")
+                self.reply(b"250 8BITMIME")
+            elif command == b"RCPT" and b"refused" in line:
+                self.reply(b"550 No such user")
+            elif command == b"DATA":
+                in_data = True
+                self.reply(b"354 End data with <CR><LF>.<CR><LF>")
+            elif command == b"QUIT":
+                self.reply(b"221 Bye")
+                return
+            else:
+                self.reply(b"250 OK")
+
+
+class SMTPPoolTestCase(TestCase):
+    def setUp(self):
+        self.server = socketserver.ThreadingTCPServer(("localhost", 0), SMTPStandInHandler)
+        self.server.daemon_threads = True
+        self.server.num_connections = 0
+        self.server.num_messages = 0
+        self.server.drop_after = None
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.settings_override = override_settings(
+            SMTP_HOST="localhost",
+            SMTP_PORT=self.server.server_address[1],
+            SMTP_USE_TLS=False,
+            SMTP_USERNAME="",
+        )
+        self.settings_override.enable()
+        alerts.smtp_pool = None
+
+    def tearDown(self):
+        alerts.get_smtp_pool().close()
+        alerts.smtp_pool = None
+        self.settings_override.disable()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def send(self, to="student@example.com"):
+        return alerts.send_email("team@example.com", to, "CIS-120-001 is now open!", "<p>Hi</p>")
+
+    def test_connection_reused(self):
+        for _ in range(5):
+            self.assertTrue(self.send())
+        self.assertEqual(1, self.server.num_connections)
+        self.assertEqual(5, self.server.num_messages)
+
+    def test_batch_with_refused_recipient(self):
+        emails = [
+            ("team@example.com", to, "Subject", "<p>Hi</p>")
+            for to in ["a@example.com", "refused@example.com", "b@example.com"]
+        ]
+        self.assertEqual([True, None, True], alerts.send_emails(emails))
+        self.assertEqual(2, self.server.num_messages)
+        with self.assertRaises(SMTPRecipientsRefused):
+            self.send("refused@example.com")
+        self.assertTrue(self.send())
+        self.assertEqual(1, self.server.num_connections)
+
+    def test_batch_with_rejected_message(self):
+        emails = [
+            ("team@example.com", "student@example.com", subject, "<p>Hi</p>")
+            for subject in ["Subject", "Rejected", "Subject"]
+        ]
+        results = alerts.send_emails(emails)
+        self.assertTrue(results[0])
+        self.assertIsInstance(results[1], SMTPDataError)
+        self.assertEqual(554, results[1].smtp_code)
+        self.assertTrue(results[2])
+        self.assertEqual(2, self.server.num_messages)
+        self.assertEqual(1, self.server.num_connections)
+
+    def test_reconnect_on_dropped_connection(self):
+        self.server.drop_after = 2
+        for _ in range(3):
+            self.assertTrue(self.send())
+        self.assertEqual(2, self.server.num_connections)
+        self.assertEqual(3, self.server.num_messages)
+
+    def test_batch_reconnects_on_dropped_connection(self):
+        self.server.drop_after = 1
+        emails = [("team@example.com", "student@example.com", "Subject", "<p>Hi</p>")] * 3
+        self.assertEqual([True, True, True], alerts.send_emails(emails))
+        self.assertEqual(3, self.server.num_connections)
+        self.assertEqual(3, self.server.num_messages)
+
+    @override_settings(SMTP_POOL_SIZE=1)
+    def test_batch_reconnect_fails(self):
+        alerts.smtp_pool = None
+        pool = alerts.get_smtp_pool()
+        self.server.drop_after = 1
+        emails = [("team@example.com", "student@example.com", "Subject", "<p>Hi</p>")] * 3
+        with patch.object(pool, "connect", side_effect=[pool.connect(), ConnectionRefusedError()]):
+            results = alerts.send_emails(emails)
+        self.assertTrue(results[0])
+        self.assertIsInstance(results[1], ConnectionRefusedError)
+        self.assertIsInstance(results[2], ConnectionRefusedError)
+        self.assertEqual(1, self.server.num_messages)
+        self.assertTrue(pool.slots.acquire(blocking=False))  # the connection slot was released
+        pool.slots.release()
+
+    @override_settings(SMTP_POOL_MAX_MESSAGES_PER_CONNECTION=2)
+    def test_max_messages_per_connection(self):
+        alerts.smtp_pool = None
+        for _ in range(5):
+            self.assertTrue(self.send())
+        self.assertEqual(3, self.server.num_connections)
+
+    def test_email_send_alert(self):
+        _, section = create_mock_data("CIS-120-001", TEST_SEMESTER)
+        reg = Registration(section=section, email="student@example.com")
+        self.assertTrue(alerts.Email(reg).send_alert())
+        self.assertEqual(1, self.server.num_messages)
+
+
+@override_settings(ALERT_BATCH_DISPATCH=True, ALERT_BATCH_SIZE=2)
+@patch("alert.alerts.send_emails")
+@patch("alert.alerts.send_text", return_value=True)
+class BatchAlertDispatchTestCase(TestCase):
+    def setUp(self):
+        set_semester()
+        _, self.section, _, _ = get_or_create_course_and_section("CIS-1600-001", TEST_SEMESTER)
+        self.section.capacity = 30
+        self.section.save()
+        self.registrations = [
+            Registration(email="a@example.com", phone="+15555555555", section=self.section),
+            Registration(email="b@example.com", section=self.section, auto_resubscribe=True),
+            Registration(phone="+15555555556", section=self.section),
+        ]
+        for reg in self.registrations:
+            reg.save()
+        self.section.refresh_from_db()
+        self.assertEqual(3, self.section.registration_volume)
+
+    def test_send_course_alerts_batched(self, mock_text, mock_emails):
+        mock_emails.side_effect = lambda emails: [True] * len(emails)
+        with patch("alert.tasks.send_alert.delay") as mock_send_alert:
+            tasks.send_course_alerts("CIS-1600-001", "O", semester=TEST_SEMESTER, sent_by="WEB")
+        self.assertFalse(mock_send_alert.called)
+        self.assertEqual(2, mock_text.call_count)
+        self.assertLessEqual(mock_emails.call_count, 2)  # at most one call per batch
+        self.assertEqual(
+            ["a@example.com", "b@example.com"],
+            sorted(email[1] for call in mock_emails.call_args_list for email in call[0][0]),
+        )
+        for reg in self.registrations:
+            reg.refresh_from_db()
+            self.assertTrue(reg.notification_sent)
+            self.assertEqual("WEB", reg.notification_sent_by)
+            self.assertIsNotNone(reg.notification_sent_at)
+        resubscribed = Registration.objects.get(resubscribed_from=self.registrations[1])
+        self.assertTrue(resubscribed.is_active)
+        self.assertEqual(resubscribed, self.registrations[1].get_most_current())
+        self.section.refresh_from_db()
+        self.assertEqual(1, self.section.registration_volume)
+
+    def test_unsent_alerts_not_marked(self, mock_text, mock_emails):
+        mock_text.return_value = None
+        mock_emails.side_effect = lambda emails: [None] * len(emails)
+        self.assertEqual(0, tasks.dispatch_alerts(self.registrations))
+        for reg in self.registrations:
+            reg.refresh_from_db()
+            self.assertTrue(reg.is_active)
+        self.section.refresh_from_db()
+        self.assertEqual(3, self.section.registration_volume)
+
+    def test_messages_rendered_once(self, mock_text, mock_emails):
+        mock_emails.side_effect = lambda emails: [True] * len(emails)
+        registrations = get_registrations_for_alerts("CIS-1600-001", TEST_SEMESTER)
+        alerts.clear_alert_render_cache()
+        with patch("alert.alerts.loader.get_template", wraps=alerts.loader.get_template) as t:
+            with self.assertNumQueries(0):
+                results = alerts.send_alerts(registrations)
+        self.assertEqual([True, True, True], results)
+        self.assertEqual(2, t.call_count)  # the text and open email templates
+        # Each distinct message is rendered once (the only auto-resubscribing registration
+        # has no phone number, and the close email template is never rendered)
+        self.assertEqual(
+            {
+                ("alert/text_alert.txt", "CIS-1600-001", False),
+                ("alert/email_alert.html", "CIS-1600-001", False),
+                ("alert/email_alert.html", "CIS-1600-001", True),
+            },
+            set(alerts.rendered_alert_lru),
+        )
+
+
+class AlertRenderingTestCase(TestCase):
+    def setUp(self):
+        set_semester()
+        _, self.section, _, _ = get_or_create_course_and_section("CIS-1600-001", TEST_SEMESTER)
+        self.reg = Registration(email="a@example.com", section=self.section)
+        alerts.clear_alert_render_cache()
+
+    def test_rendered_lazily_and_once(self):
+        with patch("alert.alerts.loader.get_template", wraps=alerts.loader.get_template) as t:
+            email = alerts.Email(self.reg)
+            self.assertFalse(t.called)
+            text = email.text
+            self.assertIn("CIS-1600-001", text)
+            self.assertEqual(text, alerts.Email(self.reg).text)
+            self.assertEqual(1, t.call_count)
+            self.assertNotEqual(text, email.close_text)
+            self.assertEqual(2, t.call_count)
+        self.assertIsNone(alerts.Text(self.reg).close_text)
+
+    def test_keyed_by_auto_resubscribe(self):
+        text = alerts.Email(self.reg).text
+        self.reg.auto_resubscribe = True
+        self.assertNotEqual(text, alerts.Email(self.reg).text)
+        self.assertEqual(2, len(alerts.rendered_alert_lru))
+
+    @override_settings(ALERT_RENDER_CACHE_SIZE=1)
+    def test_lru_eviction(self):
+        alerts.Email(self.reg).text
+        alerts.Text(self.reg).text
+        self.assertEqual(
+            [("alert/text_alert.txt", "CIS-1600-001", False)], list(alerts.rendered_alert_lru)
+        )
+
+
+class ChannelDispatchTestCase(TestCase):
+    def setUp(self):
+        set_semester()
+        _, self.section, _, _ = get_or_create_course_and_section("CIS-1600-001", TEST_SEMESTER)
+        self.reg = Registration(email="a@example.com", phone="+15555555555", section=self.section)
+        self.reg.save()
+
+    def slow(self, result, seconds=0.3):
+        def send_alert(close_notification=False):
+            time.sleep(seconds)
+            return result
+
+        return send_alert
+
+    def test_channels_sent_concurrently(self):
+        with patch("alert.models.Email.send_alert", side_effect=self.slow(True)):
+            with patch("alert.models.Text.send_alert", side_effect=self.slow(True)):
+                start = time.monotonic()
+                self.assertTrue(Registration.objects.get(id=self.reg.id).alert())
+                self.assertLess(time.monotonic() - start, 0.55)
+
+    @override_settings(ALERT_CHANNEL_TIMEOUTS={"text": 0.05, "email": 5, "push": 5})
+    def test_channel_timeout(self):
+        text, email = alerts.Text(self.reg), alerts.Email(self.reg)
+        with patch("alert.alerts.Email.send_alert", return_value=True):
+            with patch("alert.alerts.Text.send_alert", side_effect=self.slow(True)):
+                self.assertEqual([None, True], alerts.send_channel_alerts([text, email]))
+                # A channel timing out doesn't prevent the alert from being marked sent
+                self.assertTrue(self.reg.alert())
+        self.reg.refresh_from_db()
+        self.assertTrue(self.reg.notification_sent)
+
+    def test_channel_timeout_retry(self):
+        transient_errors, still_sending = set(), set()
+        queued = Future()  # a send still waiting for a free thread is cancelled and retried
+        self.assertEqual(
+            (None, None),
+            alerts.get_channel_result(
+                "text", queued, 0, transient_errors=transient_errors, still_sending=still_sending
+            ),
+        )
+        self.assertTrue(queued.cancelled())
+        self.assertEqual(({"text"}, set()), (transient_errors, still_sending))
+
+        transient_errors.clear()
+        running = Future()  # a send that already started may still deliver the alert
+        running.set_running_or_notify_cancel()
+        alerts.get_channel_result(
+            "push", running, 0, transient_errors=transient_errors, still_sending=still_sending
+        )
+        self.assertFalse(running.cancelled())
+        self.assertEqual((set(), {"push"}), (transient_errors, still_sending))
+
+    @override_settings(ALERT_CHANNEL_TIMEOUTS={"text": 0.05, "email": 5, "push": 5})
+    def test_channel_still_sending_not_retried(self):
+        text, email = alerts.Text(self.reg), alerts.Email(self.reg)
+        transient_errors = set()
+        with patch("alert.alerts.Email.send_alert", side_effect=alerts.TransientAlertError):
+            with patch("alert.alerts.Text.send_alert", side_effect=self.slow(True)):
+                self.assertEqual(
+                    [None, None],
+                    alerts.send_channel_alerts([text, email], transient_errors=transient_errors),
+                )
+        self.assertEqual(set(), transient_errors)
+
+    def test_channel_exception(self):
+        text, email = alerts.Text(self.reg), alerts.Email(self.reg)
+        with patch("alert.alerts.Email.send_alert", side_effect=ConnectionRefusedError):
+            with patch("alert.alerts.Text.send_alert", return_value=False):
+                self.assertEqual([False, None], alerts.send_channel_alerts([text, email]))
+                self.assertFalse(self.reg.alert())
+        self.reg.refresh_from_db()
+        self.assertFalse(self.reg.notification_sent)
+
+    @override_settings(TWILIO_SID="AC123", TWILIO_AUTH_TOKEN="token")
+    def test_shared_clients(self):
+        alerts.channel_clients.clear()
+        self.assertIs(alerts.get_twilio_client(), alerts.get_twilio_client())
+        self.assertIs(alerts.get_push_session(), alerts.get_push_session())
+        with patch("alert.alerts.os.getpid", return_value=-1):
+            self.assertIsNot(alerts.channel_clients["text"][1], alerts.get_twilio_client())
+        alerts.channel_clients.clear()
+
+
+class MarkAlertsSentTestCase(TestCase):
+    def setUp(self):
+        set_semester()
+        self.sections = []
+        for code in ["CIS-1600-001", "CIS-1210-001"]:
+            _, section, _, _ = get_or_create_course_and_section(code, TEST_SEMESTER)
+            section.capacity = 30
+            section.save()
+            self.sections.append(section)
+
+    def create_registrations(self, n):
+        registrations = []
+        for i in range(n):
+            reg = Registration(
+                email=f"{i}@example.com",
+                section=self.sections[i % 2],
+                auto_resubscribe=(i % 3 != 0),
+            )
+            reg.save()
+            registrations.append(reg)
+        return registrations
+
+    @patch("alert.tasks.schedule_section_demand_change")
+    def test_mark_alerts_sent(self, mock_schedule):
+        registrations = self.create_registrations(6)
+        # Start with registrations[1] in a resubscribe chain of 2
+        (first_successor,) = Registration.mark_alerts_sent([registrations[1]])
+        registrations[1] = first_successor
+        mock_schedule.reset_mock()
+
+        successors = Registration.mark_alerts_sent(registrations, sent_by="WEB")
+        self.assertEqual(1, mock_schedule.call_count)
+        self.assertEqual(4, len(successors))
+        for reg in registrations:
+            reg.refresh_from_db()
+            self.assertTrue(reg.notification_sent)
+            self.assertEqual("WEB", reg.notification_sent_by)
+            self.assertFalse(reg.is_active)
+            if reg.auto_resubscribe:
+                head = reg.get_most_current()
+                self.assertTrue(head.is_active)
+                self.assertEqual(reg, head.resubscribed_from)
+                self.assertEqual(head, head.head_registration)
+                self.assertEqual(
+                    reg.get_original_registration().created_at, head.original_created_at
+                )
+                for chained in reg.get_resubscribe_group():
+                    self.assertEqual(head, chained.head_registration)
+                self.assertEqual(
+                    3 if reg == first_successor else 2, reg.get_resubscribe_group().count()
+                )
+            else:
+                self.assertFalse(Registration.objects.filter(resubscribed_from=reg).exists())
+        for section in self.sections:
+            section.refresh_from_db()
+            self.assertEqual(
+                Registration.objects.filter(
+                    section=section, **Registration.is_active_filter()
+                ).count(),
+                section.registration_volume,
+            )
+
+    @patch("alert.tasks.schedule_section_demand_change")
+    def test_constant_queries(self, mock_schedule):
+        num_queries = []
+        for n in [4, 8]:
+            registrations = self.create_registrations(n)
+            with CaptureQueriesContext(connection) as captured:
+                Registration.mark_alerts_sent(registrations)
+            num_queries.append(len(captured.captured_queries))
+            Registration.objects.all().delete()
+        self.assertEqual(num_queries[0], num_queries[1])
+
+    def test_mark_close_notifications_sent(self):
+        registrations = self.create_registrations(2)
+        Registration.mark_alerts_sent(registrations, close_notification=True, sent_by="WEB")
+        for reg in registrations:
+            reg.refresh_from_db()
+            self.assertTrue(reg.close_notification_sent)
+            self.assertTrue(reg.is_active)
+        self.sections[0].refresh_from_db()
+        self.assertEqual(1, self.sections[0].registration_volume)
+
+
+@override_settings(ALERT_LATENCY_TRACING_ENABLED=True)
+@patch("alert.alerts.send_text", return_value=True)
+@patch("alert.alerts.send_email", return_value=True)
+class AlertLatencyTracingTestCase(TestCase):
+    def setUp(self):
+        set_semester()
+        Option.objects.update_or_create(
+            key="SEND_FROM_WEBHOOK", value_type="BOOL", defaults={"value": "TRUE"}
+        )
+        _, self.section, _, _ = get_or_create_course_and_section("CIS-1600-001", TEST_SEMESTER)
+        for i in range(2):
+            Registration(
+                email=f"{i}@example.com", phone=f"+1555555555{i}", section=self.section
+            ).save()
+        auth = base64.standard_b64encode("webhook:password".encode("ascii"))
+        self.headers = {"Authorization": f"Basic {auth.decode()}"}
+        self.body = {
+            "section_id_normalized": "CIS-1600-001",
+            "previous_status": "C",
+            "status": "O",
+            "status_code_normalized": "Open",
+            "term": translate_semester(TEST_SEMESTER),
+        }
+
+    def post_webhook(self, url_name="webhook", body=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            res = self.client.post(
+                reverse(url_name, urlconf="alert.urls"),
+                data=json.dumps(body or self.body),
+                content_type="application/json",
+                **self.headers,
+            )
+        self.assertEqual(200, res.status_code)
+
+    def check_trace(self, trace):
+        self.assertEqual("CIS-1600-001", trace.full_code)
+        self.assertEqual(TEST_SEMESTER, trace.semester)
+        self.assertEqual("O", trace.course_status)
+        self.assertGreaterEqual(trace.course_alerts_started_ms, 0)
+        self.assertGreaterEqual(trace.status_update_committed_ms, 0)
+        self.assertEqual(2, len(trace.alerts))
+        for alert_started, email, text, push in trace.alerts:
+            self.assertGreaterEqual(alert_started, trace.course_alerts_started_ms)
+            self.assertGreaterEqual(email, alert_started)
+            self.assertGreaterEqual(text, alert_started)
+            self.assertIsNone(push)
+
+    def test_webhook_traced(self, mock_email, mock_text):
+        self.post_webhook()
+        self.assertEqual(2, mock_email.call_count)
+        self.check_trace(AlertLatencyTrace.objects.get())
+
+    def test_batch_webhook_traced(self, mock_email, mock_text):
+        self.post_webhook("webhook-batch", [self.body])
+        self.check_trace(AlertLatencyTrace.objects.get())
+
+    @override_settings(ALERT_BATCH_DISPATCH=True)
+    def test_batch_dispatch_traced(self, mock_email, mock_text):
+        with patch("alert.alerts.send_emails", side_effect=lambda emails: [True] * len(emails)):
+            self.post_webhook()
+        self.check_trace(AlertLatencyTrace.objects.get())
+
+    @override_settings(ALERT_LATENCY_TRACING_ENABLED=False)
+    def test_tracing_disabled(self, mock_email, mock_text):
+        self.post_webhook()
+        self.assertEqual(2, mock_email.call_count)
+        self.assertFalse(AlertLatencyTrace.objects.exists())
+
+    def test_latency_report(self, mock_email, mock_text):
+        self.post_webhook()
+        AlertLatencyTrace.objects.create(
+            full_code="CIS-1210-001",
+            semester=TEST_SEMESTER,
+            course_status="O",
+            webhook_received_at=timezone.now(),
+            course_alerts_started_ms=10,
+            alerts=[[20, 100, None, None], [30, 200, 300, None]],
+        )
+        report = latency.get_alert_latency_percentiles(AlertLatencyTrace.objects.all())
+        self.assertEqual([TEST_SEMESTER], list(report))
+        self.assertEqual(4, report[TEST_SEMESTER]["email"]["count"])
+        self.assertEqual(3, report[TEST_SEMESTER]["text"]["count"])
+        self.assertEqual(0, report[TEST_SEMESTER]["push"]["count"])
+        self.assertIsNone(report[TEST_SEMESTER]["push"]["p50"])
+        self.assertLessEqual(report[TEST_SEMESTER]["email"]["p50"], 200)
+
+        out = StringIO()
+        call_command("alertlatency", "--json", stdout=out)
+        self.assertEqual(report, json.loads(out.getvalue()))
+
+        url = reverse("alert-latency")
+        user = User.objects.create_user(username="jacob", password="top_secret")
+        self.client.force_login(user)
+        self.assertEqual(403, self.client.get(url).status_code)
+        user.is_staff = True
+        user.save()
+        res = self.client.get(url, {"semesters": TEST_SEMESTER, "days": 1})
+        self.assertEqual(200, res.status_code)
+        self.assertEqual(report, res.json()["semesters"])
+
+
+class AlertRateLimitingTestCase(TestCase):
+    @patch("alert.rate_limit.token_bucket")
+    def test_disabled(self, mock_bucket):
+        self.assertTrue(rate_limit.acquire_channel_tokens("text"))
+        mock_bucket.assert_not_called()
+
+    @override_settings(
+        ALERT_RATE_LIMITING_ENABLED=True,
+        ALERT_CHANNEL_RATE_LIMITS={"email": (14, 28), "text": (1, 5), "push": (50, 100)},
+        ALERT_RATE_LIMIT_MAX_WAIT=10,
+    )
+    @patch("alert.rate_limit.time.sleep")
+    @patch("alert.rate_limit.token_bucket")
+    def test_acquire(self, mock_bucket, mock_sleep):
+        mock_bucket.return_value = b"0"
+        self.assertTrue(rate_limit.acquire_channel_tokens("text", 3))
+        mock_sleep.assert_not_called()
+        self.assertEqual(["alert_rate_limit:text"], mock_bucket.call_args[1]["keys"])
+        rate, burst, _, count, max_wait = mock_bucket.call_args[1]["args"]
+        self.assertEqual((1, 5, 3, 10), (rate, burst, count, max_wait))
+
+        mock_bucket.return_value = b"2.5"
+        self.assertTrue(rate_limit.acquire_channel_tokens("text"))
+        mock_sleep.assert_called_once_with(2.5)
+
+        mock_sleep.reset_mock()
+        mock_bucket.return_value = b"10.5"
+        self.assertFalse(rate_limit.acquire_channel_tokens("text"))
+        mock_sleep.assert_not_called()
+
+        # The channels are not throttled if Redis is unavailable
+        mock_bucket.side_effect = redis.exceptions.ConnectionError()
+        self.assertTrue(rate_limit.acquire_channel_tokens("text"))
+        mock_sleep.assert_not_called()
+
+
+@override_settings(ALERT_RETRY_MAX_ATTEMPTS=3)
+class AlertRetryTestCase(TestCase):
+    def setUp(self):
+        set_semester()
+        _, self.section, _, _ = get_or_create_course_and_section("CIS-1600-001", TEST_SEMESTER)
+        self.reg = Registration(email="a@example.com", phone="+15555555555", section=self.section)
+        self.reg.save()
+
+    def assert_sent(self, reg, sent=True):
+        reg.refresh_from_db()
+        self.assertEqual(sent, reg.notification_sent)
+
+    @patch("alert.alerts.send_text", side_effect=TwilioRestException(429, "", "Too Many Requests"))
+    @patch("alert.alerts.send_email")
+    def test_transient_error_retried(self, mock_email, mock_text):
+        mock_email.side_effect = [SMTPServerDisconnected(), True]
+        tasks.send_alert(self.reg.id, close_notification=False)
+        self.assertEqual(2, mock_email.call_count)
+        self.assertEqual(2, mock_text.call_count)
+        self.assert_sent(self.reg)
+
+    @patch("alert.alerts.send_text", side_effect=TwilioRestException(400, "", "Bad Request"))
+    @patch("alert.alerts.send_email", side_effect=SMTPRecipientsRefused({}))
+    def test_permanent_error_not_retried(self, mock_email, mock_text):
+        tasks.send_alert(self.reg.id, close_notification=False)
+        self.assertEqual(1, mock_email.call_count)
+        self.assertEqual(1, mock_text.call_count)
+        self.assert_sent(self.reg, False)
+
+    @patch("alert.alerts.send_text", return_value=True)
+    @patch("alert.alerts.send_email", side_effect=SMTPServerDisconnected())
+    def test_partial_transient_error_not_retried(self, mock_email, mock_text):
+        tasks.send_alert(self.reg.id, close_notification=False)
+        self.assertEqual(1, mock_email.call_count)
+        self.assert_sent(self.reg)
+
+    @patch("alert.alerts.send_text", side_effect=TwilioRestException(503, "", "Unavailable"))
+    @patch("alert.alerts.send_email", side_effect=SMTPServerDisconnected())
+    def test_retries_exhausted(self, mock_email, mock_text):
+        tasks.send_alert(self.reg.id, close_notification=False)
+        self.assertEqual(4, mock_email.call_count)
+        self.assert_sent(self.reg, False)
+        self.assertTrue(Registration.objects.get(id=self.reg.id).is_active)
+
+    @override_settings(ALERT_RATE_LIMITING_ENABLED=True, ALERT_RATE_LIMIT_MAX_WAIT=1)
+    @patch("alert.rate_limit.token_bucket", return_value=b"5")
+    @patch("alert.alerts.send_text")
+    @patch("alert.alerts.send_email")
+    def test_rate_limit_saturated(self, mock_email, mock_text, mock_bucket):
+        tasks.send_alert(self.reg.id, close_notification=False)
+        mock_email.assert_not_called()
+        mock_text.assert_not_called()
+        self.assertEqual(8, mock_bucket.call_count)  # 2 channels, 4 attempts
+        self.assert_sent(self.reg, False)
+
+    @override_settings(ALERT_BATCH_DISPATCH=True)
+    @patch("alert.alerts.send_text", return_value=False)
+    @patch("alert.alerts.send_email", return_value=True)
+    @patch("alert.alerts.send_emails")
+    def test_batch_transient_error_retried(self, mock_emails, mock_email, mock_text):
+        mock_emails.side_effect = lambda emails: [
+            SMTPServerDisconnected() if to == "a@example.com" else True for _, to, _, _ in emails
+        ]
+        other = Registration(email="b@example.com", section=self.section)
+        other.save()
+        tasks.send_course_alerts("CIS-1600-001", "O", semester=TEST_SEMESTER)
+        self.assertEqual(1, mock_emails.call_count)
+        # Only the registration whose email failed is retried (individually)
+        self.assertEqual(1, mock_email.call_count)
+        self.assertEqual("a@example.com", mock_email.call_args[1]["to"])
+        self.assert_sent(self.reg)
+        self.assert_sent(other)
+
+    @override_settings(ALERT_BATCH_DISPATCH=True)
+    @patch("alert.alerts.send_text", return_value=False)
+    @patch("alert.alerts.send_email", return_value=True)
+    @patch("alert.alerts.send_emails")
+    def test_batch_permanent_error_not_retried(self, mock_emails, mock_email, mock_text):
+        mock_emails.side_effect = lambda emails: [
+            SMTPDataError(554, b"Message rejected") if to == "a@example.com" else True
+            for _, to, _, _ in emails
+        ]
+        other = Registration(email="b@example.com", section=self.section)
+        other.save()
+        tasks.send_course_alerts("CIS-1600-001", "O", semester=TEST_SEMESTER)
+        mock_email.assert_not_called()
+        self.assert_sent(self.reg, False)
+        self.assert_sent(other)
+
+    @override_settings(ALERT_RETRY_BASE_DELAY=5, ALERT_RETRY_MAX_DELAY=60)
+    def test_retry_delay(self):
+        with patch("alert.tasks.random.uniform", side_effect=lambda a, b: b):
+            self.assertEqual(
+                [10, 20, 40, 60, 60], [tasks.get_alert_retry_delay(n) for n in range(1, 6)]
+            )
+        for n in range(1, 10):
+            self.assertTrue(0 <= tasks.get_alert_retry_delay(n) <= 60)
+
+    def test_earliest_registrations_first(self):
+        regs = [self.reg]
+        for i in range(3):
+            reg = Registration(email=f"{i}@example.com", section=self.section)
+            reg.save()
+            regs.append(reg)
+        now = timezone.now()
+        for i, reg in enumerate(regs):
+            Registration.objects.filter(id=reg.id).update(
+                original_created_at=now - timedelta(days=i)
+            )
+        self.assertEqual(
+            [reg.id for reg in reversed(regs)],
+            [reg.id for reg in get_registrations_for_alerts("CIS-1600-001", TEST_SEMESTER, "O")],
+        )
+
+
+@override_settings(ALERT_FANOUT_DEDUP_ENABLED=True, ALERT_FANOUT_DEDUP_WINDOW=60)
+@patch("alert.views.send_course_alerts.delay")
+@patch("alert.fanout_dedup.claim_fanout")
+class AlertFanoutDedupTestCase(TestCase):
+    def setUp(self):
+        self.transition_at = datetime(2019, 1, 10, 12, 0, 30, tzinfo=gettz("UTC"))
+
+    def test_claimed(self, mock_claim, mock_delay):
+        mock_claim.return_value = 1
+        alert_for_course(
+            "CIS 1600 001",
+            semester=TEST_SEMESTER,
+            sent_by="WEB",
+            course_status="O",
+            received_at=self.transition_at,
+        )
+        mock_delay.assert_called_once()
+        self.assertEqual(
+            [f"alert_fanout:{TEST_SEMESTER}:CIS-1600-001", f"alert_fanout:{TEST_SEMESTER}:stats"],
+            mock_claim.call_args[1]["keys"],
+        )
+        self.assertEqual(
+            ["O", int(self.transition_at.timestamp()) // 60, 180], mock_claim.call_args[1]["args"]
+        )
+
+    def test_duplicate_suppressed(self, mock_claim, mock_delay):
+        mock_claim.return_value = 0
+        self.assertIsNone(
+            alert_for_course(
+                "CIS-1600-001",
+                semester=TEST_SEMESTER,
+                sent_by="WEB",
+                course_status="O",
+                received_at=self.transition_at,
+            )
+        )
+        mock_delay.assert_not_called()
+
+    @patch("alert.fanout_dedup.release_fanout")
+    def test_released_if_not_queued(self, mock_release, mock_claim, mock_delay):
+        mock_claim.return_value = 1
+        mock_delay.side_effect = ConnectionRefusedError()
+        with self.assertRaises(ConnectionRefusedError):
+            alert_for_course(
+                "CIS-1600-001",
+                semester=TEST_SEMESTER,
+                sent_by="WEB",
+                course_status="O",
+                received_at=self.transition_at,
+            )
+        self.assertEqual(mock_claim.call_args[1]["keys"], mock_release.call_args[1]["keys"])
+        self.assertEqual(mock_claim.call_args[1]["args"][:2], mock_release.call_args[1]["args"])
+
+    def test_redis_unavailable(self, mock_claim, mock_delay):
+        mock_claim.side_effect = redis.exceptions.ConnectionError()
+        alert_for_course("CIS-1600-001", semester=TEST_SEMESTER, sent_by="WEB", course_status="O")
+        mock_delay.assert_called_once()
+
+    @override_settings(ALERT_FANOUT_DEDUP_ENABLED=False)
+    def test_disabled(self, mock_claim, mock_delay):
+        alert_for_course("CIS-1600-001", semester=TEST_SEMESTER, sent_by="WEB", course_status="O")
+        mock_claim.assert_not_called()
+        mock_delay.assert_called_once()
+
+    def test_buckets(self, mock_claim, mock_delay):
+        self.assertEqual(
+            fanout_dedup.get_alert_fanout_bucket(self.transition_at),
+            fanout_dedup.get_alert_fanout_bucket(self.transition_at + timedelta(seconds=29)),
+        )
+        self.assertEqual(
+            fanout_dedup.get_alert_fanout_bucket(self.transition_at) + 1,
+            fanout_dedup.get_alert_fanout_bucket(self.transition_at + timedelta(seconds=30)),
+        )
+
+    @patch("alert.fanout_dedup.r")
+    def test_stats(self, mock_redis, mock_claim, mock_delay):
+        mock_redis.hgetall.return_value = {b"claimed": b"3", b"suppressed": b"2"}
+        self.assertEqual(
+            {"claimed": 3, "suppressed": 2}, fanout_dedup.get_alert_fanout_stats(TEST_SEMESTER)
+        )
+        mock_redis.hgetall.return_value = dict()
+        self.assertEqual(
+            {"claimed": 0, "suppressed": 0}, fanout_dedup.get_alert_fanout_stats(TEST_SEMESTER)
+        )
+
+
+class RegistrationBulkLoadTestCase(TestCase):
+    def setUp(self):
+        set_semester()
+        _, self.section, _, _ = get_or_create_course_and_section("CIS-1600-001", TEST_SEMESTER)
+        _, self.other_section, _, _ = get_or_create_course_and_section(
+            "CIS-1200-001", TEST_SEMESTER
+        )
+        self.start = timezone.now() - timedelta(days=10)
+
+    def make_rows(self, num_chains=1, prefix=""):
+        """
+        Returns rows for num_chains resubscribe chains of 3 registrations each (the last of
+        which is active) watching self.section, and one registration watching
+        self.other_section, in scrambled order.
+        """
+        rows = []
+        for c in range(num_chains):
+            for i in range(3):
+                rows.append(
+                    {
+                        "load_id": f"{prefix}{c}-{i}",
+                        "resubscribed_from": f"{prefix}{c}-{i - 1}" if i else None,
+                        "section_id": self.section.id,
+                        "source": "SCRIPT_PCA",
+                        "email": f"{c}@example.com",
+                        "created_at": self.start + timedelta(days=i, minutes=c),
+                        "notification_sent": i < 2,
+                        "notification_sent_at": (
+                            self.start + timedelta(days=i, hours=1) if i < 2 else None
+                        ),
+                    }
+                )
+        rows.append(
+            {
+                "section_id": self.other_section.id,
+                "source": "SCRIPT_PCA",
+                "phone": "(215) 555-0100",
+                "created_at": self.start,
+            }
+        )
+        return rows[::-1]
+
+    def test_bulk_load(self):
+        registrations = Registration.bulk_load(self.make_rows())
+        self.assertEqual(4, Registration.objects.count())
+        other, head, middle, tail = registrations
+        for registration in [tail, middle, head]:
+            registration = Registration.objects.get(id=registration.id)
+            self.assertEqual(head.id, registration.head_registration_id)
+            self.assertEqual(tail.created_at, registration.original_created_at)
+            self.assertEqual(TEST_SEMESTER, registration.semester)
+            self.assertEqual(head, registration.get_most_current())
+            self.assertEqual(head, registration.get_most_current_iter())
+            self.assertEqual(tail, registration.get_original_registration())
+        self.assertEqual(middle.id, Registration.objects.get(id=head.id).resubscribed_from_id)
+        self.assertEqual(tail.id, Registration.objects.get(id=middle.id).resubscribed_from_id)
+        self.assertIsNone(Registration.objects.get(id=tail.id).resubscribed_from_id)
+        self.assertEqual(self.start, Registration.objects.get(id=tail.id).created_at)
+        self.assertEqual(
+            self.start + timedelta(days=2), Registration.objects.get(id=head.id).created_at
+        )
+
+        other = Registration.objects.get(id=other.id)
+        self.assertEqual("+12155550100", other.phone)
+        self.assertEqual(other.id, other.head_registration_id)
+        self.assertEqual(other.created_at, other.original_created_at)
+
+        self.section.refresh_from_db()
+        self.other_section.refresh_from_db()
+        self.assertEqual(1, self.section.registration_volume)
+        self.assertEqual(1, self.other_section.registration_volume)
+
+        # Loading more registrations reconciles the volumes with the existing ones
+        Registration.bulk_load(self.make_rows(prefix="x"))
+        self.section.refresh_from_db()
+        self.assertEqual(2, self.section.registration_volume)
+
+    def test_constant_queries(self):
+        query_counts = []
+        for n, prefix in [(2, "a"), (10, "b")]:
+            with CaptureQueriesContext(connection) as captured:
+                Registration.bulk_load(self.make_rows(num_chains=n, prefix=prefix))
+            query_counts.append(len(captured.captured_queries))
+        self.assertEqual(query_counts[0], query_counts[1])
+        self.assertEqual((2 + 10) * 3 + 2, Registration.objects.count())
+
+    def test_invalid_chains(self):
+        rows = self.make_rows()
+        for invalid in [
+            rows + [{"section_id": self.section.id, "resubscribed_from": "missing"}],
+            rows + [{"section_id": self.section.id, "resubscribed_from": "0-1"}],
+            rows + [{"section_id": self.section.id, "load_id": "0-1"}],
+            [
+                {"section_id": self.section.id, "load_id": 1, "resubscribed_from": 2},
+                {"section_id": self.section.id, "load_id": 2, "resubscribed_from": 1},
+            ],
+            [{"section_id": -1}],
+        ]:
+            with self.assertRaises(ValueError):
+                Registration.bulk_load(invalid)
+        self.assertFalse(Registration.objects.exists())
+
+
+class RegistrationListQueriesTestCase(TestCase):
+    def setUp(self):
+        set_semester()
+        self.user = User.objects.create_user(username="jacob", password="top_secret")
+        self.user.profile.email = "j@gmail.com"
+        self.user.profile.save()
+        self.client = APIClient()
+        self.client.login(username="jacob", password="top_secret")
+        self.num_sections = 0
+
+    def add_registrations(self, n):
+        """
+        Adds a resubscribe chain of 2 registrations (the first of which has sent an alert)
+        for each of n new sections, and a cancelled registration for another new section.
+        """
+        for _ in range(n):
+            self.num_sections += 1
+            _, section = create_mock_data(f"CIS-{1000 + self.num_sections}-001", TEST_SEMESTER)
+            registration = Registration(user=self.user, section=section)
+            registration.save()
+            Registration.mark_alerts_sent([registration], sent_by="WEB")
+            Registration.objects.get(id=registration.id).resubscribe()
+        self.num_sections += 1
+        _, section = create_mock_data(f"CIS-{1000 + self.num_sections}-001", TEST_SEMESTER)
+        Registration(user=self.user, section=section, cancelled=True).save()
+
+    def count_queries(self, url_name):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(reverse(url_name))
+        self.assertEqual(200, response.status_code)
+        return len(captured.captured_queries), response.data
+
+    def check_constant_queries(self, url_name, num_results):
+        """
+        Checks that listing num_results[0] and then num_results[1] registrations (after adding
+        2 and then 6 more resubscribe chains) takes the same number of queries.
+        """
+        query_counts = []
+        for n, expected in zip([2, 6], num_results):
+            self.add_registrations(n)
+            num_queries, data = self.count_queries(url_name)
+            self.assertEqual(expected, len(data))
+            query_counts.append(num_queries)
+        self.assertEqual(query_counts[0], query_counts[1])
+
+    def test_list_constant_queries(self):
+        self.check_constant_queries("registrations-list", [3, 10])
+        _, data = self.count_queries("registrations-list")
+        for ob in data:
+            registration = Registration.objects.get(id=ob["id"])
+            self.assertEqual(
+                registration.last_notification_sent_at,
+                ob["last_notification_sent_at"],
+            )
+            self.assertEqual(registration.section.status, ob["section_status"])
+
+    def test_history_constant_queries(self):
+        self.check_constant_queries("registrationhistory-list", [5, 18])
+
+
+class RegistrationHeadFlagTestCase(TestCase):
+    def setUp(self):
+        set_semester()
+        _, self.section, _, _ = get_or_create_course_and_section("CIS-1600-001", TEST_SEMESTER)
+
+    def assert_heads_consistent(self):
+        for registration in Registration.objects.all():
+            self.assertEqual(
+                not Registration.objects.filter(resubscribed_from=registration).exists(),
+                registration.is_head,
+            )
+            self.assertEqual(
+                registration.id == registration.head_registration_id, registration.is_head
+            )
+
+    def test_resubscribe(self):
+        registration = Registration(email="a@example.com", section=self.section)
+        registration.save()
+        self.assertTrue(Registration.objects.get(id=registration.id).is_head)
+        registration.notification_sent = True
+        registration.save()
+        successor = registration.resubscribe()
+        successor.notification_sent = True
+        successor.save()
+        head = successor.resubscribe()
+        self.assert_heads_consistent()
+        registration.refresh_from_db()
+        self.assertEqual(head, registration.get_most_current())
+
+        # Saving a stale copy of a registration doesn't overwrite its is_head flag
+        successor.cancelled = True
+        successor.save()
+        self.assertFalse(Registration.objects.get(id=successor.id).is_head)
+
+    @patch("alert.tasks.schedule_section_demand_change")
+    def test_mark_alerts_sent(self, mock_schedule):
+        registrations = []
+        for i in range(4):
+            registration = Registration(
+                email=f"{i}@example.com", section=self.section, auto_resubscribe=i % 2 == 0
+            )
+            registration.save()
+            registrations.append(registration)
+        successors = Registration.mark_alerts_sent(registrations)
+        self.assertEqual(2, len(successors))
+        Registration.mark_alerts_sent(successors)
+        self.assertEqual(8, Registration.objects.count())
+        self.assert_heads_consistent()
+
+    def test_bulk_load(self):
+        start = timezone.now() - timedelta(days=10)
+        Registration.bulk_load(
+            [
+                {
+                    "load_id": i,
+                    "resubscribed_from": i - 1 if i else None,
+                    "section_id": self.section.id,
+                    "email": "a@example.com",
+                    "created_at": start + timedelta(days=i),
+                    "notification_sent": i < 2,
+                }
+                for i in range(3)
+            ]
+        )
+        self.assert_heads_consistent()
+
+    def test_backfill_command(self):
+        registration = Registration(email="a@example.com", section=self.section)
+        registration.save()
+        registration.notification_sent = True
+        registration.save()
+        registration.resubscribe()
+        call_command("backfill_registration_heads", "--check")
+
+        # Simulate rows written without maintaining is_head (e.g. with raw SQL)
+        Registration.objects.update(is_head=True)
+        with self.assertRaises(CommandError):
+            call_command("backfill_registration_heads", "--check")
+        call_command("backfill_registration_heads")
+        self.assert_heads_consistent()
+        call_command("backfill_registration_heads", "--check")
+
+
+class BulkRegistrationTestCase(TestCase):
+    def setUp(self):
+        set_semester()
+        self.user = User.objects.create_user(username="jacob", password="top_secret")
+        self.user.profile.email = "j@gmail.com"
+        self.user.profile.save()
+        self.client = APIClient()
+        self.client.login(username="jacob", password="top_secret")
+        self.sections = []
+        for i in range(4):
+            _, section = create_mock_data(f"CIS-{1100 + i}-001", TEST_SEMESTER)
+            self.sections.append(section)
+
+    def bulk(self, method, items):
+        response = getattr(self.client, method)(
+            reverse("registrations-bulk"), json.dumps(items), content_type="application/json"
+        )
+        return response
+
+    def bulk_results(self, method, items):
+        response = self.bulk(method, items)
+        self.assertEqual(200, response.status_code)
+        return [(result["status"], result.get("id")) for result in response.data["results"]]
+
+    def check_registration_volumes(self):
+        for section in self.sections:
+            section.refresh_from_db()
+            self.assertEqual(
+                Registration.objects.filter(
+                    section=section, **Registration.is_active_filter()
+                ).count(),
+                section.registration_volume,
+            )
+
+    @patch("alert.tasks.schedule_section_demand_change")
+    def test_bulk_create(self, mock_schedule):
+        Registration(user=self.user, section=self.sections[3]).save()
+        mock_schedule.reset_mock()
+        items = [
+            {"section": "CIS-1100-001", "auto_resubscribe": True},
+            {"section": "cis 1101 001", "close_notification": True},
+            {"section": "CIS-1100-001"},
+            {"section": "CIS-9999-001"},
+            {"section": "CIS-1103-001"},
+            {"auto_resubscribe": True},
+        ]
+        with CaptureQueriesContext(connection) as captured:
+            results = self.bulk_results("post", items)
+        self.assertEqual([201, 201, 400, 404, 409, 400], [code for code, _ in results])
+        self.assertEqual(1, mock_schedule.call_count)
+
+        first = Registration.objects.get(id=results[0][1])
+        self.assertEqual(self.sections[0], first.section)
+        self.assertTrue(first.auto_resubscribe)
+        self.assertTrue(first.is_active)
+        self.assertTrue(first.is_head)
+        self.assertEqual(first, first.head_registration)
+        self.assertEqual(first.created_at, first.original_created_at)
+        self.assertEqual(TEST_SEMESTER, first.semester)
+        second = Registration.objects.get(id=results[1][1])
+        self.assertEqual(self.sections[1], second.section)
+        self.assertTrue(second.close_notification)
+        self.check_registration_volumes()
+
+        # Creating more registrations doesn't take more queries
+        for section in self.sections[:2]:
+            Registration.objects.filter(section=section).update(cancelled=True)
+        items = [{"section": section.full_code} for section in self.sections[:3]]
+        with CaptureQueriesContext(connection) as captured_more:
+            results = self.bulk_results("post", items)
+        self.assertEqual([201, 201, 201], [code for code, _ in results])
+        self.assertLessEqual(len(captured_more.captured_queries), len(captured.captured_queries))
+
+    def test_bulk_create_invalid(self):
+        self.assertEqual(400, self.bulk("post", {"section": "CIS-1100-001"}).status_code)
+        self.assertEqual(400, self.bulk("post", ["CIS-1100-001"]).status_code)
+        with self.settings(PCA_BULK_REGISTRATION_LIMIT=1):
+            items = [{"section": section.full_code} for section in self.sections]
+            self.assertEqual(400, self.bulk("post", items).status_code)
+        self.user.profile.email = None
+        self.user.profile.save()
+        self.assertEqual(406, self.bulk("post", [{"section": "CIS-1100-001"}]).status_code)
+        self.assertFalse(Registration.objects.exists())
+
+    def test_bulk_create_registration_closed(self):
+        Option.objects.update_or_create(key="REGISTRATION_OPEN", value_type="BOOL", value="FALSE")
+        self.assertEqual(503, self.bulk("post", [{"section": "CIS-1100-001"}]).status_code)
+        self.assertFalse(Registration.objects.exists())
+
+    @patch("alert.tasks.schedule_section_demand_change")
+    def test_bulk_update(self, mock_schedule):
+        results = self.bulk_results(
+            "post", [{"section": section.full_code} for section in self.sections]
+        )
+        registrations = [Registration.objects.get(id=id) for _, id in results]
+        Registration.mark_alerts_sent([registrations[0]])
+        mock_schedule.reset_mock()
+
+        results = self.bulk_results(
+            "put",
+            [
+                {"section": "CIS-1100-001", "resubscribe": True},
+                {"section": "CIS-1101-001", "cancelled": True},
+                {"section": "CIS-1102-001", "auto_resubscribe": True},
+                {"section": "CIS-1103-001", "deleted": True},
+                {"section": "CIS-1101-001", "deleted": True},
+                {"section": "CIS-9999-001", "cancelled": True},
+            ],
+        )
+        self.assertEqual([200, 200, 200, 200, 400, 404], [code for code, _ in results])
+        self.assertEqual(1, mock_schedule.call_count)
+
+        successor = Registration.objects.get(id=results[0][1])
+        self.assertEqual(registrations[0], successor.resubscribed_from)
+        self.assertTrue(successor.is_active)
+        for registration in registrations:
+            registration.refresh_from_db()
+        self.assertEqual(successor, registrations[0].get_most_current())
+        self.assertFalse(registrations[0].is_head)
+        self.assertTrue(registrations[1].cancelled)
+        self.assertIsNotNone(registrations[1].cancelled_at)
+        self.assertTrue(registrations[2].auto_resubscribe)
+        self.assertTrue(registrations[2].is_active)
+        self.assertTrue(registrations[3].deleted)
+        self.check_registration_volumes()
+
+        # Cancelled registrations can be resubscribed to, sent ones can't be cancelled
+        results = self.bulk_results(
+            "put",
+            [
+                {"section": "CIS-1101-001", "resubscribe": True},
+                {"section": "CIS-1100-001", "resubscribe": True},
+                {"section": "CIS-1103-001", "cancelled": True},
+            ],
+        )
+        self.assertEqual([200, 400, 404], [code for code, _ in results])
+        self.assertTrue(Registration.objects.get(id=results[0][1]).is_active)
+        self.check_registration_volumes()
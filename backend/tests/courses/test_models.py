@@ -1,17 +1,37 @@
+from datetime import timedelta
+from unittest.mock import patch
+
 from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
 from django.db.models.signals import post_save
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.utils import timezone
 from options.models import Option
 from rest_framework.test import APIClient
 
 from alert.management.commands.recomputestats import recompute_precomputed_fields
 from alert.models import AddDropPeriod
-from courses.models import Course, Department, PreNGSSRequirement, Section, Topic, UserProfile
+from courses.models import (
+    Course,
+    Department,
+    PreNGSSRequirement,
+    Section,
+    StatusUpdate,
+    StatusUpdateRequestBody,
+    Topic,
+    UserProfile,
+)
 from courses.util import (
+    find_inconsistent_last_status_updates,
+    get_cached_section_id,
+    get_course_and_section,
     get_or_create_course,
     get_or_create_course_and_section,
     invalidate_current_semester_cache,
     record_update,
+    remember_section_id,
     separate_course_code,
     set_crosslistings,
     update_course_from_record,
@@ -103,6 +123,44 @@ class GetCourseSectionTest(TestCase):
         self.assertEqual(course.code, "120")
         self.assertEqual(section.code, "001")
 
+    def test_cached_lookup_single_query(self):
+        get_course_and_section("PSCI-131-001", TEST_SEMESTER)
+        with self.assertNumQueries(1):
+            course, section = get_course_and_section("psci 131 001", TEST_SEMESTER)
+        with self.assertNumQueries(0):
+            self.assertEqual(course, self.c)
+            self.assertEqual(section, self.s)
+        with self.assertNumQueries(1):
+            get_or_create_course_and_section("PSCI131001", TEST_SEMESTER)
+
+    def test_cache_created_section(self):
+        section = Section(code="002", course=self.c)
+        section.save()
+        self.assertEqual(get_cached_section_id("PSCI-131-002", TEST_SEMESTER), section.id)
+
+    def test_cache_invalidated_on_delete(self):
+        get_course_and_section("PSCI-131-001", TEST_SEMESTER)
+        self.s.delete()
+        self.assertIsNone(get_cached_section_id("PSCI-131-001", TEST_SEMESTER))
+        with self.assertRaises(Section.DoesNotExist):
+            get_course_and_section("PSCI-131-001", TEST_SEMESTER)
+        _, section, _, section_c = get_or_create_course_and_section("PSCI-131-001", TEST_SEMESTER)
+        self.assertTrue(section_c)
+        self.assertEqual(get_cached_section_id("PSCI-131-001", TEST_SEMESTER), section.id)
+
+    def test_stale_cache_entry_evicted(self):
+        remember_section_id("PSCI-131-003", TEST_SEMESTER, -1)
+        with self.assertRaises(Section.DoesNotExist):
+            get_course_and_section("PSCI-131-003", TEST_SEMESTER)
+        self.assertIsNone(get_cached_section_id("PSCI-131-003", TEST_SEMESTER))
+
+    @override_settings(SECTION_ID_CACHE_SIZE=1)
+    def test_cache_bounded(self):
+        remember_section_id("PSCI-131-001", TEST_SEMESTER, self.s.id)
+        remember_section_id("PSCI-131-002", TEST_SEMESTER, -1)
+        self.assertIsNone(get_cached_section_id("PSCI-131-001", TEST_SEMESTER))
+        self.assertEqual(get_cached_section_id("PSCI-131-002", TEST_SEMESTER), -1)
+
 
 class CourseSaveAutoPrimaryListingTest(TestCase):
     def test_new(self):
@@ -299,6 +357,255 @@ class SectionHasStatusUpdateTestCase(TestCase):
         self.assertTrue(Section.objects.get(full_code="CIS-120-001").has_status_updates)
 
 
+class SectionLastStatusUpdateTestCase(TestCase):
+    def setUp(self):
+        set_semester()
+        self.course, self.section = create_mock_data("CIS-120-001", TEST_SEMESTER)
+
+    def assertLastStatusUpdate(self, up):
+        section = Section.objects.get(id=self.section.id)
+        self.assertEqual(section.last_status_update, up)
+        self.assertEqual(section.last_status_update_at, up.created_at if up else None)
+        self.assertEqual(section.last_status_update_new_status, up.new_status if up else None)
+
+    def test_no_updates(self):
+        self.assertLastStatusUpdate(None)
+
+    def test_two_updates(self):
+        record_update(self.section, TEST_SEMESTER, "C", "O", True, "JSON")
+        self.assertEqual(self.section.last_status_update_new_status, "O")
+        up = record_update(self.section, TEST_SEMESTER, "O", "C", True, "JSON")
+        self.assertLastStatusUpdate(up)
+
+    def test_out_of_order_update(self):
+        up = record_update(self.section, TEST_SEMESTER, "C", "O", True, "JSON")
+        record_update(
+            self.section,
+            TEST_SEMESTER,
+            "O",
+            "C",
+            True,
+            "JSON",
+            created_at=up.created_at - timedelta(days=1),
+        )
+        self.assertLastStatusUpdate(up)
+
+    def test_status_update_save(self):
+        up = StatusUpdate(section=self.section, old_status="C", new_status="O", alert_sent=False)
+        up.save()
+        self.assertLastStatusUpdate(up)
+        self.assertEqual(self.section.last_status_update_new_status, "O")
+        earlier = StatusUpdate(
+            section=self.section,
+            old_status="O",
+            new_status="C",
+            alert_sent=False,
+            created_at=up.created_at - timedelta(days=1),
+        )
+        earlier.save()
+        self.assertLastStatusUpdate(up)
+
+        up.created_at -= timedelta(days=2)  # now earlier than the other update
+        up.save()
+        self.assertLastStatusUpdate(earlier)
+        self.assertEqual(self.section.last_status_update_new_status, "C")
+
+    def test_backfill(self):
+        up = record_update(self.section, TEST_SEMESTER, "C", "O", True, "JSON")
+        Section.objects.update(
+            last_status_update=None, last_status_update_at=None, last_status_update_new_status=None
+        )
+        self.assertEqual(find_inconsistent_last_status_updates(), [self.section.id])
+        with self.assertRaises(CommandError):
+            call_command("backfill_last_status_updates", "--check")
+        call_command("backfill_last_status_updates", "--semesters", TEST_SEMESTER)
+        self.assertLastStatusUpdate(up)
+        self.assertEqual(find_inconsistent_last_status_updates(), [])
+        call_command("backfill_last_status_updates", "--check")
+
+    def test_deleted_update(self):
+        up1 = record_update(self.section, TEST_SEMESTER, "C", "O", True, "JSON")
+        up2 = record_update(self.section, TEST_SEMESTER, "O", "C", True, "JSON")
+        up2.delete()
+        self.assertEqual(find_inconsistent_last_status_updates([TEST_SEMESTER]), [])
+        self.assertLastStatusUpdate(up1)
+        StatusUpdate.objects.all().delete()
+        self.assertLastStatusUpdate(None)
+
+
+@patch("alert.tasks.schedule_section_demand_change")
+class StatusUpdateBulkRecordTestCase(TestCase):
+    def setUp(self):
+        set_semester()
+        _, self.section = create_mock_data("CIS-120-001", TEST_SEMESTER)
+        _, self.section2 = create_mock_data("CIS-160-001", TEST_SEMESTER)
+        self.add_drop = AddDropPeriod.objects.get(semester=TEST_SEMESTER)
+
+    def make_update(self, section, old_status, new_status, created_at=None):
+        return StatusUpdate(
+            section=section,
+            old_status=old_status,
+            new_status=new_status,
+            alert_sent=False,
+            created_at=created_at or timezone.now(),
+        )
+
+    def test_save_single_write(self, mock_demand_change):
+        # INSERT + last_status_update UPDATE + has_status_updates UPDATE
+        with self.assertNumQueries(3):
+            self.make_update(self.section, "C", "O").save(add_drop_period=self.add_drop)
+        self.assertTrue(Section.objects.get(id=self.section.id).has_status_updates)
+        with self.assertNumQueries(2):  # INSERT + last_status_update UPDATE
+            up = self.make_update(self.section, "O", "C")
+            up.save(add_drop_period=self.add_drop)
+        self.assertEqual(
+            StatusUpdate.objects.get(id=up.id).percent_through_add_drop_period,
+            self.add_drop.get_percent_through_add_drop(up.created_at),
+        )
+        self.assertEqual(2, mock_demand_change.call_count)
+
+    def test_bulk_record(self, mock_demand_change):
+        now = timezone.now()
+        updates = [
+            self.make_update(self.section, "C", "O", now - timedelta(minutes=2)),
+            self.make_update(self.section2, "O", "C", now - timedelta(minutes=1)),
+            self.make_update(self.section, "O", "C", now),
+        ]
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertNumQueries(5):  # 3 writes, plus SAVEPOINT and RELEASE
+                created = StatusUpdate.bulk_record(
+                    updates, add_drop_periods={TEST_SEMESTER: self.add_drop}
+                )
+        self.assertEqual(3, len(created))
+        self.assertEqual(3, StatusUpdate.objects.count())
+        for up in StatusUpdate.objects.all():
+            self.assertEqual(
+                up.percent_through_add_drop_period,
+                self.add_drop.get_percent_through_add_drop(up.created_at),
+            )
+        section = Section.objects.get(id=self.section.id)
+        self.assertTrue(section.has_status_updates)
+        self.assertEqual(section.last_status_update_id, updates[2].id)
+        self.assertEqual(section.last_status_update_new_status, "C")
+        section2 = Section.objects.get(id=self.section2.id)
+        self.assertTrue(section2.has_status_updates)
+        self.assertEqual(section2.last_status_update_id, updates[1].id)
+        mock_demand_change.assert_called_once_with(self.section.id, now, TEST_SEMESTER)
+
+    def test_bulk_record_empty(self, mock_demand_change):
+        with self.assertNumQueries(0):
+            self.assertEqual([], StatusUpdate.bulk_record([]))
+
+
+@patch("alert.tasks.schedule_section_demand_change")
+class StatusUpdateRequestBodyTestCase(TestCase):
+    def setUp(self):
+        set_semester()
+        _, self.section = create_mock_data("CIS-120-001", TEST_SEMESTER)
+        self.add_drop = AddDropPeriod.objects.get(semester=TEST_SEMESTER)
+
+    def make_update(self, request_body, created_at=None):
+        return StatusUpdate(
+            section=self.section,
+            old_status="C",
+            new_status="O",
+            alert_sent=False,
+            request_body=request_body,
+            created_at=created_at or timezone.now(),
+        )
+
+    @override_settings(STATUS_UPDATE_COMPACT_REQUEST_BODIES=True)
+    def test_save_compacts_and_dedups(self, mock_demand_change):
+        body = '{"status": "O", "section_id_normalized": "CIS-120-001"}'
+        first = self.make_update(body)
+        first.save(add_drop_period=self.add_drop)
+        self.make_update(body).save(add_drop_period=self.add_drop)
+        StatusUpdate.bulk_record(
+            [self.make_update(body), self.make_update("{}")],
+            add_drop_periods={TEST_SEMESTER: self.add_drop},
+        )
+        self.assertEqual(2, StatusUpdateRequestBody.objects.count())
+        self.assertFalse(StatusUpdate.objects.exclude(request_body="").exists())
+        up = StatusUpdate.objects.get(id=first.id)
+        self.assertEqual("", up.request_body)
+        self.assertEqual(body, up.raw_request_body)
+
+    def test_not_compacted_by_default(self, mock_demand_change):
+        up = self.make_update("{}")
+        up.save(add_drop_period=self.add_drop)
+        self.assertEqual("{}", StatusUpdate.objects.get(id=up.id).request_body)
+        self.assertEqual("{}", up.raw_request_body)
+        self.assertFalse(StatusUpdateRequestBody.objects.exists())
+
+    def test_compact_command(self, mock_demand_change):
+        now = timezone.now()
+        old = self.make_update("old", now - timedelta(days=30))
+        old.save(add_drop_period=self.add_drop)
+        ups = [self.make_update(body) for body in ["a", "b", "a", ""]]
+        for up in ups:
+            up.save(add_drop_period=self.add_drop)
+        call_command("compact_status_updates", semesters=TEST_SEMESTER, batch_size=2)
+        self.assertFalse(StatusUpdate.objects.exclude(request_body="").exists())
+        self.assertEqual(3, StatusUpdateRequestBody.objects.count())
+        self.assertEqual(
+            ["a", "b", "a", ""],
+            [StatusUpdate.objects.get(id=up.id).raw_request_body for up in ups],
+        )
+
+        call_command("compact_status_updates", semesters=TEST_SEMESTER, drop_older_than=7)
+        self.assertEqual("", StatusUpdate.objects.get(id=old.id).raw_request_body)
+        self.assertEqual(2, StatusUpdateRequestBody.objects.count())  # "old" was deleted
+
+    def get_store_lock_modes(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT mode FROM pg_locks WHERE locktype = 'advisory' AND objid = %s "
+                "AND pid = pg_backend_pid()",
+                [StatusUpdateRequestBody.STORE_LOCK_KEY],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def test_store_holds_lock_until_commit(self, mock_demand_change):
+        self.assertEqual([], self.get_store_lock_modes())
+        StatusUpdateRequestBody.store(["a"])
+        # Held (shared) for the rest of the transaction, so delete_unreferenced waits for
+        # the status updates referencing the stored bodies to be committed
+        self.assertEqual(["ShareLock"], self.get_store_lock_modes())
+        self.assertEqual(1, StatusUpdateRequestBody.delete_unreferenced())
+        self.assertEqual({"ShareLock", "ExclusiveLock"}, set(self.get_store_lock_modes()))
+
+
+@patch("alert.tasks.schedule_section_demand_change")
+class SemesterColumnTestCase(TestCase):
+    def setUp(self):
+        set_semester()
+        _, self.section = create_mock_data("CIS-120-001", TEST_SEMESTER)
+        self.add_drop = AddDropPeriod.objects.get(semester=TEST_SEMESTER)
+
+    def make_update(self):
+        return StatusUpdate(section=self.section, old_status="C", new_status="O", alert_sent=False)
+
+    def test_set_on_save(self, mock_demand_change):
+        self.make_update().save()
+        StatusUpdate.bulk_record(
+            [self.make_update()], add_drop_periods={TEST_SEMESTER: self.add_drop}
+        )
+        self.assertEqual(
+            [TEST_SEMESTER, TEST_SEMESTER],
+            list(StatusUpdate.objects.values_list("semester", flat=True)),
+        )
+
+    def test_backfill_command(self, mock_demand_change):
+        up = self.make_update()
+        up.save()
+        StatusUpdate.objects.filter(id=up.id).update(semester="")
+        with self.assertRaises(CommandError):
+            call_command("backfill_semester_columns", check=True)
+        call_command("backfill_semester_columns", semesters=TEST_SEMESTER)
+        self.assertEqual(TEST_SEMESTER, StatusUpdate.objects.get(id=up.id).semester)
+        call_command("backfill_semester_columns", check=True)
+
+
 class CrosslistingTestCase(TestCase):
     def setUp(self):
         self.anch, _ = create_mock_data("ANCH-027-401", TEST_SEMESTER)
@@ -1,14 +1,28 @@
+import math
+import random
+from unittest.mock import patch
+
+import scipy.stats as stats
+from django.db import connection
 from django.db.models.signals import post_save
+from django.test import override_settings
 from django.test.testcases import TestCase
+from django.test.utils import CaptureQueriesContext
 from options.models import Option
 
 from alert.management.commands.recomputestats import (
     deduplicate_status_updates,
+    recompute_demand_distribution_estimates,
     recompute_precomputed_fields,
 )
-from alert.models import AddDropPeriod
+from alert.models import AddDropPeriod, PcaDemandDistributionEstimate, Registration
 from courses.models import Building, Course, Meeting, Room, Section, StatusUpdate
-from courses.util import get_or_create_course_and_section, invalidate_current_semester_cache
+from courses.util import (
+    get_or_create_add_drop_period,
+    get_or_create_course_and_section,
+    invalidate_current_semester_cache,
+    record_update,
+)
 from tests.courses.util import create_mock_data
 
 
@@ -147,3 +161,127 @@ class RecomputePrecomputedFieldsTestCase(TestCase):
 
         self.assertEquals(Course.objects.get(id=self.cis_120_old.id).num_activities, 1)
         self.assertEquals(Section.objects.get(id=self.cis_120_001_old.id).num_meetings, 3)
+
+
+class ScanDemandExtrema:
+    """
+    Finds the lowest / highest demand sections with a scan over all sections on each query
+    (as recompute_demand_distribution_estimates originally did), for comparison with
+    recomputestats.DemandExtrema.
+    """
+
+    def __init__(self, demands):
+        self.demands = demands
+
+    def update(self, section_id):
+        pass
+
+    def lowest(self):
+        return min(self.demands.keys(), key=lambda x: self.demands[x])
+
+    def highest(self):
+        return max(self.demands.keys(), key=lambda x: self.demands[x])
+
+
+class DemandDistributionEstimatesTestCase(TestCase):
+    def setUp(self):
+        set_semester()
+        rand = random.Random(0)
+        adp = get_or_create_add_drop_period(TEST_SEMESTER)
+        start, duration = adp.estimated_start, adp.estimated_end - adp.estimated_start
+
+        def to_date(percent):
+            return start + percent * duration
+
+        sections = []
+        for i in range(12):
+            _, section = create_mock_data(f"CIS-{1000 + i}-001", TEST_SEMESTER)
+            section.capacity = rand.choice([10, 20, 40])  # so that demands tie often
+            section.save()
+            sections.append(section)
+            old_status, new_status = rand.choice([("O", "C"), ("C", "O")])
+            for percent in sorted(rand.uniform(0, 1) for _ in range(4)):
+                record_update(
+                    section, TEST_SEMESTER, old_status, new_status, False, dict(), to_date(percent)
+                )
+                old_status, new_status = new_status, old_status
+        for _ in range(60):
+            registration = Registration(section=rand.choice(sections))
+            registration.save()
+            created_at = rand.uniform(0, 1)
+            registration.created_at = to_date(created_at)
+            deactivation = rand.choice([None, "notification_sent", "cancelled"])
+            if deactivation:
+                setattr(registration, deactivation, True)
+                setattr(registration, f"{deactivation}_at", to_date(rand.uniform(created_at, 1)))
+            registration.save()
+
+    def get_estimates(self, **kwargs):
+        recompute_demand_distribution_estimates(semesters=TEST_SEMESTER, **kwargs)
+        return list(
+            PcaDemandDistributionEstimate.objects.filter(semester=TEST_SEMESTER)
+            .order_by("created_at", "id")
+            .values_list(
+                "created_at",
+                "highest_demand_section_id",
+                "highest_demand_section_volume",
+                "lowest_demand_section_id",
+                "lowest_demand_section_volume",
+                "csrdv_frac_zero",
+                "csprdv_lognorm_param_shape",
+                "csprdv_lognorm_param_loc",
+                "csprdv_lognorm_param_scale",
+                "percent_through_add_drop_period",
+                "in_add_drop_period",
+            )
+        )
+
+    def test_same_estimates_as_scan(self):
+        estimates = self.get_estimates()
+        with patch("alert.management.commands.recomputestats.DemandExtrema", ScanDemandExtrema):
+            scan_estimates = self.get_estimates()
+        self.assertGreater(len(estimates), 10)
+        self.assertGreater(len({estimate[1] for estimate in estimates}), 1)
+        self.assertEqual(scan_estimates, estimates)
+
+    def test_same_lognorm_params_as_full_fit(self):
+        estimates = self.get_estimates()
+        lognorm_fit = stats.lognorm.fit
+        with override_settings(DEMAND_DISTRIBUTION_FULL_LOGNORM_FIT=True), patch(
+            "alert.demand_fit.stats.lognorm.fit", lambda values: lognorm_fit(values, floc=0)
+        ):
+            full_fit_estimates = self.get_estimates()
+        self.assertEqual(len(full_fit_estimates), len(estimates))
+        self.assertTrue(any(estimate[6] is not None for estimate in estimates))
+        for estimate, full_fit_estimate in zip(estimates, full_fit_estimates):
+            self.assertEqual(full_fit_estimate[:6], estimate[:6])
+            if estimate[6] is None:
+                # Fewer than 2 distinct positive demands (the full fit has shape 0)
+                self.assertTrue(full_fit_estimate[6] is None or full_fit_estimate[6] < 1e-7)
+                continue
+            for param, full_fit_param in zip(estimate[6:], full_fit_estimate[6:]):
+                self.assertTrue(math.isclose(param, full_fit_param, rel_tol=1e-9, abs_tol=1e-12))
+
+    def test_chunked_bulk_create(self):
+        estimates = self.get_estimates()
+        with CaptureQueriesContext(connection) as captured:
+            chunked_estimates = self.get_estimates(chunk_size=4)
+        self.assertEqual(estimates, chunked_estimates)
+        inserts = [
+            query
+            for query in captured.captured_queries
+            if query["sql"].startswith(
+                f'INSERT INTO "{PcaDemandDistributionEstimate._meta.db_table}"'
+            )
+        ]
+        self.assertEqual(math.ceil(len(estimates) / 4), len(inserts))
+
+        adp = get_or_create_add_drop_period(TEST_SEMESTER)
+        for estimate in PcaDemandDistributionEstimate.objects.filter(semester=TEST_SEMESTER):
+            percent_through, in_add_drop_period = (
+                estimate.percent_through_add_drop_period,
+                estimate.in_add_drop_period,
+            )
+            estimate.set_add_drop_fields(adp)
+            self.assertEqual(estimate.percent_through_add_drop_period, percent_through)
+            self.assertEqual(estimate.in_add_drop_period, in_add_drop_period)